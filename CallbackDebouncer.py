@@ -0,0 +1,78 @@
+import asyncio
+from collections import OrderedDict
+from typing import Awaitable, Callable, Coroutine, Optional, Tuple
+
+from telegram import CallbackQuery, InlineKeyboardMarkup
+from telegram.error import BadRequest, RetryAfter
+
+
+class CallbackDebouncer:
+    """Collapses bursts of callback queries on the same message.
+
+    The first query is handled right away. Queries arriving while it is handled replace each
+    other, are answered immediately, and only the last one is handled afterwards.
+    """
+    __slots__ = ["delay", "max_messages", "_pending", "_workers", "_texts"]
+    delay: float
+    max_messages: int
+    _pending: dict[Tuple[int, int], Tuple[CallbackQuery, Callable[[CallbackQuery], Awaitable[None]]]]
+    _workers: dict[Tuple[int, int], asyncio.Task]
+    _texts: OrderedDict[Tuple[int, int], str]
+
+    def __init__(self, delay: float = 0.3, max_messages: int = 4096):
+        self.delay = delay
+        self.max_messages = max_messages
+        self._pending = {}
+        self._workers = {}
+        self._texts = OrderedDict()
+
+    async def submit(
+            self,
+            query: CallbackQuery,
+            handle: Callable[[CallbackQuery], Awaitable[None]],
+            create_task: Callable[[Coroutine], asyncio.Task] = asyncio.create_task
+    ) -> None:
+        key: Tuple[int, int] = (query.message.chat_id, query.message.message_id)
+        previous: Optional[Tuple[CallbackQuery, Callable]] = self._pending.get(key)
+        self._pending[key] = (query, handle)
+        if key not in self._workers:
+            self._workers[key] = create_task(self._work(key))
+        if previous is not None:
+            await previous[0].answer()
+
+    async def _work(self, key: Tuple[int, int]) -> None:
+        try:
+            query, handle = self._pending.pop(key)
+            await handle(query)
+            while key in self._pending:
+                # Give the user a moment to finish tapping before handling the latest query
+                await asyncio.sleep(self.delay)
+                query, handle = self._pending.pop(key)
+                await handle(query)
+        finally:
+            del self._workers[key]
+
+    async def edit(self, query: CallbackQuery, text: str, reply_markup: InlineKeyboardMarkup) -> None:
+        key: Tuple[int, int] = (query.message.chat_id, query.message.message_id)
+        if self._texts.get(key) != text:
+            while True:
+                try:
+                    await query.edit_message_text(text, reply_markup=reply_markup)
+                    break
+                except RetryAfter as error:
+                    await asyncio.sleep(error.retry_after)
+                except BadRequest as error:
+                    if "not modified" not in error.message:
+                        raise
+                    break
+
+            self._texts[key] = text
+            self._texts.move_to_end(key)
+            if len(self._texts) > self.max_messages:
+                self._texts.popitem(last=False)
+
+        try:
+            await query.answer()
+        except BadRequest:
+            # The query may have expired while we were waiting for retry_after
+            pass
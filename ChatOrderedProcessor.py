@@ -0,0 +1,56 @@
+import asyncio
+from typing import Any, Awaitable, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Processes updates concurrently, except that the updates of one chat are handled in the order they arrived.
+
+    Updates without a chat, like inline queries, are not ordered at all. An update waiting for the previous one of
+    its chat does not take one of the max_concurrent_updates slots, so one busy chat can't hold up the others.
+    """
+    __slots__ = ["_tails"]
+    # The last update of every chat that is being handled or waiting to be, done once it is handled
+    _tails: dict[int, asyncio.Future]
+
+    def __init__(self, max_concurrent_updates: int):
+        super().__init__(max_concurrent_updates)
+        self._tails = {}
+
+    # Marked final, but do_process_update() runs with a slot already taken, too late to wait for the chat there.
+    # Checked against python-telegram-bot 20.7, pyproject.toml pins that version for it.
+    async def process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        chat_id: Optional[int] = None
+        if isinstance(update, Update) and update.effective_chat is not None:
+            chat_id = update.effective_chat.id
+        if chat_id is None:
+            await super().process_update(update, coroutine)
+            return
+
+        previous: Optional[asyncio.Future] = self._tails.get(chat_id)
+        done: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._tails[chat_id] = done
+        try:
+            if previous is not None:
+                # wait() neither raises the previous update's error nor cancels it along with this one
+                await asyncio.wait([previous])
+            await super().process_update(update, coroutine)
+        except asyncio.CancelledError:
+            if asyncio.iscoroutine(coroutine):
+                coroutine.close()
+            raise
+        finally:
+            done.set_result(None)
+            if self._tails.get(chat_id) is done:
+                del self._tails[chat_id]
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
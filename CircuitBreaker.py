@@ -0,0 +1,45 @@
+import time
+
+
+class CircuitBreaker:
+    """Stops calling a failing upstream for a while.
+
+    After ``failure_threshold`` consecutive failures the circuit opens and ``allow()`` returns False
+    for ``reset_timeout`` seconds. Then a single trial call is let through: success closes the
+    circuit again, failure keeps it open for another ``reset_timeout``.
+    """
+    __slots__ = ["failure_threshold", "reset_timeout", "failures", "opened_at", "_trial_running"]
+    failure_threshold: int
+    reset_timeout: float
+    failures: int
+    opened_at: float
+    _trial_running: bool
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_running = False
+
+    @property
+    def is_open(self) -> bool:
+        return self.failures >= self.failure_threshold
+
+    def allow(self) -> bool:
+        if not self.is_open:
+            return True
+        if self._trial_running or time.monotonic() - self.opened_at < self.reset_timeout:
+            return False
+        self._trial_running = True
+        return True
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self._trial_running = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._trial_running = False
+        if self.is_open:
+            self.opened_at = time.monotonic()
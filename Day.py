@@ -1,4 +1,5 @@
-from typing import Optional
+from collections import OrderedDict
+from typing import Optional, Tuple
 from datetime import date
 from Lesson import Lesson
 
@@ -14,56 +15,64 @@ class Day:
         self.day_date = our_date
         self.week_number = data["week_number"]
 
-        self.first_subgroup = []
-        for lesson_data in data["first_subgroup"]:
-            self.first_subgroup.append(Lesson(lesson_data))
-
+        self.first_subgroup = [Lesson(lesson_data) for lesson_data in data["first_subgroup"]]
         self.second_subgroup = None
         if data["second_subgroup"]:
-            self.second_subgroup = []
-            for lesson_data in data["second_subgroup"]:
-                self.second_subgroup.append(Lesson(lesson_data))
+            self.second_subgroup = [Lesson(lesson_data) for lesson_data in data["second_subgroup"]]
 
     def get_telegram_message(self, group_name: Optional[str]) -> str:
+        day_month: str = f'{self.day_date.day:02}.{self.day_date.month:02}'
+        group_suffix: str = f', {group_name}' if group_name else ''
         if not len(self.first_subgroup) and (not self.second_subgroup or not len(self.second_subgroup)):
-            result: str = f'{self.day_date.strftime("%d.%m")} ({self.week_number}'
-            if group_name:
-                result += f', {group_name}'
-            result += ') ніяких пар немає!'
-            return result
-        result: str = f'<b>Пари на {self.day_date.strftime("%d.%m")} '
-        result += f'({self.day_date.strftime("%A").capitalize()} {self.week_number}'
-        if group_name:
-            result += f', {group_name}'
-        result += '):</b>\n\n'
-        result += '<b>Перша підгрупа:</b>\n'
-
-        nums_dict: dict[str, str] = {
-            "0": "0️⃣",
-            "1": "1️⃣",
-            "2": "2️⃣",
-            "3": "3️⃣",
-            "4": "4️⃣",
-            "5": "5️⃣",
-            "6": "6️⃣",
-            "7": "7️⃣",
-            "8": "8️⃣",
-            "9": "9️⃣"
-        }
+            return f'{day_month} ({self.week_number}{group_suffix}) ніяких пар немає!'
 
+        parts: list[str] = [
+            f'<b>Пари на {day_month} ({WEEKDAY_NAMES[self.day_date.weekday()]} {self.week_number}'
+            f'{group_suffix}):</b>\n\n<b>Перша підгрупа:</b>\n'
+        ]
         lesson: Lesson
-        for index, lesson in enumerate(self.first_subgroup):
-            for num in str(index + 1):
-                result += nums_dict[num]
-            result += f' | {lesson.get_telegram_message()}\n'
+        for index, lesson in enumerate(self.first_subgroup, 1):
+            parts.append(f'{lesson_number_emoji(index)} | {lesson.get_telegram_message()}\n')
+
+        if self.second_subgroup is not None:
+            parts.append('\n<b>Друга підгрупа:</b>\n')
+            for index, lesson in enumerate(self.second_subgroup, 1):
+                parts.append(f'{lesson_number_emoji(index)} | {lesson.get_telegram_message()}\n')
+
+        return ''.join(parts)
+
+
+def lesson_number_emoji(number: int) -> str:
+    if number < len(_LESSON_NUMBER_EMOJIS):
+        return _LESSON_NUMBER_EMOJIS[number]
+    return ''.join(_DIGIT_EMOJIS[int(digit)] for digit in str(number))
 
-        if self.second_subgroup is None:
-            return result
 
-        result += '\n<b>Друга підгрупа:</b>\n'
-        for index, lesson in enumerate(self.second_subgroup):
-            for num in str(index + 1):
-                result += nums_dict[num]
-            result += f' | {lesson.get_telegram_message()}\n'
+def render_day(data: dict, our_date: date, group_name: Optional[str], content_hash: bytes) -> str:
+    """Return Day(data, our_date).get_telegram_message(group_name), memoized.
 
+    content_hash must identify the upstream payload ``data`` was decoded from.
+    """
+    key: Tuple[bytes, str, date, Optional[str]] = (content_hash, data["group"]["code"], our_date, group_name)
+    result: Optional[str] = _rendered.get(key)
+    if result is not None:
+        _rendered.move_to_end(key)
         return result
+
+    result = Day(data, our_date).get_telegram_message(group_name)
+    _rendered[key] = result
+    if len(_rendered) > RENDER_CACHE_SIZE:
+        _rendered.popitem(last=False)
+    return result
+
+
+# Monday first, like date.weekday(). Formatting with strftime("%A") needed the uk_UA locale set for the whole process.
+WEEKDAY_NAMES: Tuple[str, ...] = ("Понеділок", "Вівторок", "Середа", "Четвер", "П'ятниця", "Субота", "Неділя")
+
+_DIGIT_EMOJIS: Tuple[str, ...] = ("0️⃣", "1️⃣", "2️⃣", "3️⃣", "4️⃣", "5️⃣", "6️⃣", "7️⃣", "8️⃣", "9️⃣")
+_LESSON_NUMBER_EMOJIS: Tuple[str, ...] = tuple(
+    ''.join(_DIGIT_EMOJIS[int(digit)] for digit in str(number)) for number in range(20)
+)
+
+RENDER_CACHE_SIZE: int = 2048
+_rendered: OrderedDict[Tuple[bytes, str, date, Optional[str]], str] = OrderedDict()
@@ -0,0 +1,121 @@
+import asyncio
+import html
+import json
+import logging
+import os
+import traceback
+from typing import Optional, Tuple
+
+from telegram import Bot, Update
+from telegram.constants import MessageLimit, ParseMode
+from telegram.error import TelegramError
+
+logger = logging.getLogger(__name__)
+
+# Frames from this directory are the bot's own code, the innermost of them locates an error
+SOURCE_DIRECTORY: str = os.path.dirname(os.path.abspath(__file__))
+
+# Limits that keep a digest within one message
+MAX_SAMPLES: int = 3
+MAX_GROUPS: int = 10
+MAX_SAMPLE_LENGTH: int = 600
+MAX_ERROR_LENGTH: int = 200
+
+
+class ErrorGroup:
+    """Exceptions of one type raised at one place."""
+    __slots__ = ["error_type", "location", "count", "message", "sample"]
+    error_type: str
+    location: str
+    count: int
+    message: str
+    sample: str
+
+    def __init__(self, error: BaseException, location: str, update: object):
+        self.error_type = type(error).__name__
+        self.location = location
+        self.count = 0
+        self.message = str(error)[:MAX_ERROR_LENGTH]
+        # Only the first update of a group is kept, serializing every one of them is what made outages expensive
+        sample: object = update.to_dict() if isinstance(update, Update) else str(update)
+        self.sample = json.dumps(sample, indent=1, ensure_ascii=False)[:MAX_SAMPLE_LENGTH]
+
+
+def fingerprint(error: BaseException) -> Tuple[str, str]:
+    """Return the type of the error and where it was raised, preferring the bot's own code to libraries."""
+    frames: traceback.StackSummary = traceback.extract_tb(error.__traceback__)
+    frame: Optional[traceback.FrameSummary] = None
+    for candidate in reversed(frames):
+        if candidate.filename.startswith(SOURCE_DIRECTORY):
+            frame = candidate
+            break
+    if frame is None and frames:
+        frame = frames[-1]
+    if frame is None:
+        return type(error).__name__, "unknown"
+    return type(error).__name__, f"{os.path.basename(frame.filename)}:{frame.lineno} in {frame.name}"
+
+
+class ErrorReporter:
+    """Collects exceptions over a window and sends the developer one digest per window."""
+    __slots__ = ["chat_id", "window", "_groups", "_task"]
+    chat_id: int
+    window: float
+    _groups: dict[Tuple[str, str], ErrorGroup]
+    _task: Optional[asyncio.Task]
+
+    def __init__(self, chat_id: int, window: float = 60.0):
+        self.chat_id = chat_id
+        self.window = window
+        self._groups = {}
+        self._task = None
+
+    def record(self, bot: Bot, error: BaseException, update: object) -> None:
+        """Count the error, the digest is sent in the background once the window is over."""
+        key: Tuple[str, str] = fingerprint(error)
+        group: Optional[ErrorGroup] = self._groups.get(key)
+        if group is None:
+            group = self._groups[key] = ErrorGroup(error, key[1], update)
+        group.count += 1
+        if self._task is None:
+            self._task = asyncio.create_task(self._report_later(bot))
+
+    def cancel(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _report_later(self, bot: Bot) -> None:
+        try:
+            await asyncio.sleep(self.window)
+        finally:
+            self._task = None
+        groups: list[ErrorGroup] = sorted(self._groups.values(), key=lambda group: group.count, reverse=True)
+        self._groups = {}
+        try:
+            await bot.send_message(chat_id=self.chat_id, text=self.digest(groups), parse_mode=ParseMode.HTML)
+        except TelegramError as error:
+            logger.warning("Could not send the error digest: %s", error)
+
+    def digest(self, groups: list[ErrorGroup]) -> str:
+        text: str = self._format(groups, MAX_SAMPLES)
+        if len(text) > MessageLimit.MAX_TEXT_LENGTH:
+            text = self._format(groups, 0)
+        return text
+
+    def _format(self, groups: list[ErrorGroup], samples: int) -> str:
+        total: int = sum(group.count for group in groups)
+        parts: list[str] = [f"<b>{total} exceptions in the last {self.window:g} s</b>\n"]
+        for index, group in enumerate(groups[:MAX_GROUPS]):
+            parts.append(
+                f"\n<b>{group.count}×</b> <code>{html.escape(group.error_type)}</code> "
+                f"at <code>{html.escape(group.location)}</code>\n"
+            )
+            if index < samples:
+                parts.append(
+                    f"<pre>{html.escape(group.message, quote=False)}</pre>\n"
+                    f"<pre>{html.escape(group.sample, quote=False)}</pre>\n"
+                )
+        if len(groups) > MAX_GROUPS:
+            parts.append(f"\n…and {len(groups) - MAX_GROUPS} more")
+        return "".join(parts)
@@ -4,7 +4,7 @@ from typing import Tuple
 class Group:
     __slots__ = ["code", "name", "desc"]
     code: str
-    names: str
+    name: str
     desc: str
 
     def __init__(self, data: dict):
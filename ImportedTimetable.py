@@ -0,0 +1,63 @@
+import hashlib
+import json
+import os
+from typing import Optional
+
+
+class ImportedTimetable:
+    """Lessons written by importer.py, one APILesson dict per line, re-read when the file changes. Any dicts with
+    a "group_code" will do, the calendar overrides are read the same way.
+
+    refresh() tells which groups changed, so that whatever is built from the lessons is only updated for them.
+    """
+    __slots__ = ["path", "groups", "_mtime", "_fingerprints"]
+    path: str
+    groups: dict[str, list[dict]]
+    _mtime: Optional[float]
+    _fingerprints: dict[str, str]
+
+    def __init__(self, path: str):
+        self.path = path
+        self.groups = {}
+        self._mtime = None
+        self._fingerprints = {}
+
+    def refresh(self) -> dict[str, list[dict]]:
+        """Re-read the file if it was modified. Returns the lessons of every group that changed, empty if removed.
+
+        Raises ValueError if the file holds something else, the lessons known so far are kept then.
+        """
+        try:
+            mtime: Optional[float] = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self._mtime:
+            return {}
+        self._mtime = mtime
+
+        groups: dict[str, list[dict]] = {}
+        if mtime is not None:
+            with open(self.path, encoding="utf-8") as lessons_file:
+                for number, line in enumerate(lessons_file, 1):
+                    if line.strip():
+                        lesson: dict = json.loads(line)
+                        if "group_code" not in lesson:
+                            # Like a record of the diff importer.py --diff writes, which has only what changed
+                            raise ValueError(f"{self.path}:{number}: no group_code, not the -o output of importer.py?")
+                        groups.setdefault(lesson["group_code"], []).append(lesson)
+
+        fingerprints: dict[str, str] = {
+            group_code: hashlib.blake2b(
+                json.dumps(lessons, ensure_ascii=False, sort_keys=True).encode(),
+                digest_size=16
+            ).hexdigest()
+            for group_code, lessons in groups.items()
+        }
+        changed: dict[str, list[dict]] = {
+            group_code: groups.get(group_code, [])
+            for group_code in fingerprints.keys() | self._fingerprints.keys()
+            if fingerprints.get(group_code) != self._fingerprints.get(group_code)
+        }
+        self.groups = groups
+        self._fingerprints = fingerprints
+        return changed
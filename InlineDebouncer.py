@@ -0,0 +1,56 @@
+import asyncio
+from typing import Awaitable, Callable, Coroutine
+
+from telegram import InlineQuery
+from telegram.error import BadRequest
+
+
+class InlineDebouncer:
+    """Handles only the last inline query of every user.
+
+    Inline queries arrive on every keystroke. Each one waits for a moment first, and a newer query
+    of the same user cancels it, whether it is still waiting or already being handled.
+    """
+    __slots__ = ["delay", "superseded", "_tasks", "_cancelled"]
+    delay: float
+    superseded: int
+    _tasks: dict[int, asyncio.Task]
+    # Tasks cancelled by a newer query, any other cancellation, like on shutdown, is passed on
+    _cancelled: set[asyncio.Task]
+
+    def __init__(self, delay: float = 0.4):
+        self.delay = delay
+        self.superseded = 0
+        self._tasks = {}
+        self._cancelled = set()
+
+    async def submit(
+            self,
+            query: InlineQuery,
+            handle: Callable[[InlineQuery], Awaitable[None]],
+            create_task: Callable[[Coroutine], asyncio.Task] = asyncio.create_task
+    ) -> None:
+        user_id: int = query.from_user.id
+        previous: asyncio.Task = self._tasks.get(user_id)
+        if previous is not None:
+            if previous.cancel():
+                # A task cancelled before it started never runs _work(), so it's forgotten once done instead
+                self._cancelled.add(previous)
+                previous.add_done_callback(self._cancelled.discard)
+            self.superseded += 1
+        self._tasks[user_id] = create_task(self._work(user_id, query, handle))
+
+    async def _work(self, user_id: int, query: InlineQuery, handle: Callable[[InlineQuery], Awaitable[None]]) -> None:
+        try:
+            await asyncio.sleep(self.delay)
+            await handle(query)
+        except asyncio.CancelledError:
+            # Superseded, Telegram only shows the answer to the latest query anyway
+            if asyncio.current_task() not in self._cancelled:
+                raise
+        except BadRequest as error:
+            if "query is too old" not in error.message:
+                raise
+        finally:
+            if self._tasks.get(user_id) is asyncio.current_task():
+                del self._tasks[user_id]
@@ -1,9 +1,18 @@
-import re
+import sys
+from functools import lru_cache
 from typing import Tuple
-from datetime import datetime, time, timedelta
+from datetime import time, timedelta
 from Teacher import Teacher
 import pytz
 
+TIMEZONE = pytz.timezone('Europe/Kiev')
+
+LESSON_TYPES: dict[str, str] = {
+    "lecture": "Лекція",
+    "practical": "Практична",
+    "laboratory": "Лабораторна"
+}
+
 
 class Lesson:
     __slots__ = ["local_id", "name", "lesson_type", "teachers", "comment", "place", "begin_time", "duration", "canceled"]
@@ -19,52 +28,42 @@ class Lesson:
 
     def __init__(self, data: dict):
         self.local_id = data["local_id"]
-
-        self.name = data["names"][0]
-
-        match data["lesson_type"]:
-            case "lecture":
-                self.lesson_type = "Лекція"
-            case "practical":
-                self.lesson_type = "Практична"
-            case "laboratory":
-                self.lesson_type = "Лабораторна"
-            case _:
-                self.lesson_type = data["lesson_type"]
-
-        self.teachers = []
-        for teacher_data in data["lecturers"]:
-            self.teachers.append(Teacher(teacher_data))
+        self.name = sys.intern(data["names"][0])
+        self.lesson_type = LESSON_TYPES.get(data["lesson_type"], data["lesson_type"])
+        self.teachers = [Teacher.from_data(teacher_data) for teacher_data in data["lecturers"]]
         self.comment = data["comment"]
-        self.place = data["place"]
-
-        minutes_since_midnight: int = int(data["time"])
-        self.begin_time = time(
-            hour=(minutes_since_midnight // 60),
-            minute=(minutes_since_midnight % 60),
-            tzinfo=pytz.timezone('Europe/Kiev')
-        )
-
-        self.duration = timedelta(minutes=int(data["duration"]))
+        self.place = sys.intern(data["place"])
+        self.begin_time = _begin_time(int(data["time"]))
+        self.duration = _duration(int(data["duration"]))
         self.canceled = data["canceled"]
 
     def get_telegram_message(self) -> str:
-        result: str = f'{self.begin_time.strftime("%H:%M")} - '
-        result += (datetime.combine(datetime.now(), self.begin_time) + self.duration).strftime("%H:%M")
-        result += f' | '
-        if self.canceled:
-            result += '<s>'
-        result += f'{self.name} | {self.lesson_type} | {self.teachers[0]} | '
-        if re.match(r'^https:\/\/', self.place):
-            result += f'<a href="{self.place}">Посилання</a>'
+        end_minutes: int = (
+            self.begin_time.hour * 60 + self.begin_time.minute + self.duration.seconds // 60
+        ) % (24 * 60)
+        if self.place.startswith('https://'):
+            place: str = f'<a href="{self.place}">Посилання</a>'
         else:
-            map_url: str = 'https://www.google.com/maps/d/u/4/edit?mid=1q08ygA-JJCaMu0LrBQxZiJ1fxVq8KD0&usp=sharing'
-            result += f'<a href="{map_url}">{self.place}</a>'
+            place: str = f'<a href="{MAP_URL}">{self.place}</a>'
+        result: str = (
+            f'{self.begin_time.hour:02}:{self.begin_time.minute:02} - {end_minutes // 60:02}:{end_minutes % 60:02} | '
+            f'{"<s>" if self.canceled else ""}{self.name} | {self.lesson_type} | {self.teachers[0]} | {place}'
+            f'{"</s>" if self.canceled else ""}'
+        )
+        if len(self.comment) != 0:
+            return f'{result} // {self.comment}'
+        return result
 
-        if self.canceled:
-            result += '</s>'
 
-        if len(self.comment) != 0:
-            result += f' // {self.comment}'
+MAP_URL: str = 'https://www.google.com/maps/d/u/4/edit?mid=1q08ygA-JJCaMu0LrBQxZiJ1fxVq8KD0&usp=sharing'
 
-        return result
+
+# Lessons only ever start and last for a handful of distinct times, so the objects are shared
+@lru_cache(maxsize=None)
+def _begin_time(minutes_since_midnight: int) -> time:
+    return time(hour=(minutes_since_midnight // 60), minute=(minutes_since_midnight % 60), tzinfo=TIMEZONE)
+
+
+@lru_cache(maxsize=None)
+def _duration(minutes: int) -> timedelta:
+    return timedelta(minutes=minutes)
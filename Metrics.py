@@ -0,0 +1,191 @@
+import asyncio
+import bisect
+import logging
+import time
+from typing import Callable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+PREFIX: str = "schedulebot_"
+
+# Upper bounds of the histogram buckets, seconds
+BUCKETS: Tuple[float, ...] = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+# Sorted (name, value) pairs
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    __slots__ = ["counts", "sum", "count"]
+    # One count per bucket, the last one for values above every bound
+    counts: list[int]
+    sum: float
+    count: int
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, quantile: float) -> float:
+        """Upper bound of the bucket the quantile falls into, inf if it is above the last one."""
+        rank: float = quantile * self.count
+        cumulative: int = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return float("inf")
+
+
+_counters: dict[Tuple[str, Labels], float] = {}
+_histograms: dict[Tuple[str, Labels], Histogram] = {}
+# Existing stats() methods, exported as gauges named prefix_key
+_collectors: list[Tuple[str, Callable[[], dict[str, int]]]] = []
+_server: Optional[asyncio.Server] = None
+
+
+def inc(name: str, value: float = 1.0, **labels: str) -> None:
+    key: Tuple[str, Labels] = (name, tuple(sorted(labels.items())))
+    _counters[key] = _counters.get(key, 0.0) + value
+
+
+def histogram(name: str, **labels: str) -> Histogram:
+    key: Tuple[str, Labels] = (name, tuple(sorted(labels.items())))
+    result: Optional[Histogram] = _histograms.get(key)
+    if result is None:
+        result = _histograms[key] = Histogram()
+    return result
+
+
+def observe(name: str, value: float, **labels: str) -> None:
+    histogram(name, **labels).observe(value)
+
+
+class timed:
+    """Context manager that observes the seconds spent inside it."""
+    __slots__ = ["histogram", "begin"]
+    histogram: Histogram
+    begin: float
+
+    def __init__(self, name: str, **labels: str):
+        self.histogram = histogram(name, **labels)
+
+    def __enter__(self) -> None:
+        self.begin = time.perf_counter()
+
+    def __exit__(self, *exc_info) -> None:
+        self.histogram.observe(time.perf_counter() - self.begin)
+
+
+def register_collector(prefix: str, stats: Callable[[], dict[str, int]]) -> None:
+    _collectors.append((prefix, stats))
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    lines: list[str] = []
+    typed: set[str] = set()
+
+    def declare(name: str, metric_type: str) -> None:
+        if name not in typed:
+            typed.add(name)
+            lines.append(f"# TYPE {PREFIX}{name} {metric_type}")
+
+    for (name, labels), value in sorted(_counters.items()):
+        declare(name, "counter")
+        lines.append(f"{PREFIX}{name}{_format_labels(labels)} {value:g}")
+
+    for (name, labels), values in sorted(_histograms.items(), key=lambda item: item[0]):
+        declare(name, "histogram")
+        cumulative: int = 0
+        for bound, count in zip(BUCKETS, values.counts):
+            cumulative += count
+            lines.append(f"{PREFIX}{name}_bucket{_format_labels(labels + (('le', f'{bound:g}'),))} {cumulative}")
+        lines.append(f"{PREFIX}{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {values.count}")
+        lines.append(f"{PREFIX}{name}_sum{_format_labels(labels)} {values.sum:g}")
+        lines.append(f"{PREFIX}{name}_count{_format_labels(labels)} {values.count}")
+
+    for prefix, stats in _collectors:
+        for key, value in stats().items():
+            declare(f"{prefix}_{key}", "gauge")
+            lines.append(f"{PREFIX}{prefix}_{key} {value}")
+
+    return "\n".join(lines) + "\n"
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def log_summary() -> None:
+    for (name, labels), values in sorted(_histograms.items(), key=lambda item: item[0]):
+        # timed() creates its histogram before the first observation
+        if not values.count:
+            continue
+        logger.info(
+            "%s%s: %d, mean %.1f ms, p50 <= %.1f ms, p99 <= %.1f ms",
+            name,
+            _format_labels(labels),
+            values.count,
+            values.sum / values.count * 1000,
+            values.quantile(0.5) * 1000,
+            values.quantile(0.99) * 1000
+        )
+    for (name, labels), value in sorted(_counters.items()):
+        logger.info("%s%s: %g", name, _format_labels(labels), value)
+    for prefix, stats in _collectors:
+        logger.info("%s: %s", prefix, ", ".join(f"{key} = {value}" for key, value in stats().items()))
+
+
+async def start_server(host: str, port: int) -> asyncio.Server:
+    """Serve render() on GET /metrics."""
+    global _server
+    _server = await asyncio.start_server(_handle, host, port)
+    return _server
+
+
+async def stop_server() -> None:
+    global _server
+    if _server is not None:
+        _server.close()
+        await _server.wait_closed()
+        _server = None
+
+
+async def _handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        request_line: bytes = await reader.readline()
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+        parts: list[bytes] = request_line.split()
+        if len(parts) >= 2 and parts[0] == b"GET" and parts[1].split(b"?")[0] == b"/metrics":
+            status: str = "200 OK"
+            body: bytes = render().encode()
+        else:
+            status = "404 Not Found"
+            body = b"Not Found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
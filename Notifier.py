@@ -0,0 +1,361 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from datetime import date, datetime, time as day_time, timedelta
+from typing import Iterable, Iterator, Optional, Tuple
+
+import httpx
+from telegram.error import Forbidden, RetryAfter, TelegramError
+from telegram.ext import Application, ContextTypes, Job
+
+import ScheduleAPI
+import Sharding
+from Day import Day, render_day
+from Lesson import Lesson, TIMEZONE
+from SharedState import Backend, SharedStateError
+
+logger = logging.getLogger(__name__)
+
+# Tomorrow's schedule every day at a given time, minutes since midnight
+DAILY: str = "daily"
+# A message some minutes before every lesson
+REMINDER: str = "reminder"
+
+# kind, group code, minutes. All chats subscribed with the same key receive the same messages.
+SubscriptionKey = Tuple[str, str, int]
+
+# What happens when an event is due
+_SEND_DAY: str = "send_day"
+_PLAN_REMINDERS: str = "plan_reminders"
+_REMIND: str = "remind"
+
+
+class SendThrottle:
+    """Spaces out messages so that the bot stays below Telegram's global limit of about 30 messages per second.
+
+    The limit is per bot. With shared state, the worker processes count their messages per second together
+    instead, and a RetryAfter seen by one of them pauses all of them.
+    """
+    __slots__ = ["rate", "interval", "shared", "_next_slot", "_pausing"]
+    rate: float
+    interval: float
+    shared: Optional[Backend]
+    _next_slot: float
+    # Writes of a pause to the shared state, kept here until they finish
+    _pausing: set[asyncio.Task]
+
+    def __init__(self, rate: float = 25.0, shared: Optional[Backend] = None):
+        self.rate = rate
+        self.interval = 1.0 / rate
+        self.shared = shared
+        self._next_slot = 0.0
+        self._pausing = set()
+
+    async def wait(self) -> None:
+        now: float = time.monotonic()
+        slot: float = max(now, self._next_slot)
+        self._next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+        if self.shared is not None:
+            try:
+                await self._wait_shared()
+            except SharedStateError as error:
+                logger.warning("Could not read the shared send rate, throttling locally: %s", error)
+
+    async def _wait_shared(self) -> None:
+        while True:
+            now: float = time.time()
+            paused_until: Optional[bytes] = (await self.shared.get_many(["throttle|paused_until"]))[0]
+            if paused_until is not None and float(paused_until) > now:
+                await asyncio.sleep(float(paused_until) - now)
+                continue
+            if await self.shared.incr(f"throttle|{int(now)}", 2.0) <= self.rate:
+                return
+            await asyncio.sleep(int(now) + 1 - now)
+
+    def pause(self, seconds: float) -> None:
+        self._next_slot = max(self._next_slot, time.monotonic() + seconds)
+        if self.shared is not None:
+            task: asyncio.Task = asyncio.create_task(self._pause_shared(seconds))
+            self._pausing.add(task)
+            task.add_done_callback(self._pausing.discard)
+
+    async def _pause_shared(self, seconds: float) -> None:
+        try:
+            await self.shared.set_many([("throttle|paused_until", str(time.time() + seconds).encode())], seconds)
+        except SharedStateError as error:
+            logger.warning("Could not share a pause of the send rate: %s", error)
+
+
+class Notifier:
+    """Delivers subscribed pushes from a single heap of due events, driven by one JobQueue job.
+
+    Subscriptions with the same key share their events, so the work per event depends on the number of groups
+    and not on the number of chats. The schedule of a group is fetched once per event for all of its chats.
+    """
+    __slots__ = [
+        "url_base",
+        "token",
+        "throttle",
+        "shard",
+        "_subscribers",
+        "_chat_keys",
+        "_events",
+        "_counter",
+        "_scheduled",
+        "_application",
+        "_job",
+        "_job_when"
+    ]
+    url_base: str
+    token: Optional[str]
+    throttle: SendThrottle
+    # (index, count) of this worker process, it notifies only the chats sharded to it
+    shard: Tuple[int, int]
+    _subscribers: dict[SubscriptionKey, set[int]]
+    _chat_keys: dict[int, set[SubscriptionKey]]
+    # (when, tie breaker, action, key, text)
+    _events: list[Tuple[float, int, str, SubscriptionKey, Optional[str]]]
+    _counter: Iterator[int]
+    # Keys that have an event in the heap that reschedules itself
+    _scheduled: set[SubscriptionKey]
+    _application: Optional[Application]
+    _job: Optional[Job]
+    _job_when: float
+
+    def __init__(
+            self,
+            url_base: str,
+            token: Optional[str],
+            rate: float = 25.0,
+            shared: Optional[Backend] = None,
+            shard: Tuple[int, int] = (0, 1)
+    ):
+        self.url_base = url_base
+        self.token = token
+        self.throttle = SendThrottle(rate, shared)
+        self.shard = shard
+        self._subscribers = {}
+        self._chat_keys = {}
+        self._events = []
+        self._counter = itertools.count()
+        self._scheduled = set()
+        self._application = None
+        self._job = None
+        self._job_when = 0.0
+
+    def start(self, application: Application) -> None:
+        """Load the stored subscriptions and start dispatching."""
+        if application.job_queue is None:
+            raise RuntimeError('Notifications need the JobQueue, install "python-telegram-bot[job-queue]"')
+        self._application = application
+        if ScheduleAPI.storage is not None:
+            for chat_id, kind, group_code, minutes in ScheduleAPI.storage.get_subscriptions():
+                # The database is shared by all workers, subscribing happens in the worker that owns the chat
+                if Sharding.shard_of(chat_id, self.shard[1]) == self.shard[0]:
+                    self._add(chat_id, (kind, group_code, minutes))
+        for key in self._subscribers:
+            self._schedule(key)
+        self._arm()
+
+    def stop(self) -> None:
+        if self._job is not None:
+            self._job.schedule_removal()
+            self._job = None
+        self._application = None
+
+    def subscribe(self, chat_id: int, kind: str, group_code: str, minutes: int) -> None:
+        key: SubscriptionKey = (kind, group_code, minutes)
+        if ScheduleAPI.storage is not None:
+            ScheduleAPI.storage.set_subscription(chat_id, kind, group_code, minutes)
+        self._add(chat_id, key)
+        if self._application is not None and key not in self._scheduled:
+            self._schedule(key)
+            self._arm()
+
+    def unsubscribe(self, chat_id: int) -> int:
+        if ScheduleAPI.storage is not None:
+            ScheduleAPI.storage.delete_subscriptions(chat_id)
+        keys: set[SubscriptionKey] = self._chat_keys.pop(chat_id, set())
+        # Events of keys without subscribers are dropped when they come due
+        for key in keys:
+            self._remove(chat_id, key)
+        return len(keys)
+
+    def notify_changed(self, group_codes: Iterable[str]) -> None:
+        """Tell the chats subscribed to any of the groups that the imported lessons of the group changed."""
+        if self._application is None:
+            return
+        for group_code in group_codes:
+            chats: set[int] = self._group_chats(group_code)
+            if chats:
+                self._application.create_task(
+                    self._send_chats(sorted(chats), f'🔄 Розклад групи {group_code} оновлено')
+                )
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "chats": len(self._chat_keys),
+            "keys": len(self._subscribers),
+            "events": len(self._events)
+        }
+
+    def _add(self, chat_id: int, key: SubscriptionKey) -> None:
+        keys: set[SubscriptionKey] = self._chat_keys.setdefault(chat_id, set())
+        # A chat has one subscription of a kind per group, subscribing again replaces it
+        for old_key in [old_key for old_key in keys if old_key[:2] == key[:2] and old_key != key]:
+            keys.discard(old_key)
+            self._remove(chat_id, old_key)
+        keys.add(key)
+        self._subscribers.setdefault(key, set()).add(chat_id)
+
+    def _remove(self, chat_id: int, key: SubscriptionKey) -> None:
+        chats: Optional[set[int]] = self._subscribers.get(key)
+        if chats is None:
+            return
+        chats.discard(chat_id)
+        if not chats:
+            del self._subscribers[key]
+
+    def _schedule(self, key: SubscriptionKey) -> None:
+        self._scheduled.add(key)
+        kind, _, minutes = key
+        if kind == REMINDER:
+            # Plan the rest of today right away
+            self._push(time.time(), _PLAN_REMINDERS, key)
+            return
+        today: date = datetime.now(TIMEZONE).date()
+        when: float = _at(today, minutes)
+        if when <= time.time():
+            when = _at(today + timedelta(days=1), minutes)
+        self._push(when, _SEND_DAY, key)
+
+    def _push(self, when: float, action: str, key: SubscriptionKey, text: Optional[str] = None) -> None:
+        heapq.heappush(self._events, (when, next(self._counter), action, key, text))
+
+    def _arm(self) -> None:
+        if self._application is None or not self._events:
+            return
+        when: float = self._events[0][0]
+        if self._job is not None:
+            if self._job_when <= when:
+                return
+            self._job.schedule_removal()
+        self._job = self._application.job_queue.run_once(
+            self._dispatch,
+            max(0.0, when - time.time()),
+            name="notifications"
+        )
+        self._job_when = when
+
+    async def _dispatch(self, context: ContextTypes.DEFAULT_TYPE) -> None:
+        self._job = None
+        now: float = time.time()
+        while self._events and self._events[0][0] <= now:
+            _, _, action, key, text = heapq.heappop(self._events)
+            if key not in self._subscribers:
+                if action != _REMIND:
+                    # The event would have rescheduled itself, the next subscription schedules it anew
+                    self._scheduled.discard(key)
+                continue
+            # Sending to many chats takes a while, other events must not wait for it
+            context.application.create_task(self._fire(action, key, text))
+        self._arm()
+
+    async def _fire(self, action: str, key: SubscriptionKey, text: Optional[str]) -> None:
+        _, group_code, minutes = key
+        today: date = datetime.now(TIMEZONE).date()
+        if action == _PLAN_REMINDERS:
+            self._push(_at(today + timedelta(days=1), 0), _PLAN_REMINDERS, key)
+            await self._plan_reminders(key, today)
+            self._arm()
+            return
+        if action == _SEND_DAY:
+            self._push(_at(today + timedelta(days=1), minutes), _SEND_DAY, key)
+            self._arm()
+            text = await self._render_day(group_code, today + timedelta(days=1))
+        if text is not None:
+            await self._send(key, text)
+
+    async def _render_day(self, group_code: str, schedule_date: date) -> Optional[str]:
+        fetched: Optional[Tuple[dict, httpx.Response]] = await self._fetch_group_day(group_code, schedule_date)
+        if fetched is None:
+            return None
+        group_data, response = fetched
+        text: str = render_day(group_data, schedule_date, None, ScheduleAPI.payload_digest(response))
+        return text + ScheduleAPI.STALE_NOTICE if ScheduleAPI.is_stale(response) else text
+
+    async def _plan_reminders(self, key: SubscriptionKey, schedule_date: date) -> None:
+        fetched: Optional[Tuple[dict, httpx.Response]] = await self._fetch_group_day(key[1], schedule_date)
+        if fetched is None:
+            return
+        day: Day = Day(fetched[0], schedule_date)
+        subgroups: list[Tuple[str, list[Lesson]]] = [("", day.first_subgroup)]
+        if day.second_subgroup is not None:
+            subgroups = [("Перша підгрупа: ", day.first_subgroup), ("Друга підгрупа: ", day.second_subgroup)]
+
+        now: float = time.time()
+        texts: dict[float, list[str]] = {}
+        for label, lessons in subgroups:
+            for lesson in lessons:
+                when: float = _at(schedule_date, lesson.begin_time.hour * 60 + lesson.begin_time.minute) - key[2] * 60
+                if lesson.canceled or when <= now:
+                    continue
+                texts.setdefault(when, []).append(f'{label}{lesson.get_telegram_message()}')
+        for when, lines in texts.items():
+            self._push(when, _REMIND, key, f'⏰ Через {key[2]} хв:\n' + '\n'.join(lines))
+
+    async def _fetch_group_day(self, group_code: str, schedule_date: date) -> Optional[Tuple[dict, httpx.Response]]:
+        # The API is queried by chat. Any chat bound to the group will do, and always asking through the same one
+        # lets the schedule cache share the response between all events of the group.
+        for chat_id in sorted(self._group_chats(group_code)):
+            response: httpx.Response = await ScheduleAPI.get_schedule_data(
+                self.url_base,
+                chat_id,
+                schedule_date,
+                self.token,
+                background=True
+            )
+            error: Optional[str] = ScheduleAPI.check_response_for_errors(response)
+            if error is not None:
+                logger.warning("Could not fetch %s of %s for notifications: %s", schedule_date, group_code, error)
+                return None
+            for group_data in ScheduleAPI.decode_response(response):
+                if group_data["group"]["code"] == group_code:
+                    return group_data, response
+        return None
+
+    def _group_chats(self, group_code: str) -> set[int]:
+        chats: set[int] = set()
+        for key, key_chats in self._subscribers.items():
+            if key[1] == group_code:
+                chats |= key_chats
+        return chats
+
+    async def _send(self, key: SubscriptionKey, text: str) -> None:
+        await self._send_chats(list(self._subscribers.get(key, ())), text)
+
+    async def _send_chats(self, chat_ids: list[int], text: str) -> None:
+        for chat_id in chat_ids:
+            await self.throttle.wait()
+            try:
+                await self._application.bot.send_message(chat_id, text)
+            except RetryAfter as error:
+                self.throttle.pause(error.retry_after)
+                await self.throttle.wait()
+                try:
+                    await self._application.bot.send_message(chat_id, text)
+                except TelegramError as retry_error:
+                    logger.warning("Could not notify %s: %s", chat_id, retry_error)
+            except Forbidden:
+                # The bot was blocked or removed from the chat
+                self.unsubscribe(chat_id)
+            except TelegramError as error:
+                logger.warning("Could not notify %s: %s", chat_id, error)
+
+
+def _at(day: date, minutes: int) -> float:
+    return TIMEZONE.localize(datetime.combine(day, day_time(minutes // 60, minutes % 60))).timestamp()
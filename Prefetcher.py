@@ -0,0 +1,91 @@
+import asyncio
+import logging
+import time
+from contextlib import contextmanager
+from datetime import date, timedelta
+from functools import partial
+from typing import Awaitable, Callable, Hashable, Iterator
+
+logger = logging.getLogger(__name__)
+
+
+class Prefetcher:
+    """Runs low-priority background fetches.
+
+    Only one prefetch runs at a time, at most one every ``min_interval`` seconds,
+    and only while no foreground request is in progress. Scheduling a new prefetch
+    for the same key cancels the previous one.
+    """
+    __slots__ = ["radius", "min_interval", "_tasks", "_lock", "_idle", "_foreground", "_last_run"]
+    radius: int
+    min_interval: float
+    _tasks: dict[Hashable, asyncio.Task]
+    _lock: asyncio.Lock
+    _idle: asyncio.Event
+    _foreground: int
+    _last_run: float
+
+    def __init__(self, radius: int = 1, min_interval: float = 0.1):
+        self.radius = radius
+        self.min_interval = min_interval
+        self._tasks = {}
+        self._lock = asyncio.Lock()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._foreground = 0
+        self._last_run = 0.0
+
+    @contextmanager
+    def foreground(self) -> Iterator[None]:
+        self._foreground += 1
+        self._idle.clear()
+        try:
+            yield
+        finally:
+            self._foreground -= 1
+            if not self._foreground:
+                self._idle.set()
+
+    def neighbours(self, schedule_date: date) -> list[date]:
+        result: list[date] = []
+        for offset in range(1, self.radius + 1):
+            result.append(schedule_date + timedelta(days=offset))
+            result.append(schedule_date - timedelta(days=offset))
+        return result
+
+    def schedule(self, key: Hashable, dates: list[date], fetch: Callable[[date], Awaitable]) -> None:
+        self.cancel(key)
+        if not dates:
+            return
+        task: asyncio.Task = asyncio.create_task(self._run(key, dates, fetch))
+        self._tasks[key] = task
+        task.add_done_callback(partial(self._forget, key))
+
+    def cancel(self, key: Hashable) -> None:
+        task = self._tasks.pop(key, None)
+        if task is not None:
+            task.cancel()
+
+    def _forget(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+
+    def cancel_all(self) -> None:
+        for task in self._tasks.values():
+            task.cancel()
+        self._tasks.clear()
+
+    async def _run(self, key: Hashable, dates: list[date], fetch: Callable[[date], Awaitable]) -> None:
+        for prefetch_date in dates:
+            async with self._lock:
+                await self._idle.wait()
+                delay: float = self._last_run + self.min_interval - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                self._last_run = time.monotonic()
+                try:
+                    await fetch(prefetch_date)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as error:
+                    logger.debug("Prefetch of %s for %s failed: %s", prefetch_date, key, error)
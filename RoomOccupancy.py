@@ -0,0 +1,112 @@
+import bisect
+from datetime import date
+from typing import Hashable, Tuple
+
+# Minutes since midnight the pairs start at, as parser.lessons_to_api() assigns them
+PAIR_STARTS: Tuple[int, ...] = (480, 590, 700, 810, 920, 1030)
+DAYS: int = 7
+
+# room, bit
+Occupation = Tuple[str, int]
+
+
+def occupancy_bit(week_number: int, day_number: int, pair: int) -> int:
+    """Bit of a pair in a room's occupancy: two weeks of seven days of six pairs."""
+    return ((week_number - 1) * DAYS + day_number) * len(PAIR_STARTS) + pair
+
+
+def pair_of(minutes: int) -> int:
+    """0-based pair a lesson starting at that time belongs to, also if it starts a few minutes early."""
+    return max(0, bisect.bisect_right(PAIR_STARTS, minutes + 10) - 1)
+
+
+def is_room(place: str) -> bool:
+    # Online lessons have a link for a place
+    return bool(place) and not place.startswith("https://")
+
+
+class RoomOccupancy:
+    """Which rooms are taken at every pair of both weeks, one int of 84 bits per room.
+
+    A room and pair can be taken by several groups and known from several sources, a fetched day of a group or
+    the imported lessons of a group. Every bit keeps a count of them, so that updating a source clears only the
+    bits nothing else holds.
+    """
+    __slots__ = ["_bits", "_counts", "_sources", "_rooms"]
+    _bits: dict[str, int]
+    _counts: dict[Occupation, int]
+    _sources: dict[Hashable, list[Occupation]]
+    # Every room that is taken at least once, sorted
+    _rooms: list[str]
+
+    def __init__(self):
+        self._bits = {}
+        self._counts = {}
+        self._sources = {}
+        self._rooms = []
+
+    def update(self, source: Hashable, occupations: list[Occupation]) -> None:
+        """Replace what a source says is taken."""
+        for occupation in self._sources.pop(source, []):
+            count: int = self._counts[occupation] - 1
+            if count:
+                self._counts[occupation] = count
+                continue
+            del self._counts[occupation]
+            room, bit = occupation
+            self._bits[room] &= ~(1 << bit)
+            if not self._bits[room]:
+                del self._bits[room]
+                del self._rooms[bisect.bisect_left(self._rooms, room)]
+        for occupation in occupations:
+            count = self._counts.get(occupation, 0)
+            self._counts[occupation] = count + 1
+            if count:
+                continue
+            room, bit = occupation
+            if room not in self._bits:
+                self._bits[room] = 0
+                bisect.insort(self._rooms, room)
+            self._bits[room] |= 1 << bit
+        if occupations:
+            self._sources[source] = occupations
+
+    def update_day(self, group_data: dict, schedule_date: date) -> None:
+        """Take the rooms of one day of a group as the schedule API returns it."""
+        week_number: int = group_data["week_number"]
+        occupations: set[Occupation] = {
+            (lesson_data["place"].replace(" ", ""), occupancy_bit(
+                week_number,
+                schedule_date.weekday(),
+                pair_of(int(lesson_data["time"]))
+            ))
+            for lesson_data in group_data["first_subgroup"] + (group_data["second_subgroup"] or [])
+            if not lesson_data["canceled"] and is_room(lesson_data["place"])
+        }
+        self.update(("day", group_data["group"]["code"], week_number, schedule_date.weekday()), list(occupations))
+
+    def update_imported(self, group_code: str, lessons_data: list[dict]) -> None:
+        """Take the rooms of the imported APILesson dicts of a group, an empty list frees them."""
+        occupations: set[Occupation] = {
+            (lesson_data["place"], occupancy_bit(
+                lesson_data["week_number"],
+                lesson_data["day_number"],
+                pair_of(lesson_data["time"])
+            ))
+            for lesson_data in lessons_data
+            if is_room(lesson_data["place"])
+        }
+        self.update(("imported", group_code), list(occupations))
+
+    def free_rooms(self, week_number: int, day_number: int, pair: int) -> list[str]:
+        """Rooms that are taken at some time but not at this pair, sorted."""
+        bit: int = occupancy_bit(week_number, day_number, pair)
+        bits: dict[str, int] = self._bits
+        return [room for room in self._rooms if not bits[room] >> bit & 1]
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "rooms": len(self._rooms),
+            "sources": len(self._sources),
+            "occupied_pairs": len(self._counts)
+        }
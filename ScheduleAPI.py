@@ -1,59 +1,529 @@
-from telegram import InlineKeyboardButton
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from telegram import InlineKeyboardButton, InlineQueryResultArticle, InputTextMessageContent
+from telegram.constants import MessageLimit
 from typing import Optional, Tuple
 from datetime import date, timedelta
-from Day import Day
+from functools import partial
+from Day import Day, render_day
 from Group import Group
+from ScheduleCache import ScheduleCache
+from Prefetcher import Prefetcher
+from Storage import Storage
+from CircuitBreaker import CircuitBreaker
+from RoomOccupancy import RoomOccupancy
+from SemesterCalendar import SemesterCalendar
+from SharedState import Backend, SharedStateError
+from TeacherIndex import TeacherIndex
+import Metrics
 import httpx
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-def make_api_get_request(url_base: str, url_path: str, data: dict) -> httpx.Response:
-    return httpx.get(url_base + url_path, params=data)
+logger = logging.getLogger(__name__)
 
+# Shared between all handlers, created in init_client() and closed in close_client()
+_client: Optional[httpx.AsyncClient] = None
 
-def get_schedule_data(
+schedule_cache: ScheduleCache = ScheduleCache()
+# Schedules of single groups taken apart from chat responses, shared by every chat bound to the group
+group_cache: ScheduleCache = ScheduleCache()
+# Upstream requests that will bring a group's schedule into group_cache
+_group_fetches: dict[Tuple, asyncio.Task] = {}
+# Second tier of group_cache shared with the other worker processes, None when the bot runs as one process
+shared: Optional[Backend] = None
+prefetcher: Prefetcher = Prefetcher()
+# Filled from every group schedule that passes through the group cache
+teacher_index: TeacherIndex = TeacherIndex()
+room_occupancy: RoomOccupancy = RoomOccupancy()
+# Off when the bot runs as several workers: each would only know the days fetched for its own chats, so both
+# indexes keep to the imported lessons, which every worker has
+index_fetched_days: bool = True
+# Days expanded from the imported semester, served without going upstream when set
+calendar: Optional[SemesterCalendar] = None
+# Seconds before a day served from the calendar is fetched from upstream again, to catch what changed
+calendar_sync_interval: float = 6 * 60 * 60
+# Opened by the bot on startup, persists chat bindings and the last successful responses
+storage: Optional[Storage] = None
+breaker: CircuitBreaker = CircuitBreaker()
+# Timeout of foreground requests that have a stored snapshot to fall back to
+snapshot_timeout: float = 3.0
+# Background requests after a failed one, kept here until they finish
+_revalidating: dict[Tuple, asyncio.Task] = {}
+
+STALE_NOTICE: str = "\n\n<i>⚠️ Не вдалося оновити розклад, він може бути застарілим.</i>"
+
+
+def init_client(
+        max_connections: int = 20,
+        max_keepalive_connections: int = 10,
+        keepalive_expiry: float = 30.0,
+        timeout: float = 10.0,
+        connect_timeout: float = 5.0
+) -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+                keepalive_expiry=keepalive_expiry
+            ),
+            timeout=httpx.Timeout(timeout, connect=connect_timeout)
+        )
+    return _client
+
+
+async def close_client() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+async def make_api_get_request(
+        url_base: str,
+        url_path: str,
+        data: dict,
+        timeout: Optional[float] = None
+) -> httpx.Response:
+    client: httpx.AsyncClient = init_client()
+    if timeout is None:
+        return await client.get(url_base + url_path, params=data)
+    return await client.get(url_base + url_path, params=data, timeout=timeout)
+
+
+async def get_schedule_data(
     url_base: str,
     telegram_id: int,
     schedule_date: date,
-    token: Optional[str]
+    token: Optional[str],
+    background: bool = False
 ) -> httpx.Response:
-    return make_api_get_request(url_base, '/scheduleBySubgroupsTg', {
-        "telegram_id": telegram_id,
-        "year": schedule_date.year,
-        "month": schedule_date.month,
-        "day": schedule_date.day,
-        "show_place": "false" if token is None else "true",
-        "token": token
-    })
+    fetch = partial(fetch_chat_schedule, url_base, telegram_id, schedule_date, token, background)
+    key: Tuple = schedule_cache_key(telegram_id, schedule_date, token)
+    if background:
+        return await schedule_cache.get(key, schedule_date, fetch)
+    with prefetcher.foreground():
+        return await schedule_cache.get(key, schedule_date, fetch)
+
+
+async def fetch_chat_schedule(
+    url_base: str,
+    telegram_id: int,
+    schedule_date: date,
+    token: Optional[str],
+    background: bool = False
+) -> httpx.Response:
+    """Assemble the chat's response from the schedules of its groups, going upstream only if one is missing.
+
+    Chats bound to the same group then share one upstream request per day instead of making one each.
+    """
+    codes: Optional[list[str]] = None
+    # code: group, as upstream named it when the chat was bound
+    bound_groups: dict[str, dict] = {}
+    if storage is not None:
+        groups: Optional[list[dict]] = storage.get_chat_groups(telegram_id)
+        if groups is not None:
+            codes = [group["code"] for group in groups]
+            bound_groups = {group["code"]: group for group in groups}
+
+    keys: list[Tuple] = [] if codes is None else [group_cache_key(code, schedule_date, token) for code in codes]
+    due_sync: bool = False
+    if keys:
+        await _load_shared_groups(
+            [key for key in keys if group_cache.peek(key) is None and key not in _group_fetches],
+            schedule_date
+        )
+        due_sync = _load_calendar_groups(
+            [key for key in keys if group_cache.peek(key) is None and key not in _group_fetches],
+            bound_groups,
+            schedule_date,
+            token
+        )
+        pending: list[Optional[asyncio.Task]] = [
+            _group_fetches.get(key) for key in keys if group_cache.peek(key) is None
+        ]
+        # Everything is either cached or already being requested for another chat
+        if None not in pending:
+            if pending:
+                await asyncio.wait([asyncio.shield(task) for task in set(pending)])
+            parts: list[Optional[httpx.Response]] = [group_cache.peek(key) for key in keys]
+            if None not in parts:
+                Metrics.inc("assembled_responses_total")
+                if due_sync:
+                    _revalidate(url_base, telegram_id, schedule_date, token)
+                return httpx.Response(200, content=b"[" + b",".join(part.content for part in parts) + b"]")
+
+    task: asyncio.Task = asyncio.ensure_future(
+        fetch_schedule_data(url_base, telegram_id, schedule_date, token, background)
+    )
+    for key in keys:
+        _group_fetches.setdefault(key, task)
+    task.add_done_callback(partial(_forget_group_fetches, keys))
+    return await task
+
+
+def _forget_group_fetches(keys: list[Tuple], task: asyncio.Task) -> None:
+    for key in keys:
+        if _group_fetches.get(key) is task:
+            del _group_fetches[key]
+
+
+def group_cache_key(group_code: str, schedule_date: date, token: Optional[str]) -> Tuple:
+    return (
+        group_code,
+        schedule_date.year,
+        schedule_date.month,
+        schedule_date.day,
+        "false" if token is None else "true"
+    )
+
+
+def shared_group_key(key: Tuple) -> str:
+    # The group code comes first, so that forget_chat() can drop every day of a group by prefix
+    return "group|" + "|".join(str(part) for part in key)
+
+
+async def find_group_schedule(
+        group_code: str,
+        schedule_date: date,
+        token: Optional[str]
+) -> Optional[httpx.Response]:
+    """Return the cached schedule of a single group, whichever chat or worker it was fetched for."""
+    key: Tuple = group_cache_key(group_code, schedule_date, token)
+    if group_cache.peek(key) is None:
+        await _load_shared_groups([key], schedule_date)
+    return group_cache.peek(key)
+
+
+async def _load_shared_groups(keys: list[Tuple], schedule_date: date) -> None:
+    if shared is None or not keys:
+        return
+    try:
+        values: list[Optional[bytes]] = await shared.get_many([shared_group_key(key) for key in keys])
+    except SharedStateError as error:
+        logger.warning("Could not read shared schedules: %s", error)
+        return
+    for key, value in zip(keys, values):
+        if value is not None:
+            Metrics.inc("shared_cache_hits_total")
+            response: httpx.Response = httpx.Response(200, content=value)
+            group_cache.put(key, schedule_date, response)
+            group_data: dict = decode_response(response)
+            index_group_day(group_data, schedule_date)
+            # Another worker fetched it from upstream, the key ends with whether places are shown
+            if calendar is not None and key[-1] == "true":
+                calendar.sync_day(group_data, schedule_date)
+
+
+def _load_calendar_groups(
+        keys: list[Tuple],
+        bound_groups: dict[str, dict],
+        schedule_date: date,
+        token: Optional[str]
+) -> bool:
+    """Put the calendar's days of the groups into group_cache. Returns whether one of them is due a sync."""
+    # The calendar always has places, which upstream only shows with a token
+    if calendar is None or token is None:
+        return False
+    due_sync: bool = False
+    for key in keys:
+        group_data: Optional[dict] = calendar.payload(key[0], schedule_date)
+        if group_data is None:
+            continue
+        Metrics.inc("calendar_hits_total")
+        # The calendar only knows the code, remember_chat_groups() would store it over the group's names
+        group_data = {**group_data, "group": bound_groups[key[0]]}
+        group_cache.put(key, schedule_date, httpx.Response(200, content=encode_payload(group_data)))
+        due_sync = due_sync or calendar.needs_sync(key[0], schedule_date, calendar_sync_interval)
+    return due_sync
+
+
+def index_group_day(group_data: dict, schedule_date: date) -> None:
+    if not index_fetched_days:
+        return
+    teacher_index.update_day(group_data, schedule_date)
+    room_occupancy.update_day(group_data, schedule_date)
+
+
+async def _put_group_schedules(schedule_date: date, token: Optional[str], response: httpx.Response) -> None:
+    items: list[Tuple[Tuple, bytes]] = []
+    group_data: dict
+    for group_data in decode_response(response):
+        items.append((group_cache_key(group_data["group"]["code"], schedule_date, token), encode_payload(group_data)))
+        index_group_day(group_data, schedule_date)
+        if calendar is not None and token is not None:
+            calendar.sync_day(group_data, schedule_date)
+    for key, content in items:
+        group_cache.put(key, schedule_date, httpx.Response(200, content=content))
+    if shared is None or not items:
+        return
+    try:
+        await shared.set_many(
+            [(shared_group_key(key), content) for key, content in items],
+            group_cache.ttl_for(schedule_date)
+        )
+    except SharedStateError as error:
+        logger.warning("Could not share schedules: %s", error)
+
+
+async def fetch_schedule_data(
+    url_base: str,
+    telegram_id: int,
+    schedule_date: date,
+    token: Optional[str],
+    background: bool = False
+) -> httpx.Response:
+    """Request the schedule from upstream, falling back to the last stored snapshot when it fails."""
+    show_place: str = "false" if token is None else "true"
+    snapshot: Optional[bytes] = None
+    if storage is not None:
+        snapshot = storage.get_snapshot(telegram_id, schedule_date, show_place)
+
+    if not breaker.allow():
+        Metrics.inc("breaker_rejections_total")
+        return _snapshot_response(snapshot)
+
+    # Don't keep the user waiting for long when there is something to show instead
+    timeout: Optional[float] = snapshot_timeout if snapshot is not None and not background else None
+    begin: float = time.perf_counter()
+    try:
+        response: httpx.Response = await make_api_get_request(url_base, '/scheduleBySubgroupsTg', {
+            "telegram_id": telegram_id,
+            "year": schedule_date.year,
+            "month": schedule_date.month,
+            "day": schedule_date.day,
+            "show_place": show_place,
+            "token": token
+        }, timeout)
+    except httpx.HTTPError as error:
+        Metrics.inc("upstream_errors_total", error=type(error).__name__)
+        breaker.record_failure()
+        if not background:
+            _revalidate(url_base, telegram_id, schedule_date, token)
+        return _snapshot_response(snapshot)
+
+    Metrics.observe("upstream_request_seconds", time.perf_counter() - begin)
+    Metrics.inc("upstream_responses_total", status=str(response.status_code))
+    if response.status_code >= 500:
+        breaker.record_failure()
+        if not background:
+            _revalidate(url_base, telegram_id, schedule_date, token)
+        # The body is often a proxy's HTML page, which check_response_for_errors() can't read
+        return _snapshot_response(snapshot)
+
+    breaker.record_success()
+    if response.status_code == 200:
+        await _put_group_schedules(schedule_date, token, response)
+        if storage is not None:
+            storage.put_snapshot(telegram_id, schedule_date, show_place, response.content)
+    return response
+
+
+def _snapshot_response(snapshot: Optional[bytes]) -> httpx.Response:
+    if snapshot is None:
+        return httpx.Response(503, json={"error": "schedule API unavailable"})
+    Metrics.inc("stale_responses_total")
+    return httpx.Response(200, content=snapshot, extensions={"stale": True})
+
+
+def _revalidate(url_base: str, telegram_id: int, schedule_date: date, token: Optional[str]) -> None:
+    key: Tuple = schedule_cache_key(telegram_id, schedule_date, token)
+    if key in _revalidating:
+        return
+    _revalidating[key] = asyncio.create_task(_run_revalidation(key, url_base, telegram_id, schedule_date, token))
+
+
+async def _run_revalidation(
+    key: Tuple,
+    url_base: str,
+    telegram_id: int,
+    schedule_date: date,
+    token: Optional[str]
+) -> None:
+    try:
+        response: httpx.Response = await fetch_schedule_data(url_base, telegram_id, schedule_date, token, True)
+        schedule_cache.put(key, schedule_date, response)
+    finally:
+        _revalidating.pop(key, None)
+
+
+def is_stale(response: httpx.Response) -> bool:
+    return response.extensions.get("stale", False)
+
+
+def schedule_cache_key(telegram_id: int, schedule_date: date, token: Optional[str]) -> Tuple:
+    return (
+        telegram_id,
+        schedule_date.year,
+        schedule_date.month,
+        schedule_date.day,
+        "false" if token is None else "true"
+    )
+
+
+async def get_schedule_range(
+    url_base: str,
+    telegram_id: int,
+    first_date: date,
+    last_date: date,
+    token: Optional[str]
+) -> list[httpx.Response]:
+    # The endpoint only serves one day per call, so the days are requested concurrently
+    return list(await asyncio.gather(*(
+        get_schedule_data(url_base, telegram_id, first_date + timedelta(days=offset), token)
+        for offset in range((last_date - first_date).days + 1)
+    )))
+
+
+def convert_range_to_days(responses: list[httpx.Response], first_date: date, group_code: str) -> list[Day]:
+    days: list[Day] = []
+    for offset, response in enumerate(responses):
+        for group_data in decode_response(response):
+            if group_data["group"]["code"] == group_code:
+                days.append(Day(group_data, first_date + timedelta(days=offset)))
+                break
+    return days
+
+
+def split_message(text: str, limit: int = MessageLimit.MAX_TEXT_LENGTH) -> list[str]:
+    # Every line of a rendered day closes its own tags, so it is safe to split between lines
+    chunks: list[str] = []
+    current: str = ''
+    for line in text.split('\n'):
+        while len(line) > limit:
+            if current:
+                chunks.append(current)
+                current = ''
+            chunks.append(line[:limit])
+            line = line[limit:]
+        if current and len(current) + 1 + len(line) > limit:
+            chunks.append(current)
+            current = line
+        else:
+            current = f'{current}\n{line}' if current else line
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def prefetch_neighbours(url_base: str, telegram_id: int, schedule_date: date, token: Optional[str]) -> None:
+    dates: list[date] = [
+        prefetch_date for prefetch_date in prefetcher.neighbours(schedule_date)
+        if schedule_cache.peek(schedule_cache_key(telegram_id, prefetch_date, token)) is None
+    ]
+    prefetcher.schedule(
+        telegram_id,
+        dates,
+        lambda prefetch_date: get_schedule_data(url_base, telegram_id, prefetch_date, token, background=True)
+    )
+
+
+def decode_response(response: httpx.Response) -> list[dict]:
+    if orjson is not None:
+        return orjson.loads(response.content)
+    return response.json()
+
+
+def encode_payload(data: dict) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False).encode()
+
+
+def payload_digest(response: httpx.Response) -> bytes:
+    return hashlib.blake2b(response.content, digest_size=16).digest()
 
 
 def check_response_for_errors(response: httpx.Response) -> Optional[str]:
     if response.status_code == 200:
         return None
-    match response.json()["error"]:
+    try:
+        error: object = response.json()["error"]
+    except (ValueError, TypeError, KeyError):
+        # Not the API's JSON error, like an HTML page of a proxy in front of it
+        error = None
+    match error:
         case "users and groups not found" | "groups not found":
             return "Нажаль, пов'язаних з цим чатом студентських груп знайдено не було 😔"
         case _:
             return "Щось пішло не так 🕯"
 
 
+def get_chat_groups(chat_id: int) -> Optional[list[dict]]:
+    if storage is None:
+        return None
+    return storage.get_chat_groups(chat_id)
+
+
+def remember_chat_groups(chat_id: int, response_data: list[dict]) -> None:
+    if storage is None:
+        return
+    groups: list[dict] = sorted(
+        (group_data["group"] for group_data in response_data),
+        key=lambda group: group["code"]
+    )
+    if storage.get_chat_groups(chat_id) != groups:
+        storage.set_chat_groups(chat_id, groups)
+
+
+async def forget_chat(chat_id: int) -> None:
+    groups: Optional[list[dict]] = get_chat_groups(chat_id)
+    if groups is not None:
+        # The chat asked for fresh data, which its groups' shared schedules would otherwise keep serving
+        codes: set[str] = {group["code"] for group in groups}
+        group_cache.invalidate(lambda key: key[0] in codes)
+        if calendar is not None:
+            for code in codes:
+                calendar.expire(code)
+        if shared is not None:
+            try:
+                for code in codes:
+                    await shared.delete_prefix(f"group|{code}|")
+            except SharedStateError as error:
+                logger.warning("Could not drop shared schedules: %s", error)
+    if storage is not None:
+        storage.forget_chat(chat_id)
+    schedule_cache.invalidate(lambda key: key[0] == chat_id)
+    prefetcher.cancel(chat_id)
+
+
 def check_response_for_multiple_groups(
         response_data: list[dict],
-        schedule_date: date
+        schedule_date: date,
+        callback_name: str = "UPDATE_SCHEDULE"
 ) -> Optional[Tuple[str, list[list[InlineKeyboardButton]]]]:
 
     if len(response_data) <= 1:
         return None
 
+    response_data.sort(key=lambda group: group["group"]["code"])
+    return build_group_picker([group_data["group"] for group_data in response_data], schedule_date, callback_name)
+
+
+def build_group_picker(
+        groups: list[dict],
+        schedule_date: date,
+        callback_name: str = "UPDATE_SCHEDULE"
+) -> Tuple[str, list[list[InlineKeyboardButton]]]:
+
     keyboard: list[list[InlineKeyboardButton]] = [[]]
     group_data: dict
-    response_data.sort(key=lambda group: group["group"]["code"])
-    for group_data in response_data:
+    for group_data in groups:
         if len(keyboard[-1]) >= 3:
             keyboard.append([])
-        group: Group = Group(group_data["group"])
+        group: Group = Group(group_data)
         keyboard[-1].append(InlineKeyboardButton(
             group.name,
-            callback_data=f'UPDATE_SCHEDULE|{schedule_date.strftime("%d.%m.%Y")}|{group.code}|SHOW_NAME'
+            callback_data=f'{callback_name}|{schedule_date.strftime("%d.%m.%Y")}|{group.code}|SHOW_NAME'
         ))
 
     return "До цього чату прив'язано декілька груп. Оберіть потрібну:", keyboard
@@ -62,7 +532,8 @@ def check_response_for_multiple_groups(
 def convert_daydata_to_string(
         data: dict,
         schedule_date: date,
-        show_name: bool = False
+        show_name: bool = False,
+        content_hash: Optional[bytes] = None
 ) -> Tuple[str, list[list[InlineKeyboardButton]]]:
 
     keyboard = [
@@ -83,4 +554,25 @@ def convert_daydata_to_string(
     ]
 
     group: Group = Group(data["group"])
-    return Day(data, schedule_date).get_telegram_message(group.name if show_name else None), keyboard
+    group_name: Optional[str] = group.name if show_name else None
+    if content_hash is None:
+        return Day(data, schedule_date).get_telegram_message(group_name), keyboard
+    return render_day(data, schedule_date, group_name, content_hash), keyboard
+
+
+def build_inline_result(
+        data: dict,
+        schedule_date: date,
+        content_hash: bytes,
+        stale: bool = False
+) -> InlineQueryResultArticle:
+    group: Group = Group(data["group"])
+    text: str = render_day(data, schedule_date, group.name, content_hash)
+    if stale:
+        text += STALE_NOTICE
+    return InlineQueryResultArticle(
+        id=f'{group.code}|{schedule_date.strftime("%d.%m.%Y")}'[:64],
+        title=f'{group.name}, {schedule_date.strftime("%d.%m.%Y")}',
+        description=group.desc or None,
+        input_message_content=InputTextMessageContent(split_message(text)[0])
+    )
@@ -0,0 +1,133 @@
+import asyncio
+import time
+from collections import OrderedDict
+from datetime import date
+from typing import Awaitable, Callable, Hashable, Optional, Tuple
+
+import httpx
+
+
+class ScheduleCache:
+    """LRU cache of successful schedule responses with date-dependent TTLs.
+
+    Concurrent requests for the same key share a single upstream call.
+    """
+    __slots__ = [
+        "max_size",
+        "today_ttl",
+        "past_ttl",
+        "future_ttl",
+        "hits",
+        "misses",
+        "evictions",
+        "coalesced",
+        "_entries",
+        "_in_flight"
+    ]
+    max_size: int
+    today_ttl: float
+    past_ttl: float
+    future_ttl: float
+    hits: int
+    misses: int
+    evictions: int
+    coalesced: int
+    _entries: OrderedDict[Hashable, Tuple[float, httpx.Response]]
+    _in_flight: dict[Hashable, asyncio.Task]
+
+    def __init__(
+            self,
+            max_size: int = 1024,
+            today_ttl: float = 60.0,
+            past_ttl: float = 3600.0,
+            future_ttl: float = 300.0
+    ):
+        self.max_size = max_size
+        self.today_ttl = today_ttl
+        self.past_ttl = past_ttl
+        self.future_ttl = future_ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.coalesced = 0
+        self._entries = OrderedDict()
+        self._in_flight = {}
+
+    def ttl_for(self, schedule_date: date) -> float:
+        today: date = date.today()
+        if schedule_date == today:
+            return self.today_ttl
+        if schedule_date < today:
+            return self.past_ttl
+        return self.future_ttl
+
+    def peek(self, key: Hashable) -> Optional[httpx.Response]:
+        entry: Optional[Tuple[float, httpx.Response]] = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= time.monotonic():
+            del self._entries[key]
+            return None
+        return entry[1]
+
+    def put(self, key: Hashable, schedule_date: date, response: httpx.Response) -> None:
+        # Stale snapshots are served while the upstream is failing and must not outlive the outage
+        if response.status_code != 200 or response.extensions.get("stale"):
+            return
+        self._entries[key] = (time.monotonic() + self.ttl_for(schedule_date), response)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, predicate: Callable[[Hashable], bool]) -> int:
+        keys: list[Hashable] = [key for key in self._entries if predicate(key)]
+        for key in keys:
+            del self._entries[key]
+        return len(keys)
+
+    async def get(
+            self,
+            key: Hashable,
+            schedule_date: date,
+            fetch: Callable[[], Awaitable[httpx.Response]]
+    ) -> httpx.Response:
+        response: Optional[httpx.Response] = self.peek(key)
+        if response is not None:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return response
+
+        task: Optional[asyncio.Task] = self._in_flight.get(key)
+        if task is None:
+            self.misses += 1
+            task = asyncio.ensure_future(self._fetch(key, schedule_date, fetch))
+            self._in_flight[key] = task
+        else:
+            self.coalesced += 1
+        # Shielded so that one cancelled waiter doesn't cancel the request for everybody else
+        return await asyncio.shield(task)
+
+    async def _fetch(
+            self,
+            key: Hashable,
+            schedule_date: date,
+            fetch: Callable[[], Awaitable[httpx.Response]]
+    ) -> httpx.Response:
+        try:
+            response: httpx.Response = await fetch()
+            self.put(key, schedule_date, response)
+            return response
+        finally:
+            del self._in_flight[key]
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._in_flight)
+        }
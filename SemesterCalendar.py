@@ -0,0 +1,183 @@
+import time
+from datetime import date, timedelta
+from typing import Optional, Tuple
+
+from Day import Day
+
+# An imported lesson expanded for one group: its payload, subgroup, first and last date
+_Template = Tuple[dict, int, date, date]
+
+
+def teacher_data(teacher: str) -> dict:
+    """The lecturer dict the schedule API sends, for a teacher that imported lessons name "Surname N.P."."""
+    words: list[str] = teacher.split()
+    initials: list[str] = [part for part in words[-1].split(".") if part] if len(words) > 1 else []
+    if not initials:
+        return {"code": teacher, "name": "?", "surname": teacher.strip(), "patronymic": "?"}
+    return {"code": teacher, "name": initials[0], "surname": words[-2], "patronymic": initials[-1]}
+
+
+def week_number(day_date: date, semester_start: date) -> int:
+    """1 or 2, the week the semester starts in being the first."""
+    weeks: int = ((day_date - timedelta(days=day_date.weekday())) -
+                  (semester_start - timedelta(days=semester_start.weekday()))).days // 7
+    return weeks % 2 + 1
+
+
+class SemesterCalendar:
+    """Every day of the semester of the imported groups, as the schedule API returns a group's day.
+
+    The imported lessons recur every other week between their start and end dates. They are expanded once per
+    group into a dict by date, so a day is a lookup instead of an upstream request. Days of the same week number
+    and weekday with the same lessons share one payload, and overrides, cancellations and comments of a lesson on
+    one date, copy only the day they change.
+
+    A day fetched from upstream is kept as synced and wins over the expanded one, upstream being the authority on
+    what changed since the import.
+    """
+    __slots__ = ["_templates", "_overrides", "_days", "_synced"]
+    # group code: imported APILesson dicts
+    _templates: dict[str, list[dict]]
+    # group code: override dicts, see update_overrides()
+    _overrides: dict[str, list[dict]]
+    # group code: date: group payload
+    _days: dict[str, dict[date, dict]]
+    # group code: date: (time.monotonic() of the sync, group payload from upstream)
+    _synced: dict[str, dict[date, Tuple[float, dict]]]
+
+    def __init__(self):
+        self._templates = {}
+        self._overrides = {}
+        self._days = {}
+        self._synced = {}
+
+    def update_imported(self, group_code: str, lessons_data: list[dict]) -> None:
+        """Expand the imported APILesson dicts of a group anew, an empty list drops the group."""
+        if lessons_data:
+            self._templates[group_code] = lessons_data
+        else:
+            self._templates.pop(group_code, None)
+            self._synced.pop(group_code, None)
+        self._expand(group_code)
+
+    def update_overrides(self, group_code: str, overrides_data: list[dict]) -> None:
+        """Replace the overrides of a group.
+
+        An override is a dict with "group_code", "date" as [year, month, day] and "time" in minutes since
+        midnight of the lessons it changes, optionally "subgroup" to change only the lessons of subgroup 1 or 2,
+        and the "canceled" and "comment" to set.
+        """
+        if overrides_data:
+            self._overrides[group_code] = overrides_data
+        else:
+            self._overrides.pop(group_code, None)
+        self._expand(group_code)
+
+    def sync_day(self, group_data: dict, day_date: date) -> None:
+        """Keep a day of a group as upstream returned it, if the group is in the calendar."""
+        group_code: str = group_data["group"]["code"]
+        if day_date in self._days.get(group_code, {}):
+            self._synced.setdefault(group_code, {})[day_date] = (time.monotonic(), group_data)
+
+    def expire(self, group_code: str) -> None:
+        """Make every synced day of a group due for a sync, still serving it until then."""
+        synced: dict[date, Tuple[float, dict]] = self._synced.get(group_code, {})
+        for day_date, (_, group_data) in synced.items():
+            synced[day_date] = (float("-inf"), group_data)
+
+    def needs_sync(self, group_code: str, day_date: date, interval: float) -> bool:
+        synced: Optional[Tuple[float, dict]] = self._synced.get(group_code, {}).get(day_date)
+        return synced is None or time.monotonic() - synced[0] >= interval
+
+    def payload(self, group_code: str, day_date: date) -> Optional[dict]:
+        """The group's day as the schedule API returns it, None outside the group's semester."""
+        synced: Optional[Tuple[float, dict]] = self._synced.get(group_code, {}).get(day_date)
+        if synced is not None:
+            return synced[1]
+        return self._days.get(group_code, {}).get(day_date)
+
+    def day(self, group_code: str, day_date: date) -> Optional[Day]:
+        group_data: Optional[dict] = self.payload(group_code, day_date)
+        return None if group_data is None else Day(group_data, day_date)
+
+    def _expand(self, group_code: str) -> None:
+        lessons_data: list[dict] = self._templates.get(group_code, [])
+        if not lessons_data:
+            self._days.pop(group_code, None)
+            return
+
+        # Groups without subgroups have them all -1, groups with them have 0 for lessons of the whole group
+        has_subgroups: bool = any(lesson_data["subgroup"] > 0 for lesson_data in lessons_data)
+        semester_start: date = min(date(*lesson_data["start_date"]) for lesson_data in lessons_data)
+        semester_end: date = max(date(*lesson_data["end_date"]) for lesson_data in lessons_data)
+
+        # week number, day number: templates by time
+        slots: dict[Tuple[int, int], list[_Template]] = {}
+        for lesson_data in sorted(lessons_data, key=lambda lesson: (lesson["time"], lesson["subgroup"])):
+            slot: list[_Template] = slots.setdefault((lesson_data["week_number"], lesson_data["day_number"]), [])
+            slot.append(({
+                "local_id": f'{group_code}|{lesson_data["week_number"]}|{lesson_data["day_number"]}|{len(slot)}',
+                "names": lesson_data["names"],
+                "lesson_type": lesson_data["lesson_type"],
+                "lecturers": [teacher_data(teacher) for teacher in lesson_data["lecturers"]],
+                "comment": lesson_data["comment"],
+                "place": lesson_data["place"],
+                "time": lesson_data["time"],
+                "duration": lesson_data["duration"],
+                "canceled": False
+            }, lesson_data["subgroup"], date(*lesson_data["start_date"]), date(*lesson_data["end_date"])))
+
+        # Imported lessons don't name the group, whoever serves the day puts the group upstream returned in its place
+        group: dict = {"code": group_code, "names": [group_code], "desc": ""}
+        # week number, day number, indexes of the templates held that day: payload
+        shared: dict[Tuple[int, int, Tuple[int, ...]], dict] = {}
+        days: dict[date, dict] = {}
+        for offset in range((semester_end - semester_start).days + 1):
+            day_date: date = semester_start + timedelta(days=offset)
+            week: int = week_number(day_date, semester_start)
+            slot = slots.get((week, day_date.weekday()), [])
+            held: Tuple[int, ...] = tuple(
+                index for index, (_, _, first_date, last_date) in enumerate(slot) if first_date <= day_date <= last_date
+            )
+            group_data: Optional[dict] = shared.get((week, day_date.weekday(), held))
+            if group_data is None:
+                group_data = shared[(week, day_date.weekday(), held)] = {
+                    "group": group,
+                    "week_number": week,
+                    "first_subgroup": [slot[index][0] for index in held if slot[index][1] != 2],
+                    "second_subgroup": [
+                        slot[index][0] for index in held if slot[index][1] != 1
+                    ] if has_subgroups else []
+                }
+            days[day_date] = group_data
+
+        for override in self._overrides.get(group_code, []):
+            override_date: date = date(*override["date"])
+            if override_date in days:
+                days[override_date] = _apply_override(days[override_date], override)
+        self._days[group_code] = days
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "groups": len(self._days),
+            "days": sum(len(days) for days in self._days.values()),
+            "overrides": sum(len(overrides) for overrides in self._overrides.values()),
+            "synced_days": sum(len(synced) for synced in self._synced.values())
+        }
+
+
+def _apply_override(group_data: dict, override: dict) -> dict:
+    """Return a copy of the day with the override applied to its lessons, the day itself may be shared."""
+    changed: dict = dict(group_data)
+    for subgroup, name in ((1, "first_subgroup"), (2, "second_subgroup")):
+        lessons: list[dict] = []
+        for lesson_data in group_data[name]:
+            if lesson_data["time"] == override["time"] and override.get("subgroup", subgroup) in (subgroup, 0, -1):
+                lesson_data = dict(lesson_data)
+                if "canceled" in override:
+                    lesson_data["canceled"] = override["canceled"]
+                if "comment" in override:
+                    lesson_data["comment"] = override["comment"]
+            lessons.append(lesson_data)
+        changed[name] = lessons
+    return changed
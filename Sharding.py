@@ -0,0 +1,247 @@
+import asyncio
+import json
+import logging
+import os
+import shutil
+import signal
+import struct
+import sys
+import tempfile
+from functools import partial
+from typing import Optional
+
+from telegram import Bot, Update
+from telegram.ext import Application
+
+logger = logging.getLogger(__name__)
+
+# Every update forwarded to a worker is prefixed with its length
+_LENGTH: struct.Struct = struct.Struct(">I")
+
+SECRET_TOKEN_HEADER: bytes = b"x-telegram-bot-api-secret-token"
+# Updates are a few KiB, anything bigger isn't one
+MAX_BODY_SIZE: int = 1024 * 1024
+
+
+def shard_of(chat_id: int, workers: int) -> int:
+    return chat_id % workers
+
+
+def update_chat_id(data: dict) -> Optional[int]:
+    """Return the chat of an update as Telegram sends it, for inline queries the user, or None if it has neither."""
+    for name, value in data.items():
+        if name == "update_id" or not isinstance(value, dict):
+            continue
+        # A callback query carries the message its button belongs to
+        message: object = value.get("message", value)
+        if isinstance(message, dict) and "chat" in message:
+            return message["chat"]["id"]
+        if "from" in value:
+            return value["from"]["id"]
+        return None
+    return None
+
+
+class ShardingFront:
+    """Receives webhook updates and forwards each one to the worker process that owns its chat.
+
+    Every worker gets its updates over a single Unix socket connection, in the order they arrived here.
+    """
+    __slots__ = ["url_path", "secret_token", "socket_paths", "forwarded", "_writers", "_server"]
+    url_path: bytes
+    secret_token: Optional[bytes]
+    socket_paths: list[str]
+    forwarded: list[int]
+    _writers: list[asyncio.StreamWriter]
+    _server: Optional[asyncio.AbstractServer]
+
+    def __init__(self, url_path: str, secret_token: Optional[str], socket_paths: list[str]):
+        self.url_path = ("/" + url_path.strip("/")).encode()
+        self.secret_token = None if secret_token is None else secret_token.encode()
+        self.socket_paths = socket_paths
+        self.forwarded = [0] * len(socket_paths)
+        self._writers = []
+        self._server = None
+
+    async def connect(self, processes: list[asyncio.subprocess.Process], timeout: float = 60.0) -> None:
+        """Connect to every worker once it listens, a worker that exits first fails the whole start."""
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        deadline: float = loop.time() + timeout
+        for path, process in zip(self.socket_paths, processes):
+            while True:
+                try:
+                    self._writers.append((await asyncio.open_unix_connection(path))[1])
+                    break
+                except (FileNotFoundError, ConnectionRefusedError):
+                    if process.returncode is not None or loop.time() > deadline:
+                        raise RuntimeError(f"Worker {path} did not start")
+                    await asyncio.sleep(0.1)
+
+    async def start(self, host: str, port: int) -> None:
+        self._server = await asyncio.start_server(self._handle, host, port)
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+        for writer in self._writers:
+            writer.close()
+        self._writers = []
+
+    async def forward(self, body: bytes) -> None:
+        chat_id: Optional[int] = update_chat_id(json.loads(body))
+        worker: int = shard_of(chat_id or 0, len(self._writers))
+        self._writers[worker].write(_LENGTH.pack(len(body)) + body)
+        self.forwarded[worker] += 1
+        # Telegram is answered once the worker has taken the update, a slow worker slows down its own share
+        await self._writers[worker].drain()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request_line: bytes = await reader.readline()
+                if not request_line:
+                    break
+                headers: dict[bytes, bytes] = {}
+                while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    name, _, value = line.partition(b":")
+                    headers[name.strip().lower()] = value.strip()
+                try:
+                    length: int = int(headers.get(b"content-length", b"0"))
+                except ValueError:
+                    length = -1
+
+                # Nothing is read into memory before the request turned out to be Telegram's
+                body_read: bool = False
+                parts: list[bytes] = request_line.split()
+                if len(parts) < 2 or parts[0] != b"POST" or parts[1] != self.url_path:
+                    status: bytes = b"404 Not Found"
+                elif self.secret_token is not None and headers.get(SECRET_TOKEN_HEADER) != self.secret_token:
+                    status = b"403 Forbidden"
+                elif length < 0:
+                    status = b"400 Bad Request"
+                elif length > MAX_BODY_SIZE:
+                    status = b"413 Payload Too Large"
+                else:
+                    body: bytes = await reader.readexactly(length)
+                    body_read = True
+                    try:
+                        await self.forward(body)
+                        status = b"200 OK"
+                    except ValueError:
+                        status = b"400 Bad Request"
+                # The body of a refused request is left unread, the connection can't be reused then
+                keep_alive: bool = body_read or length == 0
+                writer.write(b"HTTP/1.1 " + status + b"\r\nContent-Length: 0\r\n" +
+                             (b"" if keep_alive else b"Connection: close\r\n") + b"\r\n")
+                await writer.drain()
+                if not keep_alive or headers.get(b"connection", b"").lower() == b"close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            # ValueError: a header line longer than the reader's limit
+            pass
+        finally:
+            writer.close()
+
+
+async def serve_worker(application: Application, socket_path: str) -> None:
+    """Run the application on the updates a ShardingFront forwards to socket_path, until SIGINT or SIGTERM."""
+    stopping: asyncio.Event = asyncio.Event()
+    loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+    for stop_signal in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(stop_signal, stopping.set)
+
+    await application.initialize()
+    try:
+        if application.post_init is not None:
+            await application.post_init(application)
+        await application.start()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        server: asyncio.AbstractServer = await asyncio.start_unix_server(
+            partial(_receive, application),
+            socket_path
+        )
+        await stopping.wait()
+        server.close()
+        await application.stop()
+    finally:
+        await application.shutdown()
+        if application.post_shutdown is not None:
+            await application.post_shutdown(application)
+
+
+async def _receive(application: Application, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        while True:
+            length: int = _LENGTH.unpack(await reader.readexactly(_LENGTH.size))[0]
+            data: dict = json.loads(await reader.readexactly(length))
+            await application.update_queue.put(Update.de_json(data, application.bot))
+    except asyncio.IncompleteReadError:
+        # The front closed the connection
+        pass
+    finally:
+        writer.close()
+
+
+async def run_front(
+        bot: Bot,
+        workers: int,
+        argv: list[str],
+        listen: str,
+        port: int,
+        url_path: str,
+        webhook_url: str,
+        secret_token: Optional[str],
+        allowed_updates: list[str],
+        max_connections: int
+) -> bool:
+    """Start the worker processes, each running argv with the environment telling it its shard, and feed them
+    webhook updates until SIGINT or SIGTERM. Returns False if a worker exited on its own.
+    """
+    directory: str = tempfile.mkdtemp(prefix="schedulebot-")
+    socket_paths: list[str] = [os.path.join(directory, f"worker-{index}.sock") for index in range(workers)]
+    processes: list[asyncio.subprocess.Process] = []
+    for index, socket_path in enumerate(socket_paths):
+        processes.append(await asyncio.create_subprocess_exec(sys.executable, *argv, env={
+            **os.environ,
+            "SCHEDULE_BOT_WORKERS": str(workers),
+            "SCHEDULE_BOT_WORKER_INDEX": str(index),
+            "SCHEDULE_BOT_WORKER_SOCKET": socket_path
+        }))
+
+    stopping: asyncio.Event = asyncio.Event()
+    loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+    for stop_signal in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(stop_signal, stopping.set)
+
+    front: ShardingFront = ShardingFront(url_path, secret_token, socket_paths)
+    try:
+        await front.connect(processes)
+        await front.start(listen, port)
+        async with bot:
+            await bot.set_webhook(
+                webhook_url,
+                secret_token=secret_token,
+                allowed_updates=allowed_updates,
+                max_connections=max_connections
+            )
+        logger.info("Forwarding updates from %s:%d to %d workers", listen, port, workers)
+
+        stop_waiter: asyncio.Task = asyncio.ensure_future(stopping.wait())
+        exit_waiters: list[asyncio.Task] = [asyncio.ensure_future(process.wait()) for process in processes]
+        await asyncio.wait([stop_waiter, *exit_waiters], return_when=asyncio.FIRST_COMPLETED)
+        stop_waiter.cancel()
+        for waiter in exit_waiters:
+            waiter.cancel()
+        if not stopping.is_set():
+            logger.error("A worker exited, stopping the others")
+        return stopping.is_set()
+    finally:
+        await front.stop()
+        for process in processes:
+            if process.returncode is None:
+                process.terminate()
+        for process in processes:
+            await process.wait()
+        shutil.rmtree(directory, ignore_errors=True)
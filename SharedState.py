@@ -0,0 +1,266 @@
+import asyncio
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, Tuple, TypeVar, Union
+from urllib.parse import urlsplit
+
+# Expired entries are purged at most this often, seconds
+PURGE_INTERVAL: float = 60.0
+
+T = TypeVar("T")
+
+
+class SharedStateError(Exception):
+    """The shared state backend could not be reached or refused a command."""
+
+
+class MemoryBackend:
+    """Shared state of a single process, the default when the bot runs as one process."""
+    __slots__ = ["_entries", "_purged_at"]
+    _entries: dict[str, Tuple[float, Union[bytes, int]]]
+    _purged_at: float
+
+    def __init__(self):
+        self._entries = {}
+        self._purged_at = time.monotonic()
+
+    async def get_many(self, keys: list[str]) -> list[Optional[bytes]]:
+        now: float = time.monotonic()
+        values: list[Optional[bytes]] = []
+        for key in keys:
+            entry: Optional[Tuple[float, Union[bytes, int]]] = self._entries.get(key)
+            values.append(entry[1] if entry is not None and entry[0] > now else None)
+        return values
+
+    async def set_many(self, items: list[Tuple[str, bytes]], ttl: float) -> None:
+        now: float = time.monotonic()
+        for key, value in items:
+            self._entries[key] = (now + ttl, value)
+        if now - self._purged_at > PURGE_INTERVAL:
+            self._purged_at = now
+            self._entries = {key: entry for key, entry in self._entries.items() if entry[0] > now}
+
+    async def incr(self, key: str, ttl: float) -> int:
+        """Increment a counter that starts from 0 again ttl seconds after its first increment."""
+        now: float = time.monotonic()
+        entry: Optional[Tuple[float, Union[bytes, int]]] = self._entries.get(key)
+        if entry is None or entry[0] <= now:
+            entry = (now + ttl, 0)
+        self._entries[key] = (entry[0], entry[1] + 1)
+        return entry[1] + 1
+
+    async def delete_prefix(self, prefix: str) -> int:
+        keys: list[str] = [key for key in self._entries if key.startswith(prefix)]
+        for key in keys:
+            del self._entries[key]
+        return len(keys)
+
+    async def close(self) -> None:
+        self._entries = {}
+
+
+class SQLiteBackend:
+    """Shared state of the processes of one host, kept in a SQLite database they all open.
+
+    Queries run on a thread of their own, one at a time, so that waiting for another process's write lock doesn't
+    stall the event loop.
+    """
+    __slots__ = ["connection", "_executor", "_purged_at"]
+    connection: sqlite3.Connection
+    _executor: ThreadPoolExecutor
+    _purged_at: float
+
+    def __init__(self, path: str):
+        # Opened here, used only on the executor's thread from then on
+        self.connection = sqlite3.connect(path, timeout=5.0, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS shared_state ("
+            "key TEXT PRIMARY KEY, "
+            "value BLOB NOT NULL, "
+            "expires_at REAL NOT NULL)"
+        )
+        self.connection.commit()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shared-state")
+        self._purged_at = 0.0
+
+    async def get_many(self, keys: list[str]) -> list[Optional[bytes]]:
+        return await self._run(self._get_many, keys)
+
+    async def set_many(self, items: list[Tuple[str, bytes]], ttl: float) -> None:
+        await self._run(self._set_many, items, ttl)
+
+    async def incr(self, key: str, ttl: float) -> int:
+        return await self._run(self._incr, key, ttl)
+
+    async def delete_prefix(self, prefix: str) -> int:
+        return await self._run(self._delete_prefix, prefix)
+
+    async def close(self) -> None:
+        await asyncio.get_running_loop().run_in_executor(self._executor, self.connection.close)
+        self._executor.shutdown()
+
+    async def _run(self, function: Callable[..., T], *args) -> T:
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+        except sqlite3.Error as error:
+            raise SharedStateError(str(error)) from error
+
+    def _get_many(self, keys: list[str]) -> list[Optional[bytes]]:
+        rows: dict[str, bytes] = dict(self.connection.execute(
+            f"SELECT key, value FROM shared_state WHERE key IN ({', '.join('?' * len(keys))}) AND expires_at > ?",
+            (*keys, time.time())
+        ).fetchall())
+        return [rows.get(key) for key in keys]
+
+    def _set_many(self, items: list[Tuple[str, bytes]], ttl: float) -> None:
+        now: float = time.time()
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO shared_state (key, value, expires_at) VALUES (?, ?, ?)",
+            [(key, value, now + ttl) for key, value in items]
+        )
+        if now - self._purged_at > PURGE_INTERVAL:
+            self._purged_at = now
+            self.connection.execute("DELETE FROM shared_state WHERE expires_at <= ?", (now,))
+        self.connection.commit()
+
+    def _incr(self, key: str, ttl: float) -> int:
+        now: float = time.time()
+        value: int = self.connection.execute(
+            "INSERT INTO shared_state (key, value, expires_at) VALUES (?1, 1, ?2 + ?3) "
+            "ON CONFLICT (key) DO UPDATE SET "
+            "value = CASE WHEN expires_at > ?2 THEN value + 1 ELSE 1 END, "
+            "expires_at = CASE WHEN expires_at > ?2 THEN expires_at ELSE ?2 + ?3 END "
+            "RETURNING value",
+            (key, now, ttl)
+        ).fetchone()[0]
+        self.connection.commit()
+        return value
+
+    def _delete_prefix(self, prefix: str) -> int:
+        deleted: int = self.connection.execute(
+            "DELETE FROM shared_state WHERE substr(key, 1, ?) = ?",
+            (len(prefix), prefix)
+        ).rowcount
+        self.connection.commit()
+        return deleted
+
+
+class RedisBackend:
+    """Shared state of processes on any number of hosts, kept by a Redis-compatible server.
+
+    Speaks RESP over a single connection, commands of concurrent callers are sent one batch at a time.
+    """
+    __slots__ = ["host", "port", "database", "_reader", "_writer", "_lock"]
+    host: str
+    port: int
+    database: int
+    _reader: Optional[asyncio.StreamReader]
+    _writer: Optional[asyncio.StreamWriter]
+    _lock: asyncio.Lock
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 6379, database: int = 0):
+        self.host = host
+        self.port = port
+        self.database = database
+        self._reader = None
+        self._writer = None
+        self._lock = asyncio.Lock()
+
+    async def get_many(self, keys: list[str]) -> list[Optional[bytes]]:
+        return (await self._execute([("MGET", *keys)]))[0]
+
+    async def set_many(self, items: list[Tuple[str, bytes]], ttl: float) -> None:
+        await self._execute([("SET", key, value, "PX", int(ttl * 1000)) for key, value in items])
+
+    async def incr(self, key: str, ttl: float) -> int:
+        # Only the first increment creates the key with an expiry, INCR keeps it
+        _, value = await self._execute([("SET", key, 0, "PX", int(ttl * 1000), "NX"), ("INCR", key)])
+        return value
+
+    async def delete_prefix(self, prefix: str) -> int:
+        pattern: str = "".join("\\" + char if char in "*?[]\\" else char for char in prefix) + "*"
+        deleted: int = 0
+        cursor: bytes = b"0"
+        while True:
+            cursor, keys = (await self._execute([("SCAN", cursor, "MATCH", pattern, "COUNT", 1000)]))[0]
+            if keys:
+                deleted += (await self._execute([("DEL", *keys)]))[0]
+            if cursor == b"0":
+                return deleted
+
+    async def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            self._reader = self._writer = None
+
+    async def _execute(self, commands: list[tuple]) -> list:
+        async with self._lock:
+            try:
+                if self._writer is None:
+                    self._reader, self._writer = await asyncio.open_connection(self.host, self.port)
+                    if self.database:
+                        self._writer.write(_encode_command(("SELECT", self.database)))
+                        await _read_reply(self._reader)
+                self._writer.write(b"".join(_encode_command(command) for command in commands))
+                await self._writer.drain()
+                replies: list = [await _read_reply(self._reader) for _ in commands]
+            except (OSError, asyncio.IncompleteReadError) as error:
+                # The next command connects again
+                await self.close()
+                raise SharedStateError(f"{self.host}:{self.port}: {error!r}") from error
+            except BaseException:
+                # Cancelled or failed halfway through the batch, its unread replies would be taken for the next one's
+                await self.close()
+                raise
+        for reply in replies:
+            if isinstance(reply, SharedStateError):
+                raise reply
+        return replies
+
+
+def _encode_command(command: tuple) -> bytes:
+    parts: list[bytes] = [f"*{len(command)}\r\n".encode()]
+    for argument in command:
+        if not isinstance(argument, bytes):
+            argument = str(argument).encode()
+        parts.append(b"$%d\r\n%s\r\n" % (len(argument), argument))
+    return b"".join(parts)
+
+
+async def _read_reply(reader: asyncio.StreamReader) -> Union[None, int, bytes, list, SharedStateError]:
+    line: bytes = (await reader.readuntil(b"\r\n"))[:-2]
+    kind, payload = line[:1], line[1:]
+    if kind == b"+":
+        return payload
+    if kind == b"-":
+        # Returned rather than raised, the rest of the batch still has to be read
+        return SharedStateError(payload.decode(errors="replace"))
+    if kind == b":":
+        return int(payload)
+    if kind == b"$":
+        if payload == b"-1":
+            return None
+        return (await reader.readexactly(int(payload) + 2))[:-2]
+    if kind == b"*":
+        if payload == b"-1":
+            return None
+        return [await _read_reply(reader) for _ in range(int(payload))]
+    raise SharedStateError(f"Unexpected reply {line[:40]!r}")
+
+
+Backend = Union[MemoryBackend, SQLiteBackend, RedisBackend]
+
+
+def open_backend(url: str) -> Backend:
+    """Open the backend described by url: "memory", "sqlite:<path>" or "redis://<host>[:<port>][/<database>]"."""
+    if url == "memory":
+        return MemoryBackend()
+    if url.startswith("sqlite:"):
+        return SQLiteBackend(url[len("sqlite:"):])
+    if url.startswith("redis://"):
+        parts = urlsplit(url)
+        return RedisBackend(parts.hostname or "127.0.0.1", parts.port or 6379, int(parts.path.strip("/") or "0"))
+    raise ValueError(f"Unknown shared state backend {url!r}")
@@ -0,0 +1,103 @@
+import json
+import sqlite3
+import time
+from datetime import date
+from typing import Optional, Tuple
+
+
+class Storage:
+    """Small SQLite database for data that should survive restarts."""
+    __slots__ = ["connection", "binding_ttl"]
+    connection: sqlite3.Connection
+    binding_ttl: float
+
+    def __init__(self, path: str, binding_ttl: float = 24 * 60 * 60):
+        self.binding_ttl = binding_ttl
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS chat_groups ("
+            "chat_id INTEGER PRIMARY KEY, "
+            "groups TEXT NOT NULL, "
+            "updated_at REAL NOT NULL)"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS snapshots ("
+            "chat_id INTEGER NOT NULL, "
+            "schedule_date TEXT NOT NULL, "
+            "show_place TEXT NOT NULL, "
+            "body BLOB NOT NULL, "
+            "fetched_at REAL NOT NULL, "
+            "PRIMARY KEY (chat_id, schedule_date, show_place))"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS subscriptions ("
+            "chat_id INTEGER NOT NULL, "
+            "kind TEXT NOT NULL, "
+            "group_code TEXT NOT NULL, "
+            "minutes INTEGER NOT NULL, "
+            "PRIMARY KEY (chat_id, kind, group_code))"
+        )
+        self.connection.commit()
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def get_chat_groups(self, chat_id: int) -> Optional[list[dict]]:
+        """Return the "group" objects of the groups bound to the chat, or None if unknown or expired."""
+        row: Optional[tuple] = self.connection.execute(
+            "SELECT groups FROM chat_groups WHERE chat_id = ? AND updated_at > ?",
+            (chat_id, time.time() - self.binding_ttl)
+        ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def set_chat_groups(self, chat_id: int, groups: list[dict]) -> None:
+        self.connection.execute(
+            "INSERT OR REPLACE INTO chat_groups (chat_id, groups, updated_at) VALUES (?, ?, ?)",
+            (chat_id, json.dumps(groups, ensure_ascii=False), time.time())
+        )
+        self.connection.commit()
+
+    def forget_chat(self, chat_id: int) -> None:
+        self.connection.execute("DELETE FROM chat_groups WHERE chat_id = ?", (chat_id,))
+        self.connection.execute("DELETE FROM snapshots WHERE chat_id = ?", (chat_id,))
+        self.connection.commit()
+
+    def get_snapshot(self, chat_id: int, schedule_date: date, show_place: str) -> Optional[bytes]:
+        row: Optional[tuple] = self.connection.execute(
+            "SELECT body FROM snapshots WHERE chat_id = ? AND schedule_date = ? AND show_place = ?",
+            (chat_id, schedule_date.isoformat(), show_place)
+        ).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def put_snapshot(self, chat_id: int, schedule_date: date, show_place: str, body: bytes) -> None:
+        self.connection.execute(
+            "INSERT OR REPLACE INTO snapshots (chat_id, schedule_date, show_place, body, fetched_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (chat_id, schedule_date.isoformat(), show_place, body, time.time())
+        )
+        self.connection.commit()
+
+    def prune_snapshots(self, max_age: float) -> None:
+        self.connection.execute("DELETE FROM snapshots WHERE fetched_at < ?", (time.time() - max_age,))
+        self.connection.commit()
+
+    def get_subscriptions(self) -> list[Tuple[int, str, str, int]]:
+        """Return (chat_id, kind, group_code, minutes) of every subscription."""
+        return self.connection.execute("SELECT chat_id, kind, group_code, minutes FROM subscriptions").fetchall()
+
+    def set_subscription(self, chat_id: int, kind: str, group_code: str, minutes: int) -> None:
+        self.connection.execute(
+            "INSERT OR REPLACE INTO subscriptions (chat_id, kind, group_code, minutes) VALUES (?, ?, ?, ?)",
+            (chat_id, kind, group_code, minutes)
+        )
+        self.connection.commit()
+
+    def delete_subscriptions(self, chat_id: int) -> None:
+        self.connection.execute("DELETE FROM subscriptions WHERE chat_id = ?", (chat_id,))
+        self.connection.commit()
@@ -1,3 +1,6 @@
+from typing import Optional
+
+
 class Teacher:
     __slots__ = ["code", "name", "surname", "patronymic"]
     code: str
@@ -11,5 +14,19 @@ class Teacher:
         self.surname = data["surname"]
         self.patronymic = data["patronymic"]
 
+    @classmethod
+    def from_data(cls, data: dict) -> "Teacher":
+        # The same few teachers appear in every lesson of every group, so one object is kept per code
+        teacher: Optional[Teacher] = _teachers.get(data["code"])
+        if (teacher is None or
+                teacher.surname != data["surname"] or
+                teacher.name != data["name"] or
+                teacher.patronymic != data["patronymic"]):
+            teacher = _teachers[data["code"]] = cls(data)
+        return teacher
+
     def __str__(self):
         return self.surname + ' ' + self.name[0] + '.' + self.patronymic[0] + '.'
+
+
+_teachers: dict[str, Teacher] = {}
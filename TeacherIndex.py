@@ -0,0 +1,149 @@
+import bisect
+from datetime import date, timedelta
+from typing import Hashable, Optional, Tuple
+
+from Teacher import Teacher
+
+# week number, day number, minutes since midnight, group code, subgroup (-1 for the whole group), name, place, duration
+TeacherLesson = Tuple[int, int, int, str, int, str, str, int]
+
+
+class TeacherIndex:
+    """Where every teacher has lessons, built from group schedules the bot has fetched or imported.
+
+    Teachers are identified by their name as lessons print it, "Surname N.P.", because imported lessons name
+    teachers without a code. Lessons come in sources, a fetched day of a group or the imported lessons of a group,
+    and updating a source replaces only its own lessons.
+    """
+    __slots__ = ["_sources", "_lessons", "_names", "_codes", "_week_reference"]
+    # source: teacher: lessons
+    _sources: dict[Hashable, dict[str, list[TeacherLesson]]]
+    # teacher: source: lessons
+    _lessons: dict[str, dict[Hashable, list[TeacherLesson]]]
+    # (casefolded teacher, teacher), sorted for prefix search
+    _names: list[Tuple[str, str]]
+    _codes: dict[str, str]
+    # A date and its week number, every other week has the same number
+    _week_reference: Optional[Tuple[date, int]]
+
+    def __init__(self):
+        self._sources = {}
+        self._lessons = {}
+        self._names = []
+        self._codes = {}
+        self._week_reference = None
+
+    def update(self, source: Hashable, lessons: dict[str, list[TeacherLesson]]) -> None:
+        """Replace the lessons of a source, teacher: lessons."""
+        previous: dict[str, list[TeacherLesson]] = self._sources.pop(source, {})
+        for teacher in previous.keys() - lessons.keys():
+            teacher_sources: dict[Hashable, list[TeacherLesson]] = self._lessons[teacher]
+            del teacher_sources[source]
+            if not teacher_sources:
+                del self._lessons[teacher]
+                del self._names[bisect.bisect_left(self._names, (teacher.casefold(), teacher))]
+        for teacher, teacher_lessons in lessons.items():
+            if teacher not in self._lessons:
+                self._lessons[teacher] = {}
+                bisect.insort(self._names, (teacher.casefold(), teacher))
+            self._lessons[teacher][source] = teacher_lessons
+        if lessons:
+            self._sources[source] = lessons
+
+    def update_day(self, group_data: dict, schedule_date: date) -> None:
+        """Index one day of a group as the schedule API returns it."""
+        self._week_reference = (schedule_date, group_data["week_number"])
+        group_code: str = group_data["group"]["code"]
+        subgroups: list[Tuple[int, list[dict]]] = [(-1, group_data["first_subgroup"])]
+        if group_data["second_subgroup"]:
+            subgroups = [(1, group_data["first_subgroup"]), (2, group_data["second_subgroup"])]
+
+        # A lesson of the whole group is listed in both subgroups
+        found: dict[Tuple[str, int, str, str, int], set[int]] = {}
+        for subgroup, lessons_data in subgroups:
+            for lesson_data in lessons_data:
+                if lesson_data["canceled"]:
+                    continue
+                for teacher_data in lesson_data["lecturers"]:
+                    teacher: Teacher = Teacher.from_data(teacher_data)
+                    self._codes[str(teacher)] = teacher.code
+                    key: Tuple[str, int, str, str, int] = (
+                        str(teacher),
+                        int(lesson_data["time"]),
+                        lesson_data["names"][0] or lesson_data["names"][1],
+                        lesson_data["place"],
+                        int(lesson_data["duration"])
+                    )
+                    found.setdefault(key, set()).add(subgroup)
+
+        lessons: dict[str, list[TeacherLesson]] = {}
+        for (teacher, minutes, name, place, duration), found_subgroups in found.items():
+            lessons.setdefault(teacher, []).append((
+                group_data["week_number"],
+                schedule_date.weekday(),
+                minutes,
+                group_code,
+                found_subgroups.pop() if len(found_subgroups) == 1 else -1,
+                name,
+                place,
+                duration
+            ))
+        self.update(("day", group_code, group_data["week_number"], schedule_date.weekday()), lessons)
+
+    def update_imported(self, group_code: str, lessons_data: list[dict]) -> None:
+        """Index the imported APILesson dicts of a group, an empty list drops the group."""
+        lessons: dict[str, list[TeacherLesson]] = {}
+        for lesson_data in lessons_data:
+            for teacher in lesson_data["lecturers"]:
+                lessons.setdefault(teacher, []).append((
+                    lesson_data["week_number"],
+                    lesson_data["day_number"],
+                    lesson_data["time"],
+                    group_code,
+                    lesson_data["subgroup"],
+                    lesson_data["names"][0] or lesson_data["names"][1],
+                    lesson_data["place"],
+                    lesson_data["duration"]
+                ))
+        if self._week_reference is None and lessons_data:
+            start_date: list[int] = lessons_data[0]["start_date"]
+            self._week_reference = (date(*start_date), 1)
+        self.update(("imported", group_code), lessons)
+
+    def search(self, prefix: str, limit: int = 10) -> list[str]:
+        """Teachers whose name starts with prefix, case-insensitively, in alphabetical order."""
+        folded: str = prefix.casefold()
+        index: int = bisect.bisect_left(self._names, (folded, ""))
+        found: list[str] = []
+        while index < len(self._names) and len(found) < limit and self._names[index][0].startswith(folded):
+            found.append(self._names[index][1])
+            index += 1
+        return found
+
+    def code(self, teacher: str) -> Optional[str]:
+        return self._codes.get(teacher)
+
+    def week_number(self, schedule_date: date) -> Optional[int]:
+        """1 or 2, known once a fetched day or an imported semester gave a reference."""
+        if self._week_reference is None:
+            return None
+        reference_date, reference_week = self._week_reference
+        weeks: int = ((schedule_date - timedelta(days=schedule_date.weekday())) -
+                      (reference_date - timedelta(days=reference_date.weekday()))).days // 7
+        return reference_week if weeks % 2 == 0 else 3 - reference_week
+
+    def lessons(self, teacher: str, week_number: int, day_number: int) -> list[TeacherLesson]:
+        """Lessons of the teacher on a day, by time. The same lesson known from several sources is listed once."""
+        return sorted({
+            lesson
+            for teacher_lessons in self._lessons.get(teacher, {}).values()
+            for lesson in teacher_lessons
+            if lesson[0] == week_number and lesson[1] == day_number
+        })
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "teachers": len(self._lessons),
+            "sources": len(self._sources),
+            "lessons": sum(len(lessons) for source in self._sources.values() for lessons in source.values())
+        }
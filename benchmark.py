@@ -0,0 +1,1004 @@
+import argparse
+import asyncio
+import fnmatch
+import itertools
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import timeit
+import tracemalloc
+from datetime import date
+from typing import Callable, Optional, Union
+from urllib.parse import urlsplit, parse_qs
+
+import httpx
+from telegram import Update
+from telegram.ext import Application, Defaults, ExtBot
+
+import Day
+import ScheduleAPI
+
+
+def make_lesson_payload(index: int, group_index: int = 0) -> dict:
+    return {
+        "local_id": f"{group_index}-{index}",
+        "names": [f"Предмет {index}", ""],
+        "lesson_type": ("lecture", "practical", "laboratory")[index % 3],
+        "lecturers": [{
+            "code": f"T{group_index}-{index % 4}",
+            "name": "Іван",
+            "surname": f"Викладач{index % 4}",
+            "patronymic": "Петрович"
+        }],
+        "comment": "" if index % 2 else "Контрольна робота",
+        "place": "https://meet.google.com/abc-defg-hij" if index % 3 == 0 else f"{index}-{100 + group_index}",
+        "time": str(480 + 110 * (index % 6)),
+        "duration": "95",
+        "canceled": index == 4
+    }
+
+
+def make_day_payload(group_index: int = 0, lessons: int = 5, subgroups: bool = True) -> dict:
+    return {
+        "group": {
+            "code": f"ІП-{10 + group_index}",
+            "names": [f"ІП-{10 + group_index}"],
+            "desc": ""
+        },
+        "week_number": 1,
+        "first_subgroup": [make_lesson_payload(index, group_index) for index in range(lessons)],
+        "second_subgroup": [make_lesson_payload(index, group_index) for index in range(lessons)] if subgroups else []
+    }
+
+
+class StubScheduleServer:
+    """Minimal HTTP/1.1 keep-alive server imitating /scheduleBySubgroupsTg."""
+    __slots__ = ["groups", "lessons", "latency", "requests", "_server"]
+    groups: int
+    lessons: int
+    latency: float
+    requests: int
+    _server: Optional[asyncio.AbstractServer]
+
+    def __init__(self, groups: int = 1, lessons: int = 5, latency: float = 0.1):
+        self.groups = groups
+        self.lessons = lessons
+        self.latency = latency
+        self.requests = 0
+        self._server = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        self._server = await asyncio.start_server(self._handle, host, port)
+        bound_host, bound_port = self._server.sockets[0].getsockname()[:2]
+        return f"http://{bound_host}:{bound_port}"
+
+    async def stop(self) -> None:
+        self._server.close()
+        await self._server.wait_closed()
+
+    def make_body(self, params: dict[str, list[str]]) -> bytes:
+        return json.dumps(
+            [make_day_payload(group_index, self.lessons) for group_index in range(self.groups)],
+            ensure_ascii=False
+        ).encode()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request_line: bytes = await reader.readline()
+                if not request_line:
+                    break
+                while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                self.requests += 1
+                await asyncio.sleep(self.latency)
+                body: bytes = self.make_body(parse_qs(urlsplit(request_line.split()[1].decode()).query))
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\n"
+                    b"Content-Type: application/json\r\n"
+                    b"Content-Length: " + str(len(body)).encode() + b"\r\n\r\n" + body
+                )
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+async def bench_api(concurrency: int, latency: float) -> None:
+    server: StubScheduleServer = StubScheduleServer(latency=latency)
+    url_base: str = await server.start()
+    ScheduleAPI.init_client()
+    try:
+        begin: float = time.perf_counter()
+        await asyncio.gather(*(
+            ScheduleAPI.get_schedule_data(url_base, chat_id, date.today(), None) for chat_id in range(concurrency)
+        ))
+        elapsed: float = time.perf_counter() - begin
+    finally:
+        await ScheduleAPI.close_client()
+        await server.stop()
+
+    print(f"{concurrency} concurrent requests, {latency * 1000:.0f} ms upstream latency: "
+          f"{elapsed * 1000:.0f} ms total (sequential would take {concurrency * latency * 1000:.0f} ms)")
+
+
+def bench_render(iterations: int, lessons: int) -> None:
+    body: bytes = json.dumps([make_day_payload(0, lessons)], ensure_ascii=False).encode()
+    response: httpx.Response = httpx.Response(200, content=body)
+    data: dict = response.json()[0]
+    schedule_date: date = date(2023, 10, 2)
+    day: Day.Day = Day.Day(data, schedule_date)
+
+    cases: dict[str, Callable[[], str]] = {
+        "Day() + get_telegram_message": lambda: Day.Day(data, schedule_date).get_telegram_message("ІП-10"),
+        "get_telegram_message": lambda: day.get_telegram_message("ІП-10"),
+        "render_day (memoized)": lambda: Day.render_day(
+            data, schedule_date, "ІП-10", ScheduleAPI.payload_digest(response)
+        )
+    }
+    for name, case in cases.items():
+        elapsed: float = timeit.timeit(case, number=iterations)
+        print(f"{name}: {elapsed / iterations * 1e6:.1f} us per render")
+
+
+def bench_decode(groups: int, lessons: int, iterations: int) -> None:
+    body: bytes = json.dumps(
+        [make_day_payload(group_index, lessons) for group_index in range(groups)],
+        ensure_ascii=False
+    ).encode()
+    response: httpx.Response = httpx.Response(200, content=body)
+    schedule_date: date = date(2023, 10, 2)
+
+    def decode() -> list[Day.Day]:
+        return [Day.Day(group_data, schedule_date) for group_data in ScheduleAPI.decode_response(response)]
+
+    elapsed: float = timeit.timeit(decode, number=iterations) / iterations
+    tracemalloc.start()
+    days: list[Day.Day] = decode()
+    retained: int = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    print(f"{groups} groups x {2 * lessons} lessons, {len(body) / 1024:.0f} KiB payload: "
+          f"{elapsed * 1000:.2f} ms per decode, {retained / 1024:.0f} KiB retained by {len(days)} days")
+
+
+def make_command_update(update_id: int, chat_id: int, text: str = "/te") -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "group", "title": f"Chat {chat_id}"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Student"},
+            "text": text,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        }
+    }
+
+
+def make_callback_update(update_id: int, chat_id: int, data: str) -> dict:
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "chat_instance": str(chat_id),
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Student"},
+            "data": data,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "group", "title": f"Chat {chat_id}"},
+                "from": {"id": RecordingBot.BOT_ID, "is_bot": True, "first_name": "SchedBot"},
+                "text": "Пари на попередній день"
+            }
+        }
+    }
+
+
+def make_inline_update(update_id: int, user_id: int, query: str) -> dict:
+    return {
+        "update_id": update_id,
+        "inline_query": {
+            # RecordingBot tells whose query was answered by the id
+            "id": str(user_id),
+            "from": {"id": user_id, "is_bot": False, "first_name": "Student"},
+            "query": query,
+            "offset": ""
+        }
+    }
+
+
+class RecordingBot(ExtBot):
+    """Bot that answers Bot API calls locally and records them instead of talking to Telegram."""
+    __slots__ = ["calls", "_replies", "_message_ids"]
+    BOT_ID: int = 123456
+    calls: list[tuple[str, dict]]
+    # Resolved by the first message sent or edited in the chat, or by the answer to the user's inline query
+    _replies: dict[int, asyncio.Future]
+    _message_ids: itertools.count
+
+    def __init__(self, defaults: Defaults):
+        super().__init__(f"{self.BOT_ID}:BENCHMARK", defaults=defaults)
+        with self._unfrozen():
+            self.calls = []
+            self._replies = {}
+            self._message_ids = itertools.count(1)
+
+    def expect_reply(self, chat_id: int) -> asyncio.Future:
+        """chat_id is the user's id for inline queries."""
+        self._replies[chat_id] = asyncio.get_running_loop().create_future()
+        return self._replies[chat_id]
+
+    async def _do_post(self, endpoint: str, data: dict, **timeouts) -> Union[bool, dict, list[dict]]:
+        self.calls.append((endpoint, data))
+        match endpoint:
+            case "getMe":
+                return {"id": self.BOT_ID, "is_bot": True, "first_name": "SchedBot", "username": "schedbot_bench_bot"}
+            case "answerInlineQuery":
+                self._resolve(int(data["inline_query_id"]), endpoint)
+                return True
+            case "sendMessage" | "editMessageText":
+                chat_id: int = int(data["chat_id"])
+                self._resolve(chat_id, endpoint)
+                return {
+                    "message_id": next(self._message_ids),
+                    "date": int(time.time()),
+                    "chat": {"id": chat_id, "type": "group", "title": f"Chat {chat_id}"},
+                    "from": {"id": self.BOT_ID, "is_bot": True, "first_name": "SchedBot"},
+                    "text": data["text"]
+                }
+            case _:
+                return True
+
+    def _resolve(self, chat_id: int, endpoint: str) -> None:
+        reply: Optional[asyncio.Future] = self._replies.pop(chat_id, None)
+        if reply is not None and not reply.done():
+            reply.set_result(endpoint)
+
+
+# scenario: (groups bound to every chat, update for the n-th chat)
+HANDLER_SCENARIOS: dict[str, tuple[int, Callable[[int, int], dict]]] = {
+    "te": (1, lambda update_id, chat_id: make_command_update(update_id, chat_id, "/te")),
+    "te_t": (1, lambda update_id, chat_id: make_command_update(update_id, chat_id, "/te_t")),
+    "picker": (3, lambda update_id, chat_id: make_command_update(update_id, chat_id, "/te")),
+    "callback": (1, lambda update_id, chat_id: make_callback_update(
+        update_id,
+        chat_id,
+        f"UPDATE_SCHEDULE|{date.today().strftime('%d.%m.%Y')}|{make_day_payload(0)['group']['code']}"
+    )),
+    # Includes the debounce delay of inline queries
+    "inline": (2, lambda update_id, user_id: make_inline_update(update_id, user_id, "ІП завтра"))
+}
+
+
+async def bench_handlers(
+        scenarios: list[str],
+        concurrency_levels: list[int],
+        count: int,
+        lessons: int,
+        latency: float,
+        max_p99: Optional[float]
+) -> bool:
+    """Run the real handlers against the stub API and a recording bot. Returns False if a p99 exceeds max_p99 ms."""
+    import main as bot
+
+    server: StubScheduleServer = StubScheduleServer(lessons=lessons, latency=latency)
+    bot.baseUrl = await server.start()
+    database_directory: tempfile.TemporaryDirectory = tempfile.TemporaryDirectory()
+    os.environ["SCHEDULE_BOT_DB"] = os.path.join(database_directory.name, "benchmark.sqlite3")
+    recording_bot: RecordingBot = RecordingBot(bot.bot_defaults())
+    application: Application = bot.build_application(recording_bot.token, recording_bot)
+    await application.initialize()
+    await application.post_init(application)
+    await application.start()
+
+    passed: bool = True
+    first_chat: int = 1
+    try:
+        for scenario in scenarios:
+            server.groups, make_update = HANDLER_SCENARIOS[scenario]
+            for concurrency in concurrency_levels:
+                # Fresh chats for every run, so that runs don't warm each other's caches
+                chats: range = range(first_chat, first_chat + count)
+                first_chat += count
+                updates: list[Update] = [
+                    Update.de_json(make_update(chat_id, chat_id), recording_bot) for chat_id in chats
+                ]
+                requests_before: int = server.requests
+                calls_before: int = len(recording_bot.calls)
+                latencies: list[float] = []
+
+                async def worker() -> None:
+                    while updates:
+                        update: Update = updates.pop()
+                        reply: asyncio.Future = recording_bot.expect_reply(
+                            update.effective_user.id if update.effective_chat is None else update.effective_chat.id
+                        )
+                        begin: float = time.perf_counter()
+                        await application.process_update(update)
+                        # Callbacks are answered from a task of the debouncer
+                        await asyncio.wait_for(reply, 10)
+                        latencies.append(time.perf_counter() - begin)
+
+                begin: float = time.perf_counter()
+                await asyncio.gather(*(worker() for _ in range(concurrency)))
+                elapsed: float = time.perf_counter() - begin
+
+                latencies.sort()
+                p50: float = latencies[len(latencies) // 2] * 1000
+                p99: float = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000
+                print(
+                    f"{scenario:>8}, concurrency {concurrency:>4}: {count / elapsed:>7.0f} updates/s, "
+                    f"p50 {p50:>7.1f} ms, p99 {p99:>7.1f} ms, "
+                    f"{server.requests - requests_before} upstream requests, "
+                    f"{len(recording_bot.calls) - calls_before} bot calls"
+                )
+                if max_p99 is not None and p99 > max_p99:
+                    passed = False
+    finally:
+        await application.stop()
+        await application.post_shutdown(application)
+        await application.shutdown()
+        await server.stop()
+        database_directory.cleanup()
+    return passed
+
+
+async def bench_webhook(
+        url: str,
+        secret: Optional[str],
+        updates_path: Optional[str],
+        count: int,
+        concurrency: int
+) -> None:
+    if updates_path is None:
+        recorded: list[dict] = [make_command_update(0, chat_id) for chat_id in range(1, 101)]
+    else:
+        with open(updates_path, encoding="utf-8") as updates_file:
+            recorded = [json.loads(line) for line in updates_file if line.strip()]
+
+    headers: dict[str, str] = {} if secret is None else {"X-Telegram-Bot-Api-Secret-Token": secret}
+    queue: asyncio.Queue[dict] = asyncio.Queue()
+    for update_id in range(count):
+        queue.put_nowait({**recorded[update_id % len(recorded)], "update_id": update_id + 1})
+
+    failures: int = 0
+
+    async def worker(client: httpx.AsyncClient) -> None:
+        nonlocal failures
+        while not queue.empty():
+            response: httpx.Response = await client.post(url, json=queue.get_nowait(), headers=headers)
+            if response.status_code != 200:
+                failures += 1
+
+    async with httpx.AsyncClient(limits=httpx.Limits(max_connections=concurrency)) as client:
+        begin: float = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed: float = time.perf_counter() - begin
+
+    print(f"{count} updates with concurrency {concurrency}: {count / elapsed:.0f} updates/s, {failures} rejected")
+
+
+class StubBotAPIServer:
+    """Minimal HTTP/1.1 keep-alive server imitating the Bot API methods the bot calls, counting them."""
+    __slots__ = ["calls", "_sent", "_server"]
+    calls: dict[str, int]
+    _sent: asyncio.Event
+    _server: Optional[asyncio.AbstractServer]
+
+    def __init__(self):
+        self.calls = {}
+        self._sent = asyncio.Event()
+        self._server = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        self._server = await asyncio.start_server(self._handle, host, port)
+        bound_host, bound_port = self._server.sockets[0].getsockname()[:2]
+        return f"http://{bound_host}:{bound_port}"
+
+    async def stop(self) -> None:
+        self._server.close()
+
+    async def wait_for(self, method: str, count: int, timeout: float) -> None:
+        async def wait() -> None:
+            while self.calls.get(method, 0) < count:
+                self._sent.clear()
+                await self._sent.wait()
+
+        await asyncio.wait_for(wait(), timeout)
+
+    def make_result(self, method: str, params: dict[str, list[str]]) -> object:
+        match method:
+            case "getMe":
+                return {"id": RecordingBot.BOT_ID, "is_bot": True, "first_name": "SchedBot", "username": "schedbot_bot"}
+            case "sendMessage" | "editMessageText":
+                chat_id: int = int(params.get("chat_id", ["0"])[0])
+                return {
+                    "message_id": self.calls[method],
+                    "date": int(time.time()),
+                    "chat": {"id": chat_id, "type": "group", "title": f"Chat {chat_id}"},
+                    "from": {"id": RecordingBot.BOT_ID, "is_bot": True, "first_name": "SchedBot"},
+                    "text": params.get("text", [""])[0]
+                }
+            case _:
+                return True
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request_line: bytes = await reader.readline()
+                if not request_line:
+                    break
+                length: int = 0
+                while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    name, _, value = line.partition(b":")
+                    if name.strip().lower() == b"content-length":
+                        length = int(value)
+                request_body: bytes = await reader.readexactly(length)
+                method: str = request_line.split()[1].decode().rsplit("/", 1)[-1]
+                self.calls[method] = self.calls.get(method, 0) + 1
+                self._sent.set()
+                body: bytes = json.dumps(
+                    {"ok": True, "result": self.make_result(method, parse_qs(request_body.decode()))},
+                    ensure_ascii=False
+                ).encode()
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\n"
+                    b"Content-Type: application/json\r\n"
+                    b"Content-Length: " + str(len(body)).encode() + b"\r\n\r\n" + body
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+class FakeRedisServer:
+    """In-process server speaking enough of the Redis protocol for SharedState.RedisBackend."""
+    __slots__ = ["commands", "_entries", "_server"]
+    commands: int
+    # key: (expires at or None, value)
+    _entries: dict[bytes, tuple[Optional[float], bytes]]
+    _server: Optional[asyncio.AbstractServer]
+
+    def __init__(self):
+        self.commands = 0
+        self._entries = {}
+        self._server = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        self._server = await asyncio.start_server(self._handle, host, port)
+        bound_host, bound_port = self._server.sockets[0].getsockname()[:2]
+        return f"redis://{bound_host}:{bound_port}"
+
+    async def stop(self) -> None:
+        self._server.close()
+
+    def _get(self, key: bytes) -> Optional[bytes]:
+        entry: Optional[tuple[Optional[float], bytes]] = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] is not None and entry[0] <= time.monotonic():
+            del self._entries[key]
+            return None
+        return entry[1]
+
+    def execute(self, command: list[bytes]) -> object:
+        self.commands += 1
+        name: str = command[0].decode().upper()
+        match name:
+            case "PING" | "SELECT":
+                return "OK"
+            case "MGET":
+                return [self._get(key) for key in command[1:]]
+            case "SET":
+                options: list[str] = [option.decode().upper() for option in command[3:]]
+                if "NX" in options and self._get(command[1]) is not None:
+                    return None
+                expires_at: Optional[float] = None
+                if "PX" in options:
+                    expires_at = time.monotonic() + int(command[3 + options.index("PX") + 1]) / 1000
+                self._entries[command[1]] = (expires_at, command[2])
+                return "OK"
+            case "INCR":
+                value: int = int(self._get(command[1]) or b"0") + 1
+                self._entries[command[1]] = (self._entries.get(command[1], (None, b""))[0], str(value).encode())
+                return value
+            case "SCAN":
+                pattern: str = command[command.index(b"MATCH") + 1].decode() if b"MATCH" in command else "*"
+                keys: list[bytes] = [key for key in list(self._entries) if self._get(key) is not None]
+                return [b"0", [key for key in keys if fnmatch.fnmatchcase(key.decode(), pattern)]]
+            case "DEL":
+                return sum(self._entries.pop(key, None) is not None for key in command[1:])
+            case _:
+                return ValueError(f"ERR unknown command '{name}'")
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                header: bytes = await reader.readuntil(b"\r\n")
+                command: list[bytes] = []
+                for _ in range(int(header[1:-2])):
+                    length: int = int((await reader.readuntil(b"\r\n"))[1:-2])
+                    command.append((await reader.readexactly(length + 2))[:-2])
+                writer.write(self._encode(self.execute(command)))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def _encode(self, reply: object) -> bytes:
+        if reply is None:
+            return b"$-1\r\n"
+        if isinstance(reply, ValueError):
+            return f"-{reply}\r\n".encode()
+        if isinstance(reply, str):
+            return f"+{reply}\r\n".encode()
+        if isinstance(reply, int):
+            return f":{reply}\r\n".encode()
+        if isinstance(reply, bytes):
+            return b"$%d\r\n%s\r\n" % (len(reply), reply)
+        return f"*{len(reply)}\r\n".encode() + b"".join(self._encode(item) for item in reply)
+
+
+def free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+async def bench_workers(
+        worker_counts: list[int],
+        shared_state: str,
+        count: int,
+        lessons: int,
+        latency: float,
+        concurrency: int
+) -> None:
+    """Run main.py behind its webhook, as one process or as a front with workers, against stub APIs."""
+    schedule_server: StubScheduleServer = StubScheduleServer(lessons=lessons, latency=latency)
+    bot_api: StubBotAPIServer = StubBotAPIServer()
+    redis_server: FakeRedisServer = FakeRedisServer()
+    environment: dict[str, str] = {
+        **os.environ,
+        "SCHEDULE_BOT_URL_BASE": await schedule_server.start(),
+        "SCHEDULE_BOT_TELEGRAM_URL": await bot_api.start(),
+        "SCHEDULE_BOT_WEBHOOK_URL": "https://bot.example.com",
+        "SCHEDULE_BOT_PREFETCH_RADIUS": "0"
+    }
+    if shared_state == "redis":
+        environment["SCHEDULE_BOT_SHARED_STATE"] = await redis_server.start()
+    elif shared_state == "memory":
+        environment["SCHEDULE_BOT_SHARED_STATE"] = "memory"
+
+    try:
+        for workers in worker_counts:
+            directory: tempfile.TemporaryDirectory = tempfile.TemporaryDirectory()
+            port: int = free_port()
+            log_path: str = os.path.join(directory.name, "bot.log")
+            with open(log_path, "wb") as log_file:
+                process: asyncio.subprocess.Process = await asyncio.create_subprocess_exec(
+                    sys.executable, "main.py", f"{RecordingBot.BOT_ID}:BENCHMARK",
+                    cwd=os.path.dirname(os.path.abspath(__file__)),
+                    env={
+                        **environment,
+                        "SCHEDULE_BOT_DB": os.path.join(directory.name, "benchmark.sqlite3"),
+                        "SCHEDULE_BOT_WEBHOOK_PORT": str(port),
+                        "SCHEDULE_BOT_WORKERS": str(workers)
+                    },
+                    stdout=log_file,
+                    stderr=log_file
+                )
+            try:
+                webhooks_before: int = bot_api.calls.get("setWebhook", 0)
+                await bot_api.wait_for("setWebhook", webhooks_before + 1, 60)
+                results: list[str] = []
+                # /te binds the chats to their groups, /te_t then finds tomorrow's schedules shared between them
+                for command in ("/te", "/te_t"):
+                    requests_before: int = schedule_server.requests
+                    sent_before: int = bot_api.calls.get("sendMessage", 0)
+                    queue: asyncio.Queue[dict] = asyncio.Queue()
+                    for chat_id in range(1, count + 1):
+                        queue.put_nowait(make_command_update(chat_id, chat_id, command))
+
+                    async def post(client: httpx.AsyncClient) -> None:
+                        while not queue.empty():
+                            response: httpx.Response = await client.post(
+                                f"http://127.0.0.1:{port}/telegram",
+                                json=queue.get_nowait()
+                            )
+                            response.raise_for_status()
+
+                    begin: float = time.perf_counter()
+                    async with httpx.AsyncClient(limits=httpx.Limits(max_connections=concurrency)) as client:
+                        await asyncio.gather(*(post(client) for _ in range(concurrency)))
+                    await bot_api.wait_for("sendMessage", sent_before + count, 120)
+                    elapsed: float = time.perf_counter() - begin
+                    results.append(
+                        f"{command} {count / elapsed:.0f} updates/s, "
+                        f"{schedule_server.requests - requests_before} upstream requests"
+                    )
+                print(f"{workers} worker(s), {shared_state} shared state: {'; '.join(results)}")
+            except (asyncio.TimeoutError, httpx.HTTPError) as error:
+                print(f"{workers} worker(s): failed with {error!r}, log follows")
+                with open(log_path, encoding="utf-8", errors="replace") as log_file:
+                    print(log_file.read()[-3000:])
+            finally:
+                process.terminate()
+                await process.wait()
+                directory.cleanup()
+    finally:
+        await schedule_server.stop()
+        await bot_api.stop()
+        if shared_state == "redis":
+            await redis_server.stop()
+
+
+def bench_teachers(groups: int, lessons: int, iterations: int) -> None:
+    from TeacherIndex import TeacherIndex
+
+    # Every group's fetched week, Monday to Saturday
+    days: list[tuple[dict, date]] = [
+        (make_day_payload(group_index, lessons), date(2023, 10, 2 + weekday))
+        for group_index in range(groups)
+        for weekday in range(6)
+    ]
+    index: TeacherIndex = TeacherIndex()
+    begin: float = time.perf_counter()
+    for group_data, schedule_date in days:
+        index.update_day(group_data, schedule_date)
+    elapsed: float = time.perf_counter() - begin
+    print(f"{groups} groups x 6 days: {elapsed * 1000:.1f} ms to build, {index.stats()}")
+
+    cases: dict[str, Callable[[], object]] = {
+        "search": lambda: index.search("Викладач1"),
+        "search + day lessons": lambda: index.lessons(index.search("Викладач1")[0], 1, 0),
+        "update one day": lambda: index.update_day(*days[len(days) // 2])
+    }
+    for name, case in cases.items():
+        elapsed = timeit.timeit(case, number=iterations) / iterations
+        print(f"{name}: {elapsed * 1e6:.1f} us")
+
+
+def bench_rooms(groups: int, lessons: int, iterations: int) -> None:
+    from RoomOccupancy import RoomOccupancy
+
+    days: list[tuple[dict, date]] = [
+        (make_day_payload(group_index, lessons), date(2023, 10, 2 + weekday))
+        for group_index in range(groups)
+        for weekday in range(6)
+    ]
+    occupancy: RoomOccupancy = RoomOccupancy()
+    begin: float = time.perf_counter()
+    for group_data, schedule_date in days:
+        occupancy.update_day(group_data, schedule_date)
+    elapsed: float = time.perf_counter() - begin
+    print(f"{groups} groups x 6 days: {elapsed * 1000:.1f} ms to build, {occupancy.stats()}")
+
+    cases: dict[str, Callable[[], object]] = {
+        "free rooms at one pair": lambda: occupancy.free_rooms(1, 2, 2),
+        "update one day": lambda: occupancy.update_day(*days[len(days) // 2])
+    }
+    for name, case in cases.items():
+        elapsed = timeit.timeit(case, number=iterations) / iterations
+        print(f"{name}: {elapsed * 1e6:.1f} us")
+
+
+def make_imported_lessons(group_index: int, lessons: int) -> list[dict]:
+    """A group's semester as importer.py writes it, lessons per day of both weeks, every third one per subgroup."""
+    return [
+        {
+            "group_code": f"ІП-{10 + group_index}",
+            "time": 480 + 110 * index,
+            "day_number": day_number,
+            "week_number": week_number,
+            "start_date": [2023, 9, 1],
+            "end_date": [2023, 12, 22],
+            "template": "1",
+            "lecturers": [f"Викладач{(group_index + index) % 40} І.П."],
+            "names": [f"Предмет {index}", ""],
+            "comment": "",
+            "duration": 90,
+            "place": f"{index}.{100 + group_index % 50}",
+            "lesson_type": ("Лекція", "Практичне", "Лабораторна")[index % 3],
+            "recordings": [],
+            "subgroup": index % 3
+        }
+        for week_number in (1, 2)
+        for day_number in range(6)
+        for index in range(lessons)
+    ]
+
+
+def bench_calendar(groups: int, lessons: int, iterations: int) -> None:
+    from SemesterCalendar import SemesterCalendar
+
+    imported: list[list[dict]] = [make_imported_lessons(group_index, lessons) for group_index in range(groups)]
+    calendar: SemesterCalendar = SemesterCalendar()
+    begin: float = time.perf_counter()
+    for group_lessons in imported:
+        calendar.update_imported(group_lessons[0]["group_code"], group_lessons)
+    elapsed: float = time.perf_counter() - begin
+    # Expanded again into another calendar, tracing would slow down the timed run
+    tracemalloc.start()
+    traced: SemesterCalendar = SemesterCalendar()
+    for group_lessons in imported:
+        traced.update_imported(group_lessons[0]["group_code"], group_lessons)
+    retained: int = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del traced
+    print(f"{groups} groups x {len(imported[0])} lessons: {elapsed * 1000:.1f} ms to expand the semester, "
+          f"{retained / 1024:.0f} KiB retained, {calendar.stats()}")
+
+    begin = time.perf_counter()
+    for group_lessons in imported:
+        calendar.update_overrides(group_lessons[0]["group_code"], [
+            {"group_code": group_lessons[0]["group_code"], "date": [2023, 10, 3], "time": 480, "canceled": True},
+            {"group_code": group_lessons[0]["group_code"], "date": [2023, 11, 7], "time": 590, "comment": "Online"}
+        ])
+    elapsed = time.perf_counter() - begin
+    print(f"two overrides per group: {elapsed * 1000:.1f} ms to expand again")
+
+    group_code: str = imported[groups // 2][0]["group_code"]
+    day_date: date = date(2023, 10, 3)
+    response: httpx.Response = httpx.Response(
+        200,
+        content=b"[" + ScheduleAPI.encode_payload(calendar.payload(group_code, day_date)) + b"]"
+    )
+    cases: dict[str, Callable[[], object]] = {
+        "day payload lookup": lambda: calendar.payload(group_code, day_date),
+        "Day from the calendar": lambda: calendar.day(group_code, day_date),
+        "Day from a cached response": lambda: Day.Day(ScheduleAPI.decode_response(response)[0], day_date),
+        "expand one group": lambda: calendar.update_imported(group_code, imported[groups // 2])
+    }
+    for name, case in cases.items():
+        elapsed = timeit.timeit(case, number=iterations) / iterations
+        print(f"{name}: {elapsed * 1e6:.1f} us")
+
+
+def bench_pdf(filepath: str, pages: Optional[range]) -> None:
+    import parser
+
+    results: dict[str, list[tuple]] = {}
+    for backend in ("pdfplumber", "tabula"):
+        begin: float = time.perf_counter()
+        try:
+            lessons: list[parser.APILesson] = parser.schedule_pdf_to_list(filepath, pages, backend)
+        except Exception as error:
+            print(f"{backend}: unavailable ({error!r})")
+            continue
+        elapsed: float = time.perf_counter() - begin
+        results[backend] = [tuple(getattr(lesson, name) for name in parser.APILesson.__slots__) for lesson in lessons]
+        print(f"{backend}: {elapsed:.2f} s, {len(lessons)} lessons")
+
+    if len(results) == 2:
+        print("outputs are identical" if results["pdfplumber"] == results["tabula"] else "outputs differ")
+
+
+# The lookalike-tolerant pattern the parser used before cell_classifier, kept as the baseline
+LEGACY_LESSON_CELL_PATTERN: str = (
+    r"^(.*?)\r?(\d{1,2}\. \d{3}\w?)?\r?(Л(?:а|a)б(?:о|o)(?:р|p)(?:а|a)т(?:о|o)(?:р|p)н(?:а|a)|"
+    r"П(?:р|p)(?:а|a)ктичн(?:е|e)|Л(?:е|e)кц(?:і|i)я)\r?(.*?)\r?([A-ZА-ЯІЇЄ].*? .?\..?\.)$"
+)
+
+
+def make_timetable_page(seed: int) -> "pandas.DataFrame":
+    import pandas
+
+    lesson_types: tuple[str, ...] = ("Лекція", "Лекцiя", "Лaбoратoрна", "Пpактичнe", "Практичне")
+    rows: list[list[Optional[str]]] = [[None] * 6 for _ in range(38)]
+    for row in range(2, 38):
+        for column in range(2, 6):
+            kind: int = (row * 7 + column * 3 + seed) % 5
+            if kind == 0:
+                rows[row][column] = (f"Програмування {row}\r{row % 9 + 1}. 3{row:02d}\r"
+                                     f"{lesson_types[(row + seed) % 5]}\rДоцент\rІваненко І.І.")
+            elif kind == 1:
+                rows[row][column] = (f"Фізика {row}", f"{row % 9 + 1}. 2{row:02d}", "Практичне\rДоц.",
+                                     "Петренко П.П.")[column - 2]
+    return pandas.DataFrame(rows[1:], columns=["День", "Пара", "1", "2", "3", "4"])
+
+
+def bench_cells(pages: int) -> None:
+    import re
+    import pandas
+    import cell_classifier
+
+    timetable: list[pandas.DataFrame] = [make_timetable_page(seed) for seed in range(pages)]
+    cells: int = sum(int(page.iloc[1:, 2:6].notna().to_numpy().sum()) for page in timetable)
+
+    def legacy() -> int:
+        matched: int = 0
+        for page in timetable:
+            for row in page.itertuples():
+                if row.Index < 2:
+                    continue
+                for ind, value in enumerate(row):
+                    if (ind not in range(3, 7)) or pandas.isna(value):
+                        continue
+                    if len(re.findall(LEGACY_LESSON_CELL_PATTERN, value)):
+                        matched += 1
+        return matched
+
+    def classified() -> int:
+        return sum(
+            fields is not None for page in timetable for _, _, _, fields in cell_classifier.classify_page(page)
+        )
+
+    assert legacy() == classified()
+    for name, case in (("itertuples + re.findall", legacy), ("classify_page", classified)):
+        elapsed: float = timeit.timeit(case, number=5) / 5
+        print(f"{name}: {elapsed * 1000:.1f} ms for {cells} cells ({elapsed / cells * 1e6:.2f} us per cell)")
+
+
+# Modules the bot itself must not load, they belong to the timetable import
+HEAVY_MODULES: tuple[str, ...] = ("pandas", "numpy", "tabula", "pdfplumber", "requests")
+
+
+def bench_imports(modules: list[str], top: int, max_ms: Optional[float]) -> bool:
+    """Import every module in a fresh interpreter with -X importtime, return whether the limits hold."""
+    passed: bool = True
+    for module in modules:
+        result: subprocess.CompletedProcess = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True
+        )
+        if result.returncode != 0:
+            print(f"import {module}: failed\n{result.stderr.strip().splitlines()[-1]}")
+            passed = False
+            continue
+
+        # "import time: self [us] | cumulative | imported package", nested imports are indented
+        timings: list[tuple[int, str]] = []
+        total: int = 0
+        for line in result.stderr.splitlines():
+            if not line.startswith("import time:") or "[us]" in line:
+                continue
+            _, cumulative, name = line[len("import time:"):].split("|")
+            timings.append((int(cumulative), name.strip()))
+            if not name.startswith("  "):
+                total += int(cumulative)
+        loaded: set[str] = {name.split(".")[0] for _, name in timings}
+        heavy: list[str] = [name for name in HEAVY_MODULES if name in loaded]
+
+        print(f"import {module}: {total / 1000:.1f} ms, {len(timings)} modules")
+        for cumulative, name in sorted(timings, reverse=True)[:top]:
+            print(f"  {cumulative / 1000:8.1f} ms  {name}")
+        if heavy:
+            print(f"  loads {', '.join(heavy)}")
+            passed = False
+        if max_ms is not None and total / 1000 > max_ms:
+            print(f"  slower than {max_ms:g} ms")
+            passed = False
+    return passed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="SchedBot benchmarks")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    api_parser = subparsers.add_parser("api", help="concurrent requests against a local stub API")
+    api_parser.add_argument("--concurrency", type=int, default=50)
+    api_parser.add_argument("--latency", type=float, default=0.2)
+
+    render_parser = subparsers.add_parser("render", help="day rendering cost")
+    render_parser.add_argument("--iterations", type=int, default=20000)
+    render_parser.add_argument("--lessons", type=int, default=6, help="lessons per subgroup")
+
+    decode_parser = subparsers.add_parser("decode", help="response decoding into Day objects")
+    decode_parser.add_argument("--groups", type=int, default=200)
+    decode_parser.add_argument("--lessons", type=int, default=6, help="lessons per subgroup")
+    decode_parser.add_argument("--iterations", type=int, default=20)
+
+    webhook_parser = subparsers.add_parser("webhook", help="replay updates against a running webhook listener")
+    webhook_parser.add_argument("--url", default="http://127.0.0.1:8443/telegram")
+    webhook_parser.add_argument("--secret", default=None)
+    webhook_parser.add_argument("--updates", default=None, help="JSONL file with one recorded update per line")
+    webhook_parser.add_argument("--count", type=int, default=1000)
+    webhook_parser.add_argument("--concurrency", type=int, default=32)
+
+    pdf_parser = subparsers.add_parser("pdf", help="compare PDF extraction backends on a timetable")
+    pdf_parser.add_argument("file")
+    pdf_parser.add_argument("--pages", type=int, nargs=2, metavar=("FIRST", "LAST"), default=None,
+                            help="zero-based, inclusive page range")
+
+    cells_parser = subparsers.add_parser("cells", help="timetable cell classification")
+    cells_parser.add_argument("--pages", type=int, default=50)
+
+    handlers_parser = subparsers.add_parser("handlers", help="bot handlers against a stub API and a recording bot")
+    handlers_parser.add_argument(
+        "--scenarios",
+        nargs="+",
+        choices=list(HANDLER_SCENARIOS),
+        default=list(HANDLER_SCENARIOS)
+    )
+    handlers_parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16, 64])
+    handlers_parser.add_argument("--count", type=int, default=500, help="updates per scenario and concurrency level")
+    handlers_parser.add_argument("--lessons", type=int, default=6, help="lessons per subgroup")
+    handlers_parser.add_argument("--latency", type=float, default=0.02)
+    handlers_parser.add_argument("--max-p99", type=float, default=None, help="fail if any p99 exceeds this, ms")
+
+    workers_parser = subparsers.add_parser("workers", help="main.py behind its webhook with sharded worker processes")
+    workers_parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    workers_parser.add_argument("--shared-state", choices=["sqlite", "redis", "memory"], default="sqlite",
+                                help="redis uses an in-process fake server")
+    workers_parser.add_argument("--count", type=int, default=500, help="chats, each sends /te and then /te_t")
+    workers_parser.add_argument("--lessons", type=int, default=6, help="lessons per subgroup")
+    workers_parser.add_argument("--latency", type=float, default=0.02)
+    workers_parser.add_argument("--concurrency", type=int, default=32, help="concurrent webhook requests")
+
+    teachers_parser = subparsers.add_parser("teachers", help="teacher index build, search and update")
+    teachers_parser.add_argument("--groups", type=int, default=300)
+    teachers_parser.add_argument("--lessons", type=int, default=6, help="lessons per subgroup")
+    teachers_parser.add_argument("--iterations", type=int, default=1000)
+
+    rooms_parser = subparsers.add_parser("rooms", help="room occupancy build, free room scan and update")
+    rooms_parser.add_argument("--groups", type=int, default=300)
+    rooms_parser.add_argument("--lessons", type=int, default=6, help="lessons per subgroup")
+    rooms_parser.add_argument("--iterations", type=int, default=1000)
+
+    calendar_parser = subparsers.add_parser("calendar", help="semester calendar expansion and day lookup")
+    calendar_parser.add_argument("--groups", type=int, default=300)
+    calendar_parser.add_argument("--lessons", type=int, default=4, help="lessons per day")
+    calendar_parser.add_argument("--iterations", type=int, default=1000)
+
+    imports_parser = subparsers.add_parser("imports", help="cold import time of the bot modules")
+    imports_parser.add_argument("--modules", nargs="+", default=["main", "parser"])
+    imports_parser.add_argument("--top", type=int, default=10, help="slowest modules to list")
+    imports_parser.add_argument("--max-ms", type=float, default=None, help="fail if any import takes longer, ms")
+
+    args = parser.parse_args()
+    match args.benchmark:
+        case "api":
+            asyncio.run(bench_api(args.concurrency, args.latency))
+        case "render":
+            bench_render(args.iterations, args.lessons)
+        case "decode":
+            bench_decode(args.groups, args.lessons, args.iterations)
+        case "webhook":
+            asyncio.run(bench_webhook(args.url, args.secret, args.updates, args.count, args.concurrency))
+        case "pdf":
+            bench_pdf(args.file, None if args.pages is None else range(args.pages[0], args.pages[1] + 1))
+        case "cells":
+            bench_cells(args.pages)
+        case "handlers":
+            if not asyncio.run(bench_handlers(
+                    args.scenarios,
+                    args.concurrency,
+                    args.count,
+                    args.lessons,
+                    args.latency,
+                    args.max_p99
+            )):
+                sys.exit(1)
+        case "workers":
+            asyncio.run(bench_workers(
+                args.workers,
+                args.shared_state,
+                args.count,
+                args.lessons,
+                args.latency,
+                args.concurrency
+            ))
+        case "teachers":
+            bench_teachers(args.groups, args.lessons, args.iterations)
+        case "rooms":
+            bench_rooms(args.groups, args.lessons, args.iterations)
+        case "calendar":
+            bench_calendar(args.groups, args.lessons, args.iterations)
+        case "imports":
+            if not bench_imports(args.modules, args.top, args.max_ms):
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import re
+from typing import TYPE_CHECKING, Optional, Tuple
+
+# numpy and pandas are only needed once a page is classified, importing this module stays cheap
+if TYPE_CHECKING:
+    import numpy
+    import pandas
+
+# Хай горить у пеклі, той хто робив цей розклад і додумався пихати латинські букви в українські слова.
+# Latin letters that the timetable authors mix into Ukrainian words, mapped to the Cyrillic letters they imitate.
+# The mapping is one character to one character, so positions in the folded text match the original text.
+HOMOGLYPHS: Tuple[Tuple[str, str], ...] = (
+    ("a", "а"),
+    ("o", "о"),
+    ("p", "р"),
+    ("e", "е"),
+    ("i", "і")
+)
+
+# Joins the cells of a page so that they are folded in one pass. Never appears in PDF text.
+CELL_SEPARATOR: str = "\0"
+
+# name, place, lesson type, teacher type, teacher. Applied to text with folded homoglyphs.
+LESSON_CELL_RE: re.Pattern = re.compile(
+    r"^(.*?)\r?(\d{1,2}\. \d{3}\w?)?\r?(Лабораторна|Практичне|Лекція)\r?(.*?)\r?([A-ZА-ЯІЇЄ].*? .?\..?\.)$"
+)
+
+ENGLISH_NAME_RE: re.Pattern = re.compile(r'^(?:[A-z]|\s)*$')
+
+# Historical normalization of lesson types, kept so that imports stay identical to earlier ones
+LESSON_TYPE_REPLACEMENTS: Tuple[Tuple[str, str], ...] = (
+    ("a", "а"),
+    ("o", "о"),
+    ("і", "i"),
+    ("e", "е"),
+    ("p", "р")
+)
+
+TEACHER_TYPES: Tuple[Tuple[str, str], ...] = (
+    ("Проф", "Професор"),
+    ("Доц", "Доцент"),
+    ("Старш", "Старший викладач"),
+    ("Асист", "Асистент")
+)
+
+# Lesson cells occupy these columns of a timetable page, starting from this row
+FIRST_LESSON_COLUMN: int = 2
+LAST_LESSON_COLUMN: int = 5
+FIRST_LESSON_ROW: int = 2
+
+
+def fold_homoglyphs(text: str) -> str:
+    # str.translate falls back to a per-character dict lookup for non-ASCII output, chained replace is ~15x faster
+    for latin, cyrillic in HOMOGLYPHS:
+        text = text.replace(latin, cyrillic)
+    return text
+
+
+def match_lesson_cell(value: str, folded: Optional[str] = None) -> Optional[Tuple[str, str, str, str, str]]:
+    """Split a cell holding a whole lesson into its fields, or return None for any other cell.
+
+    folded is fold_homoglyphs(value), if the caller already has it.
+    """
+    match: Optional[re.Match] = LESSON_CELL_RE.match(fold_homoglyphs(value) if folded is None else folded)
+    if match is None:
+        return None
+    # Unmatched groups have the span (-1, -1) and become empty strings, like re.findall returns them
+    return tuple(value[match.start(group):match.end(group)] for group in range(1, 6))
+
+
+def classify_page(page: "pandas.DataFrame") -> list[Tuple[int, int, str, Optional[Tuple[str, str, str, str, str]]]]:
+    """Return (row label, column offset, cell, lesson fields or None) for every non-empty lesson cell.
+
+    Cells are returned row by row, left to right.
+    """
+    import pandas
+
+    # Plain numpy slicing, pandas indexing costs more than classifying the cells themselves
+    labels: "numpy.ndarray" = page.index.to_numpy()
+    lesson_rows: "numpy.ndarray" = labels >= FIRST_LESSON_ROW
+    values: "numpy.ndarray" = page.to_numpy(dtype=object)[lesson_rows, FIRST_LESSON_COLUMN:LAST_LESSON_COLUMN + 1]
+    rows, columns = pandas.notna(values).nonzero()
+    if not len(rows):
+        return []
+    row_labels: list[int] = labels[lesson_rows][rows].tolist()
+    cells: list[str] = values[rows, columns].tolist()
+    folded_cells: list[str] = fold_homoglyphs(CELL_SEPARATOR.join(cells)).split(CELL_SEPARATOR)
+    return [
+        (label, column, value, match_lesson_cell(value, folded))
+        for label, column, value, folded in zip(row_labels, columns.tolist(), cells, folded_cells)
+    ]
+
+
+def normalize_lesson_type(lesson_type: str) -> str:
+    for old, new in LESSON_TYPE_REPLACEMENTS:
+        lesson_type = lesson_type.replace(old, new)
+    return lesson_type
+
+
+def normalize_teacher_type(teacher_type: str) -> str:
+    for prefix, full_name in TEACHER_TYPES:
+        if teacher_type.startswith(prefix):
+            return full_name
+    return teacher_type
+
+
+def is_english_name(name: str) -> bool:
+    # Only the first letter is checked
+    return ENGLISH_NAME_RE.match(name[0]) is not None
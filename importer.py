@@ -0,0 +1,169 @@
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from datetime import date
+from typing import Optional, TextIO, Tuple
+
+import parser
+import reimport
+
+
+class ImportJob:
+    """One PDF, or a page range of it, that holds the timetable of one group."""
+    __slots__ = ["filepath", "group_code", "pages", "start_date", "end_date"]
+    filepath: str
+    group_code: str
+    pages: Optional[range]
+    start_date: list[int]
+    end_date: list[int]
+
+    def __init__(self, directory: str, filename: str, data: dict):
+        self.filepath = os.path.join(directory, filename)
+        self.group_code = data["group_code"]
+        self.pages = None
+        if "pages" in data:
+            self.pages = range(data["pages"][0], data["pages"][1] + 1)
+        start_date: date = date.fromisoformat(data["start_date"])
+        end_date: date = date.fromisoformat(data["end_date"])
+        self.start_date = [start_date.year, start_date.month, start_date.day]
+        self.end_date = [end_date.year, end_date.month, end_date.day]
+
+    def state_filename(self) -> str:
+        return hashlib.blake2b(str(self).encode(), digest_size=8).hexdigest() + ".json"
+
+    def __str__(self):
+        pages: str = '' if self.pages is None else f' pages {self.pages.start}-{self.pages.stop - 1}'
+        return f'{os.path.basename(self.filepath)}{pages} ({self.group_code})'
+
+
+def load_jobs(directory: str, mapping_path: str) -> list[ImportJob]:
+    """Read the mapping file: {"file.pdf": [{"group_code", "start_date", "end_date", optional "pages"}]}."""
+    with open(mapping_path, encoding="utf-8") as mapping_file:
+        mapping: dict[str, list[dict]] = json.load(mapping_file)
+    return [
+        ImportJob(directory, filename, job_data)
+        for filename, jobs_data in mapping.items()
+        for job_data in (jobs_data if isinstance(jobs_data, list) else [jobs_data])
+    ]
+
+
+def run_job(job: ImportJob, backend: str) -> Tuple[list[dict], float]:
+    begin: float = time.perf_counter()
+    lessons: list[parser.APILesson] = parser.schedule_pdf_to_list(
+        job.filepath,
+        job.pages,
+        backend,
+        job.group_code,
+        job.start_date,
+        job.end_date
+    )
+    return [lesson.to_dict() for lesson in lessons], time.perf_counter() - begin
+
+
+def run_job_incremental(
+        job: ImportJob,
+        backend: str,
+        state_directory: str
+) -> Tuple[list[dict], float, str, list[dict]]:
+    begin: float = time.perf_counter()
+    state: reimport.ImportState = reimport.ImportState(os.path.join(state_directory, job.state_filename()))
+    diff, skipped = reimport.reimport(
+        job.filepath,
+        job.pages,
+        state,
+        backend,
+        job.group_code,
+        job.start_date,
+        job.end_date
+    )
+    summary: str = f"{len(diff.added)} added, {len(diff.removed)} removed, {len(diff.changed)} changed, " \
+                   f"{skipped}/{len(state.pages)} pages unchanged"
+    # Every lesson for the output the bot reads, the diff for whoever wants to know what changed
+    return state.lessons, time.perf_counter() - begin, summary, list(diff.records())
+
+
+def import_all(
+        jobs: list[ImportJob],
+        output: TextIO,
+        workers: Optional[int],
+        backend: str,
+        state_directory: Optional[str] = None,
+        diff_output: Optional[TextIO] = None
+) -> int:
+    failed: int = 0
+    begin: float = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures: dict[Future, ImportJob]
+        if state_directory is None:
+            futures = {executor.submit(run_job, job, backend): job for job in jobs}
+        else:
+            futures = {executor.submit(run_job_incremental, job, backend, state_directory): job for job in jobs}
+        for done, future in enumerate(as_completed(futures), 1):
+            job: ImportJob = futures[future]
+            try:
+                result: tuple = future.result()
+            except Exception as error:
+                failed += 1
+                print(f"[{done}/{len(jobs)}] {job}: failed: {error!r}", file=sys.stderr)
+                continue
+            records: list[dict] = result[0]
+            elapsed: float = result[1]
+            for record in records:
+                output.write(json.dumps(record, ensure_ascii=False) + "\n")
+            output.flush()
+            if diff_output is not None:
+                for record in result[3]:
+                    diff_output.write(json.dumps(record, ensure_ascii=False) + "\n")
+                diff_output.flush()
+            summary: str = f"{len(records)} lessons" if state_directory is None else result[2]
+            print(f"[{done}/{len(jobs)}] {job}: {summary} in {elapsed:.2f} s", file=sys.stderr)
+
+    print(f"Imported {len(jobs) - failed}/{len(jobs)} in {time.perf_counter() - begin:.2f} s", file=sys.stderr)
+    return failed
+
+
+def main() -> None:
+    argument_parser = argparse.ArgumentParser(description="Parse a directory of schedule PDFs into APILesson JSONL")
+    argument_parser.add_argument("directory")
+    argument_parser.add_argument("mapping", help="JSON file mapping PDF names to group codes and semester dates")
+    argument_parser.add_argument("-o", "--output", default="-", help="JSONL output file, '-' for stdout")
+    argument_parser.add_argument("-j", "--workers", type=int, default=None, help="worker processes, CPU count by default")
+    argument_parser.add_argument("--backend", default="auto", choices=["auto", "pdfplumber", "tabula"])
+    argument_parser.add_argument(
+        "--state",
+        default=None,
+        help="directory with the fingerprints of the previous import, pages that didn't change are not parsed again"
+    )
+    argument_parser.add_argument(
+        "--diff",
+        default=None,
+        help="JSONL file for the lessons added, removed and changed since the previous import, needs --state"
+    )
+    args = argument_parser.parse_args()
+    if args.diff is not None and args.state is None:
+        argument_parser.error("--diff needs --state")
+
+    jobs: list[ImportJob] = load_jobs(args.directory, args.mapping)
+    if args.state is not None:
+        os.makedirs(args.state, exist_ok=True)
+    with contextlib.ExitStack() as files:
+        output: TextIO = sys.stdout
+        if args.output != "-":
+            # Written aside and renamed once complete, the bot would otherwise read a file that is half written
+            output = files.enter_context(open(args.output + ".tmp", "w", encoding="utf-8"))
+        diff_output: Optional[TextIO] = None
+        if args.diff is not None:
+            diff_output = files.enter_context(open(args.diff, "w", encoding="utf-8"))
+        failed: int = import_all(jobs, output, args.workers, args.backend, args.state, diff_output)
+    if args.output != "-":
+        os.replace(args.output + ".tmp", args.output)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
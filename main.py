@@ -1,26 +1,51 @@
+import asyncio
 import logging
-import locale
 import html
-import json
 import os
 import sys
 import re
 
+import httpx
 import pytz
-import requests
 
+import Metrics
+import Notifier
 import ScheduleAPI
-
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, CallbackQuery
+import SharedState
+import Sharding
+from CallbackDebouncer import CallbackDebouncer
+from ChatOrderedProcessor import ChatOrderedUpdateProcessor
+from InlineDebouncer import InlineDebouncer
+from ErrorReporter import ErrorReporter
+from Day import Day, WEEKDAY_NAMES
+from Group import Group
+from ImportedTimetable import ImportedTimetable
+from RoomOccupancy import PAIR_STARTS
+from SemesterCalendar import SemesterCalendar
+from Lesson import TIMEZONE
+from Storage import Storage
+from CircuitBreaker import CircuitBreaker
+
+from telegram import Bot, Update, InlineKeyboardButton, InlineKeyboardMarkup, CallbackQuery, Message, InlineQuery
 from telegram.ext import Application, CommandHandler, ContextTypes, Defaults, CallbackQueryHandler, MessageHandler
+from telegram.ext import ApplicationBuilder, ExtBot, InlineQueryHandler
 from telegram.ext import filters
 from telegram.constants import ParseMode
 
 from datetime import date, timedelta, datetime
+from functools import partial
 from typing import Optional, Tuple, Any
 
 apiToken: Optional[str] = None
 baseUrl: str
+callbackDebouncer: CallbackDebouncer = CallbackDebouncer()
+inlineDebouncer: InlineDebouncer = InlineDebouncer()
+# Created on startup, once the database is open
+notifier: Optional[Notifier.Notifier] = None
+# Lessons written by importer.py, read on startup if SCHEDULE_BOT_IMPORT_JSONL is set
+importedTimetable: Optional[ImportedTimetable] = None
+# Cancellations and comments of imported lessons on single dates, read if SCHEDULE_BOT_OVERRIDES_JSONL is set
+importedOverrides: Optional[ImportedTimetable] = None
 
 # Enable logging
 logging.basicConfig(
@@ -34,54 +59,82 @@ logger = logging.getLogger(__name__)
 
 
 DEVELOPER_CHAT_ID: int = 558344464
+errorReporter: ErrorReporter = ErrorReporter(DEVELOPER_CHAT_ID)
+
+# Commands and WEB_APP_DATA arrive as messages, buttons as callback queries, "@bot <group> <date>" as inline queries.
+# Nothing else is handled.
+ALLOWED_UPDATES: list[str] = [Update.MESSAGE, Update.CALLBACK_QUERY, Update.INLINE_QUERY]
+
+# Seconds Telegram may cache an inline answer that found nothing, short because the user is probably still typing
+INLINE_EMPTY_CACHE_TIME: int = 10
+
+# Day names /free_rooms accepts, Monday is 0
+DAY_NUMBERS: dict[str, int] = {
+    **{name.casefold(): number for number, name in enumerate(WEEKDAY_NAMES)},
+    **{name: number for number, name in enumerate(("пн", "вт", "ср", "чт", "пт", "сб", "нд"))}
+}
+FREE_ROOMS_PER_LINE: int = 10
 
 
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Log the error and send a telegram message to notify the developer."""
+    """Log the error and notify the developer with a digest of the errors of the last minute."""
     # Log the error before we do anything else, so we can see it even if something breaks.
     logger.error("Exception while handling an update:", exc_info=context.error)
+    Metrics.inc("handler_errors_total", error=type(context.error).__name__)
+    errorReporter.record(context.bot, context.error, update)
 
-    # Build the message with some markup and additional information about what happened.
-    # You might need to add some logic to deal with messages longer than the 4096 character limit.
-    update_str = update.to_dict() if isinstance(update, Update) else str(update)
-    message = (
-        f"An exception was raised while handling an update\n"
-        f"<pre>update = {html.escape(json.dumps(update_str, indent=2, ensure_ascii=False))}"
-        "</pre>\n\n"
-        f"<pre>context.chat_data = {html.escape(str(context.chat_data))}</pre>\n\n"
-        f"<pre>context.user_data = {html.escape(str(context.user_data))}</pre>\n\n"
-        f"<pre>{html.escape(str(context.error))}</pre>"
-    )
 
-    # Finally, send the message
-    await context.bot.send_message(
-        chat_id=DEVELOPER_CHAT_ID, text=message, parse_mode=ParseMode.HTML
+async def cache_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if update.effective_user.id != DEVELOPER_CHAT_ID:
+        return
+    stats: dict[str, int] = ScheduleAPI.schedule_cache.stats()
+    stats.update((f"group_{name}", value) for name, value in ScheduleAPI.group_cache.stats().items())
+    await update.message.reply_text(
+        "<pre>" + "\n".join(f"{name} = {value}" for name, value in stats.items()) + "</pre>"
     )
 
 
+async def refresh_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    await ScheduleAPI.forget_chat(update.message.chat_id)
+    await update.message.reply_text("Збережені дані цього чату очищено, розклад буде завантажено заново.")
+
+
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     await update.message.reply_text("Привіт! Цей бот здатен відсилати розклад певної групи на певну дату.")
 
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-    await update.message.reply_text("Наявні команди: <code>/te</code>, <code>/te_t</code>")
+    await update.message.reply_text(
+        "Наявні команди: <code>/te</code>, <code>/te_t</code>, <code>/week</code>, <code>/refresh</code>, "
+        "<code>/subscribe</code>, <code>/remind</code>, <code>/unsubscribe</code>, <code>/teacher</code>, "
+        "<code>/free_rooms</code>"
+    )
 
 
 async def send_schedule_message(update: Update, schedule_date: date) -> None:
+    groups: Optional[list[dict]] = ScheduleAPI.get_chat_groups(update.message.chat_id)
+    if groups is not None and len(groups) > 1:
+        picker: Tuple[str, list[list[InlineKeyboardButton]]] = ScheduleAPI.build_group_picker(groups, schedule_date)
+        await update.message.reply_text(picker[0], reply_markup=InlineKeyboardMarkup(picker[1]))
+        return
+
     global apiToken
-    api_result: requests.Response = ScheduleAPI.get_schedule_data(
-        baseUrl,
-        update.message.chat_id,
-        schedule_date,
-        apiToken
-    )
+    with Metrics.timed("stage_seconds", handler="schedule", stage="fetch"):
+        api_result: httpx.Response = await ScheduleAPI.get_schedule_data(
+            baseUrl,
+            update.message.chat_id,
+            schedule_date,
+            apiToken
+        )
 
     error: Optional[str] = ScheduleAPI.check_response_for_errors(api_result)
     if error is not None:
         await update.message.reply_text(error)
         return
 
-    json_data: list[dict] = api_result.json()
+    with Metrics.timed("stage_seconds", handler="schedule", stage="decode"):
+        json_data: list[dict] = ScheduleAPI.decode_response(api_result)
+    ScheduleAPI.remember_chat_groups(update.message.chat_id, json_data)
     schedule: Optional[Tuple[str, list[list[InlineKeyboardButton]]]] = ScheduleAPI.check_response_for_multiple_groups(
         json_data,
         schedule_date
@@ -93,12 +146,17 @@ async def send_schedule_message(update: Update, schedule_date: date) -> None:
         )
         return
 
-    schedule: Tuple[str, list[list[InlineKeyboardButton]]] = ScheduleAPI.convert_daydata_to_string(
-        json_data[0],
-        schedule_date
-    )
+    with Metrics.timed("stage_seconds", handler="schedule", stage="render"):
+        schedule: Tuple[str, list[list[InlineKeyboardButton]]] = ScheduleAPI.convert_daydata_to_string(
+            json_data[0],
+            schedule_date,
+            content_hash=ScheduleAPI.payload_digest(api_result)
+        )
 
-    await update.message.reply_text(schedule[0], reply_markup=InlineKeyboardMarkup(schedule[1]))
+    text: str = schedule[0] + ScheduleAPI.STALE_NOTICE if ScheduleAPI.is_stale(api_result) else schedule[0]
+    with Metrics.timed("stage_seconds", handler="schedule", stage="send"):
+        await update.message.reply_text(text, reply_markup=InlineKeyboardMarkup(schedule[1]))
+    ScheduleAPI.prefetch_neighbours(baseUrl, update.message.chat_id, schedule_date, apiToken)
 
 
 async def schedule_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -122,48 +180,363 @@ async def tomorrow_schedule_command(update: Update, context: ContextTypes.DEFAUL
     await send_schedule_message(update, date.today() + timedelta(hours=24))
 
 
-async def update_schedule_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+async def send_week_schedule(
+        message: Message,
+        chat_id: int,
+        first_date: date,
+        group_code: Optional[str],
+        edit: bool = False
+) -> None:
+    if group_code is None:
+        groups: Optional[list[dict]] = ScheduleAPI.get_chat_groups(chat_id)
+        if groups is not None and len(groups) > 1:
+            picker: Tuple[str, list[list[InlineKeyboardButton]]] = \
+                ScheduleAPI.build_group_picker(groups, first_date, "WEEK_SCHEDULE")
+            await message.reply_text(picker[0], reply_markup=InlineKeyboardMarkup(picker[1]))
+            return
+
+    global apiToken
+    with Metrics.timed("stage_seconds", handler="week", stage="fetch"):
+        api_results: list[httpx.Response] = await ScheduleAPI.get_schedule_range(
+            baseUrl,
+            chat_id,
+            first_date,
+            first_date + timedelta(days=6),
+            apiToken
+        )
+
+    for api_result in api_results:
+        error: Optional[str] = ScheduleAPI.check_response_for_errors(api_result)
+        if error is not None:
+            await message.reply_text(error)
+            return
+
+    json_data: list[dict] = ScheduleAPI.decode_response(api_results[0])
+    ScheduleAPI.remember_chat_groups(chat_id, json_data)
+    show_name: bool = group_code is not None
+    if group_code is None:
+        schedule: Optional[Tuple[str, list[list[InlineKeyboardButton]]]] = \
+            ScheduleAPI.check_response_for_multiple_groups(json_data, first_date, "WEEK_SCHEDULE")
+        if schedule is not None:
+            await message.reply_text(schedule[0], reply_markup=InlineKeyboardMarkup(schedule[1]))
+            return
+        group_code = json_data[0]["group"]["code"]
+
+    group_name: Optional[str] = None
+    for group_data in json_data:
+        if group_data["group"]["code"] == group_code:
+            group_name = Group(group_data["group"]).name
+    with Metrics.timed("stage_seconds", handler="week", stage="decode"):
+        days: list[Day] = ScheduleAPI.convert_range_to_days(api_results, first_date, group_code)
+    # The chat isn't bound to the group of the button, or no longer is
+    if not days:
+        if edit:
+            await message.edit_text('Ця група вам не доступна!')
+        else:
+            await message.reply_text('Ця група вам не доступна!')
+        return
+
+    with Metrics.timed("stage_seconds", handler="week", stage="render"):
+        text: str = "\n\n".join(day.get_telegram_message(group_name if show_name else None) for day in days)
+    if any(ScheduleAPI.is_stale(api_result) for api_result in api_results):
+        text += ScheduleAPI.STALE_NOTICE
+    chunks: list[str] = ScheduleAPI.split_message(text)
+    with Metrics.timed("stage_seconds", handler="week", stage="send"):
+        if edit:
+            await message.edit_text(chunks[0])
+        else:
+            await message.reply_text(chunks[0])
+        for chunk in chunks[1:]:
+            await message.reply_text(chunk)
+
+
+async def week_schedule_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    schedule_date: date = date.today()
+
+    if len(context.args):
+        matches: list[str] = re.findall(r'^(\d{1,2})\.(\d{1,2})$', context.args[0])
+        if len(matches) != 1:
+            await update.message.reply_text("Не вірні аргументи!")
+            return
+        try:
+            schedule_date = date(schedule_date.year, int(matches[0][1]), int(matches[0][0]))
+        except ValueError:
+            await update.message.reply_text("Не вірні аргументи!")
+            return
+
+    await send_week_schedule(
+        update.message,
+        update.message.chat_id,
+        schedule_date - timedelta(days=schedule_date.weekday()),
+        None
+    )
+
+
+async def week_schedule_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if not await button_belongs_to_user(update.callback_query):
         return
 
     callback_data: list[str] = update.callback_query.data.split("|")
-    schedule_date: date = datetime.strptime(callback_data[1], "%d.%m.%Y")
+    groups: Optional[list[dict]] = ScheduleAPI.get_chat_groups(update.callback_query.message.chat_id)
+    if groups is not None and all(group["code"] != callback_data[2] for group in groups):
+        await update.callback_query.answer(
+            'Ця група вам не доступна!',
+            show_alert=True
+        )
+        return
+
+    await update.callback_query.answer()
+    await send_week_schedule(
+        update.callback_query.message,
+        update.callback_query.message.chat_id,
+        datetime.strptime(callback_data[1], "%d.%m.%Y").date(),
+        callback_data[2],
+        edit=True
+    )
+
+
+async def update_schedule_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not await button_belongs_to_user(update.callback_query):
+        return
+
+    await callbackDebouncer.submit(
+        update.callback_query,
+        apply_schedule_update,
+        partial(context.application.create_task, update=update)
+    )
+
+
+async def apply_schedule_update(query: CallbackQuery) -> None:
+    callback_data: list[str] = query.data.split("|")
+    schedule_date: date = datetime.strptime(callback_data[1], "%d.%m.%Y").date()
     group_code: str = callback_data[2]
     show_name: bool = "SHOW_NAME" in callback_data
 
+    groups: Optional[list[dict]] = ScheduleAPI.get_chat_groups(query.message.chat_id)
+    if groups is not None and all(group["code"] != group_code for group in groups):
+        await query.answer(
+            'Ця група вам не доступна!',
+            show_alert=True
+        )
+        return
+
     global apiToken
-    api_result: requests.Response = ScheduleAPI.get_schedule_data(
-        baseUrl,
-        update.callback_query.message.chat_id,
-        schedule_date,
-        apiToken
-    )
+    with Metrics.timed("stage_seconds", handler="update_schedule", stage="fetch"):
+        api_result: httpx.Response = await ScheduleAPI.get_schedule_data(
+            baseUrl,
+            query.message.chat_id,
+            schedule_date,
+            apiToken
+        )
 
     error: Optional[str] = ScheduleAPI.check_response_for_errors(api_result)
     if error is not None:
-        await update.callback_query.answer(
+        await query.answer(
             error,
             show_alert=True
         )
         return
 
-    json_data: list[dict] = api_result.json()
+    with Metrics.timed("stage_seconds", handler="update_schedule", stage="decode"):
+        json_data: list[dict] = ScheduleAPI.decode_response(api_result)
     for group_data in json_data:
         if group_data["group"]["code"] == group_code:
-            schedule: Tuple[str, list[list[InlineKeyboardButton]]] = ScheduleAPI.convert_daydata_to_string(
-                group_data,
-                schedule_date,
-                show_name
-            )
-            await update.callback_query.edit_message_text(schedule[0], reply_markup=InlineKeyboardMarkup(schedule[1]))
+            with Metrics.timed("stage_seconds", handler="update_schedule", stage="render"):
+                schedule: Tuple[str, list[list[InlineKeyboardButton]]] = ScheduleAPI.convert_daydata_to_string(
+                    group_data,
+                    schedule_date,
+                    show_name,
+                    ScheduleAPI.payload_digest(api_result)
+                )
+            text: str = schedule[0] + ScheduleAPI.STALE_NOTICE if ScheduleAPI.is_stale(api_result) else schedule[0]
+            with Metrics.timed("stage_seconds", handler="update_schedule", stage="send"):
+                await callbackDebouncer.edit(query, text, InlineKeyboardMarkup(schedule[1]))
+            ScheduleAPI.prefetch_neighbours(baseUrl, query.message.chat_id, schedule_date, apiToken)
             return
 
-    await update.callback_query.answer(
+    await query.answer(
         'Ця група вам не доступна!',
         show_alert=True
     )
 
 
+async def subscribe_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/subscribe [HH:MM] [group code]: tomorrow's schedule every day at that time."""
+    minutes: int = 20 * 60
+    args: list[str] = list(context.args)
+    if len(args) and re.match(r'^\d{1,2}:\d{2}$', args[0]):
+        hours, _, hour_minutes = args.pop(0).partition(':')
+        if int(hours) > 23 or int(hour_minutes) > 59:
+            await update.message.reply_text("Не вірні аргументи!")
+            return
+        minutes = int(hours) * 60 + int(hour_minutes)
+
+    group_code: Optional[str] = await subscription_group(update, args)
+    if group_code is None:
+        return
+    notifier.subscribe(update.message.chat_id, Notifier.DAILY, group_code, minutes)
+    await update.message.reply_text(
+        f"Розклад на завтра надходитиме щодня о {minutes // 60:02}:{minutes % 60:02}. "
+        f"Вимкнути: <code>/unsubscribe</code>"
+    )
+
+
+async def remind_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/remind [minutes] [group code]: a reminder that many minutes before every lesson."""
+    minutes: int = 10
+    args: list[str] = list(context.args)
+    if len(args) and args[0].isdigit():
+        minutes = int(args.pop(0))
+        if not 0 < minutes <= 180:
+            await update.message.reply_text("Не вірні аргументи!")
+            return
+
+    group_code: Optional[str] = await subscription_group(update, args)
+    if group_code is None:
+        return
+    notifier.subscribe(update.message.chat_id, Notifier.REMINDER, group_code, minutes)
+    await update.message.reply_text(
+        f"Нагадування надходитимуть за {minutes} хв до кожної пари. Вимкнути: <code>/unsubscribe</code>"
+    )
+
+
+async def unsubscribe_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if notifier.unsubscribe(update.message.chat_id):
+        await update.message.reply_text("Сповіщення вимкнено.")
+    else:
+        await update.message.reply_text("Цей чат не підписаний на сповіщення.")
+
+
+async def subscription_group(update: Update, args: list[str]) -> Optional[str]:
+    """Return the code of the group a subscription is for, or reply why there is none."""
+    chat_id: int = update.message.chat_id
+    groups: Optional[list[dict]] = ScheduleAPI.get_chat_groups(chat_id)
+    if groups is None:
+        api_result: httpx.Response = await ScheduleAPI.get_schedule_data(baseUrl, chat_id, date.today(), apiToken)
+        error: Optional[str] = ScheduleAPI.check_response_for_errors(api_result)
+        if error is not None:
+            await update.message.reply_text(error)
+            return None
+        json_data: list[dict] = ScheduleAPI.decode_response(api_result)
+        ScheduleAPI.remember_chat_groups(chat_id, json_data)
+        groups = [group_data["group"] for group_data in json_data]
+
+    codes: list[str] = [group["code"] for group in groups]
+    if len(args):
+        if args[0] in codes:
+            return args[0]
+        await update.message.reply_text('Ця група вам не доступна!')
+        return None
+    if len(codes) == 1:
+        return codes[0]
+    await update.message.reply_text(
+        "До цього чату прив'язано декілька груп. Додайте до команди код потрібної: " +
+        ", ".join(f"<code>{html.escape(group.code)}</code> ({html.escape(group.name)})" for group in map(Group, groups))
+    )
+    return None
+
+
+async def teacher_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/teacher <surname>: today's lessons of a teacher, from the schedules the bot already knows."""
+    if not context.args:
+        await update.message.reply_text("Вкажіть прізвище викладача: <code>/teacher Петренко</code>")
+        return
+    with Metrics.timed("stage_seconds", handler="teacher", stage="search"):
+        teachers: list[str] = ScheduleAPI.teacher_index.search(" ".join(context.args))
+    if not teachers:
+        await update.message.reply_text(
+            "Викладача не знайдено. Пошук працює за розкладами груп, які вже переглядали через бота."
+        )
+        return
+    if len(teachers) > 1:
+        await update.message.reply_text(
+            "Знайдено декількох викладачів, уточніть прізвище:\n" +
+            "\n".join(f"<code>{html.escape(teacher)}</code>" for teacher in teachers)
+        )
+        return
+    await update.message.reply_text(render_teacher_day(teachers[0], datetime.now(TIMEZONE)))
+
+
+def render_teacher_day(teacher: str, now: datetime) -> str:
+    week_number: Optional[int] = ScheduleAPI.teacher_index.week_number(now.date())
+    title: str = f'<b>{html.escape(teacher)}, {now.strftime("%d.%m")} ({WEEKDAY_NAMES[now.weekday()]}'
+    if week_number is None:
+        return title + ')</b>\nНевідомо, який зараз тиждень.'
+    lines: list[str] = [f'{title} {week_number})</b>']
+
+    minutes_now: int = now.hour * 60 + now.minute
+    for _, _, minutes, group_code, subgroup, name, place, duration in ScheduleAPI.teacher_index.lessons(
+            teacher,
+            week_number,
+            now.weekday()
+    ):
+        end: int = minutes + duration
+        # The lesson going on right now is what students usually want to know
+        marker: str = "▶️ " if minutes <= minutes_now < end else ""
+        subgroup_label: str = f" ({subgroup} підгр.)" if subgroup > 0 else ""
+        lines.append(
+            f'{marker}{minutes // 60:02}:{minutes % 60:02} - {end // 60:02}:{end % 60:02} | '
+            f'{html.escape(group_code)}{subgroup_label} | {html.escape(name)} | {html.escape(place)}'
+        )
+    if len(lines) == 1:
+        lines.append("Пар немає.")
+    return "\n".join(lines)
+
+
+async def free_rooms_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/free_rooms <day> <pair> [week]: rooms no known lesson takes at that pair."""
+    parsed: Optional[Tuple[int, int, Optional[int]]] = parse_free_rooms_args(context.args)
+    if parsed is None:
+        await update.message.reply_text(
+            "Не вірні аргументи! Приклад: <code>/free_rooms ср 3</code> або <code>/free_rooms 3 3 2</code>"
+        )
+        return
+    day_number, pair, week_number = parsed
+    if week_number is None:
+        # The nearest such day, today included
+        today: date = date.today()
+        week_number = ScheduleAPI.teacher_index.week_number(today + timedelta(days=(day_number - today.weekday()) % 7))
+        if week_number is None:
+            await update.message.reply_text("Невідомо, який зараз тиждень. Додайте його номер до команди.")
+            return
+
+    with Metrics.timed("stage_seconds", handler="free_rooms", stage="scan"):
+        rooms: list[str] = ScheduleAPI.room_occupancy.free_rooms(week_number, day_number, pair)
+    title: str = f"<b>Вільні аудиторії ({WEEKDAY_NAMES[day_number]} {week_number}, {pair + 1} пара):</b>\n"
+    if not rooms:
+        await update.message.reply_text(title + "Не знайдено жодної.")
+        return
+    # Short lines, split_message() would otherwise cut one long line in the middle of a room
+    lines: list[str] = [
+        ", ".join(html.escape(room) for room in rooms[index:index + FREE_ROOMS_PER_LINE])
+        for index in range(0, len(rooms), FREE_ROOMS_PER_LINE)
+    ]
+    text: str = title + "\n".join(lines) + "\n\n<i>За розкладами груп, відомими боту.</i>"
+    for chunk in ScheduleAPI.split_message(text):
+        await update.message.reply_text(chunk)
+
+
+def parse_free_rooms_args(args: list[str]) -> Optional[Tuple[int, int, Optional[int]]]:
+    """Return (day number, 0-based pair, week number or None) of "<day> <pair> [week]", None if invalid."""
+    if len(args) not in (2, 3):
+        return None
+    day: str = args[0].casefold()
+    if day.isdigit() and 1 <= int(day) <= len(WEEKDAY_NAMES):
+        day_number: int = int(day) - 1
+    elif day in DAY_NUMBERS:
+        day_number = DAY_NUMBERS[day]
+    else:
+        return None
+    if not args[1].isdigit() or not 1 <= int(args[1]) <= len(PAIR_STARTS):
+        return None
+    week_number: Optional[int] = None
+    if len(args) == 3:
+        if args[2] not in ("1", "2"):
+            return None
+        week_number = int(args[2])
+    return day_number, int(args[1]) - 1, week_number
+
+
 async def button_belongs_to_user(query: CallbackQuery):
     if (query.message and
             query.message.reply_to_message and
@@ -173,24 +546,219 @@ async def button_belongs_to_user(query: CallbackQuery):
     return True
 
 
+def parse_inline_query(text: str) -> Optional[Tuple[str, date]]:
+    """Split "<group> [dd.mm | завтра]" into the group and the date, None if the date is invalid."""
+    schedule_date: date = date.today()
+    words: list[str] = []
+    for word in text.split():
+        matches: list[str] = re.findall(r'^(\d{1,2})\.(\d{1,2})$', word)
+        if word.lower() == "завтра":
+            schedule_date = date.today() + timedelta(days=1)
+        elif len(matches) == 1:
+            try:
+                schedule_date = date(schedule_date.year, int(matches[0][1]), int(matches[0][0]))
+            except ValueError:
+                return None
+        else:
+            words.append(word)
+    return " ".join(words), schedule_date
+
+
+async def inline_query_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    await inlineDebouncer.submit(
+        update.inline_query,
+        answer_inline_query,
+        partial(context.application.create_task, update=update)
+    )
+
+
+async def answer_inline_query(query: InlineQuery) -> None:
+    parsed: Optional[Tuple[str, date]] = parse_inline_query(query.query)
+    if parsed is None:
+        await query.answer([], cache_time=INLINE_EMPTY_CACHE_TIME, is_personal=True)
+        return
+    group_query, schedule_date = parsed
+    # Telegram keeps the answer as long as we would keep the schedule
+    cache_time: int = int(ScheduleAPI.group_cache.ttl_for(schedule_date))
+
+    # A group somebody else has asked for doesn't need a request, nor is the answer specific to this user
+    cached: Optional[httpx.Response] = None
+    if group_query:
+        cached = await ScheduleAPI.find_group_schedule(group_query, schedule_date, apiToken)
+    if cached is not None:
+        Metrics.inc("inline_queries_total", source="group_cache")
+        await query.answer(
+            [ScheduleAPI.build_inline_result(
+                ScheduleAPI.decode_response(cached),
+                schedule_date,
+                ScheduleAPI.payload_digest(cached)
+            )],
+            cache_time=cache_time
+        )
+        return
+
+    # Otherwise the groups come from whatever the user is bound to
+    Metrics.inc("inline_queries_total", source="user")
+    with Metrics.timed("stage_seconds", handler="inline", stage="fetch"):
+        api_result: httpx.Response = await ScheduleAPI.get_schedule_data(
+            baseUrl,
+            query.from_user.id,
+            schedule_date,
+            apiToken
+        )
+    if ScheduleAPI.check_response_for_errors(api_result) is not None:
+        await query.answer([], cache_time=INLINE_EMPTY_CACHE_TIME, is_personal=True)
+        return
+
+    stale: bool = ScheduleAPI.is_stale(api_result)
+    content_hash: bytes = ScheduleAPI.payload_digest(api_result)
+    needle: str = group_query.casefold()
+    with Metrics.timed("stage_seconds", handler="inline", stage="render"):
+        results: list = [
+            ScheduleAPI.build_inline_result(group_data, schedule_date, content_hash, stale)
+            for group_data in ScheduleAPI.decode_response(api_result)
+            if needle in group_data["group"]["code"].casefold()
+            or needle in Group(group_data["group"]).name.casefold()
+        ]
+    await query.answer(
+        results,
+        cache_time=INLINE_EMPTY_CACHE_TIME if stale or not results else cache_time,
+        is_personal=True
+    )
+
+
 async def web_app_data(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     return
 
 
-def main() -> None:
-    bot_token: str = sys.argv[1]
-    global baseUrl
-    baseUrl = os.environ.get("SCHEDULE_BOT_URL_BASE", "https://api.crwnd.dev/schedule/violet")
+async def post_init(application: Application) -> None:
+    ScheduleAPI.init_client(
+        max_connections=int(os.environ.get("SCHEDULE_BOT_MAX_CONNECTIONS", "20")),
+        max_keepalive_connections=int(os.environ.get("SCHEDULE_BOT_MAX_KEEPALIVE", "10")),
+        timeout=float(os.environ.get("SCHEDULE_BOT_API_TIMEOUT", "10"))
+    )
+    ScheduleAPI.schedule_cache.max_size = int(os.environ.get("SCHEDULE_BOT_CACHE_SIZE", "1024"))
+    ScheduleAPI.group_cache.max_size = ScheduleAPI.schedule_cache.max_size
+    ScheduleAPI.storage = Storage(
+        os.environ.get("SCHEDULE_BOT_DB", "schedulebot.sqlite3"),
+        binding_ttl=float(os.environ.get("SCHEDULE_BOT_BINDING_TTL", str(24 * 60 * 60)))
+    )
+    ScheduleAPI.storage.prune_snapshots(float(os.environ.get("SCHEDULE_BOT_SNAPSHOT_MAX_AGE", str(30 * 24 * 60 * 60))))
+    ScheduleAPI.snapshot_timeout = float(os.environ.get("SCHEDULE_BOT_SNAPSHOT_TIMEOUT", "3"))
+    ScheduleAPI.breaker = CircuitBreaker(
+        failure_threshold=int(os.environ.get("SCHEDULE_BOT_BREAKER_THRESHOLD", "5")),
+        reset_timeout=float(os.environ.get("SCHEDULE_BOT_BREAKER_RESET", "30"))
+    )
+    errorReporter.window = float(os.environ.get("SCHEDULE_BOT_ERROR_WINDOW", "60"))
+    # 0 disables prefetching of neighbouring days
+    ScheduleAPI.prefetcher.radius = int(os.environ.get("SCHEDULE_BOT_PREFETCH_RADIUS", "1"))
+
+    # Worker processes share state through the database unless told otherwise, a single process needs none
+    workers: int = int(os.environ.get("SCHEDULE_BOT_WORKERS", "1"))
+    worker_index: int = int(os.environ.get("SCHEDULE_BOT_WORKER_INDEX", "0"))
+    shared_state: Optional[str] = os.environ.get("SCHEDULE_BOT_SHARED_STATE")
+    if shared_state is None and workers > 1:
+        shared_state = "sqlite:" + os.environ.get("SCHEDULE_BOT_DB", "schedulebot.sqlite3")
+    if shared_state is not None:
+        ScheduleAPI.shared = SharedState.open_backend(shared_state)
+    ScheduleAPI.index_fetched_days = workers == 1
+
+    global importedTimetable, importedOverrides
+    imported_path: Optional[str] = os.environ.get("SCHEDULE_BOT_IMPORT_JSONL")
+    if imported_path is not None:
+        importedTimetable = ImportedTimetable(imported_path)
+        # Days of the imported groups are then answered locally and only synced with upstream now and then
+        if os.environ.get("SCHEDULE_BOT_CALENDAR", "0") == "1":
+            ScheduleAPI.calendar = SemesterCalendar()
+            ScheduleAPI.calendar_sync_interval = float(os.environ.get("SCHEDULE_BOT_CALENDAR_SYNC", str(6 * 60 * 60)))
+            overrides_path: Optional[str] = os.environ.get("SCHEDULE_BOT_OVERRIDES_JSONL")
+            if overrides_path is not None:
+                importedOverrides = ImportedTimetable(overrides_path)
+        refresh_imported()
+        # Re-read when importer.py writes the file again, only the changed groups are indexed anew
+        application.job_queue.run_repeating(
+            refresh_imported_job,
+            float(os.environ.get("SCHEDULE_BOT_IMPORT_INTERVAL", "60")),
+            name="imported timetable"
+        )
 
-    locale.setlocale(locale.LC_ALL, 'uk_UA.UTF-8')
+    global notifier
+    notifier = Notifier.Notifier(
+        baseUrl,
+        apiToken,
+        rate=float(os.environ.get("SCHEDULE_BOT_SEND_RATE", "25")),
+        shared=ScheduleAPI.shared,
+        shard=(worker_index, workers)
+    )
+    notifier.start(application)
+
+    Metrics.register_collector("schedule_cache", ScheduleAPI.schedule_cache.stats)
+    Metrics.register_collector("group_cache", ScheduleAPI.group_cache.stats)
+    Metrics.register_collector("notifier", notifier.stats)
+    Metrics.register_collector("teacher_index", ScheduleAPI.teacher_index.stats)
+    Metrics.register_collector("room_occupancy", ScheduleAPI.room_occupancy.stats)
+    if ScheduleAPI.calendar is not None:
+        Metrics.register_collector("calendar", ScheduleAPI.calendar.stats)
+    metrics_port: Optional[str] = os.environ.get("SCHEDULE_BOT_METRICS_PORT")
+    if metrics_port is not None:
+        # Every worker process serves its own metrics on the next port
+        await Metrics.start_server(
+            os.environ.get("SCHEDULE_BOT_METRICS_LISTEN", "127.0.0.1"),
+            int(metrics_port) + worker_index
+        )
+    # 0 disables logging, the /metrics endpoint is usually enough
+    metrics_log_interval: float = float(os.environ.get("SCHEDULE_BOT_METRICS_LOG_INTERVAL", "0"))
+    if metrics_log_interval > 0:
+        application.job_queue.run_repeating(log_metrics, metrics_log_interval, name="metrics")
+
+
+def refresh_imported() -> list[str]:
+    """Returns the groups whose imported lessons changed and that still have lessons."""
+    changed: dict[str, list[dict]] = importedTimetable.refresh()
+    for group_code, lessons in changed.items():
+        ScheduleAPI.teacher_index.update_imported(group_code, lessons)
+        ScheduleAPI.room_occupancy.update_imported(group_code, lessons)
+        if ScheduleAPI.calendar is not None:
+            ScheduleAPI.calendar.update_imported(group_code, lessons)
+    if importedOverrides is not None:
+        for group_code, overrides in importedOverrides.refresh().items():
+            ScheduleAPI.calendar.update_overrides(group_code, overrides)
+    return [group_code for group_code, lessons in changed.items() if lessons]
+
+
+async def refresh_imported_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    try:
+        changed: list[str] = refresh_imported()
+    except ValueError as error:
+        # The bot keeps what it had, a broken file on startup fails post_init() instead
+        logger.error("Could not read imported lessons: %s", error)
+        return
+    # Every group is new to the first refresh in post_init(), only those of a later import are news to subscribers
+    if notifier is not None:
+        notifier.notify_changed(changed)
+
+
+async def log_metrics(context: ContextTypes.DEFAULT_TYPE) -> None:
+    Metrics.log_summary()
 
-    if len(sys.argv) <= 2:
-        print("No API token specified.")
-    else:
-        global apiToken
-        apiToken = sys.argv[2]
 
-    defaults = Defaults(
+async def post_shutdown(application: Application) -> None:
+    errorReporter.cancel()
+    if notifier is not None:
+        notifier.stop()
+    await Metrics.stop_server()
+    ScheduleAPI.prefetcher.cancel_all()
+    await ScheduleAPI.close_client()
+    if ScheduleAPI.shared is not None:
+        await ScheduleAPI.shared.close()
+        ScheduleAPI.shared = None
+    if ScheduleAPI.storage is not None:
+        ScheduleAPI.storage.close()
+        ScheduleAPI.storage = None
+
+
+def bot_defaults() -> Defaults:
+    return Defaults(
         parse_mode=ParseMode.HTML,
         disable_notification=True,
         disable_web_page_preview=True,
@@ -198,24 +766,122 @@ def main() -> None:
         tzinfo=pytz.timezone('Europe/Kiev')
     )
 
-    application = Application.builder().token(bot_token).defaults(defaults).build()
 
+def register_handlers(application: Application) -> None:
     application.add_handler(CommandHandler("start", start_command))
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("te", schedule_command))
     application.add_handler(CommandHandler("te_t", tomorrow_schedule_command))
+    application.add_handler(CommandHandler("week", week_schedule_command))
+    application.add_handler(CommandHandler("refresh", refresh_command))
+    application.add_handler(CommandHandler("cache_stats", cache_stats_command))
+    application.add_handler(CommandHandler("subscribe", subscribe_command))
+    application.add_handler(CommandHandler("remind", remind_command))
+    application.add_handler(CommandHandler("unsubscribe", unsubscribe_command))
+    application.add_handler(CommandHandler("teacher", teacher_command))
+    application.add_handler(CommandHandler("free_rooms", free_rooms_command))
 
     application.add_handler(MessageHandler(filters.StatusUpdate.WEB_APP_DATA, web_app_data))
+    application.add_handler(InlineQueryHandler(inline_query_handler))
 
     application.add_handler(CallbackQueryHandler(
         update_schedule_callback,
         pattern=r"^UPDATE_SCHEDULE\|\d{2}.\d{2}.\d{4}\|.*$"
     ))
+    application.add_handler(CallbackQueryHandler(
+        week_schedule_callback,
+        pattern=r"^WEEK_SCHEDULE\|\d{2}.\d{2}.\d{4}\|.*$"
+    ))
 
     application.add_error_handler(error_handler)
 
+
+def telegram_base_urls() -> dict[str, str]:
+    """base_url and base_file_url of a local Bot API server, if SCHEDULE_BOT_TELEGRAM_URL points to one."""
+    telegram_url: Optional[str] = os.environ.get("SCHEDULE_BOT_TELEGRAM_URL")
+    if telegram_url is None:
+        return {}
+    return {"base_url": f"{telegram_url.rstrip('/')}/bot", "base_file_url": f"{telegram_url.rstrip('/')}/file/bot"}
+
+
+def build_application(bot_token: str, bot: Optional[ExtBot] = None, updater: bool = True) -> Application:
+    """Build the application with every handler registered.
+
+    bot replaces the one built from bot_token, it must carry bot_defaults() itself. Such an application, like one
+    built with updater=False, has no updater: updates are passed to process_update() or put into update_queue.
+    """
+    builder: ApplicationBuilder = (
+        Application.builder()
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        # Updates of different chats are processed concurrently, those of one chat in order
+        .concurrent_updates(ChatOrderedUpdateProcessor(int(os.environ.get("SCHEDULE_BOT_CONCURRENT_UPDATES", "64"))))
+    )
+    if bot is None:
+        builder = builder.token(bot_token).defaults(bot_defaults())
+        base_urls: dict[str, str] = telegram_base_urls()
+        if base_urls:
+            builder = builder.base_url(base_urls["base_url"]).base_file_url(base_urls["base_file_url"])
+        if not updater:
+            builder = builder.updater(None)
+    else:
+        builder = builder.bot(bot).updater(None)
+    application: Application = builder.build()
+    register_handlers(application)
+    return application
+
+
+def main() -> None:
+    bot_token: str = sys.argv[1]
+    global baseUrl
+    baseUrl = os.environ.get("SCHEDULE_BOT_URL_BASE", "https://api.crwnd.dev/schedule/violet")
+
+    if len(sys.argv) <= 2:
+        print("No API token specified.")
+    else:
+        global apiToken
+        apiToken = sys.argv[2]
+
+    # A worker process started by the front below, it gets its share of the updates over a socket
+    worker_socket: Optional[str] = os.environ.get("SCHEDULE_BOT_WORKER_SOCKET")
+    if worker_socket is not None:
+        asyncio.run(Sharding.serve_worker(build_application(bot_token, updater=False), worker_socket))
+        return
+
     # Run the bot until the user presses Ctrl-C
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    webhook_url: Optional[str] = os.environ.get("SCHEDULE_BOT_WEBHOOK_URL")
+    workers: int = int(os.environ.get("SCHEDULE_BOT_WORKERS", "1"))
+    if webhook_url is None:
+        build_application(bot_token).run_polling(allowed_updates=ALLOWED_UPDATES)
+        return
+
+    url_path: str = os.environ.get("SCHEDULE_BOT_WEBHOOK_PATH", "telegram")
+    if workers > 1:
+        if not asyncio.run(Sharding.run_front(
+                Bot(bot_token, **telegram_base_urls()),
+                workers,
+                sys.argv,
+                listen=os.environ.get("SCHEDULE_BOT_WEBHOOK_LISTEN", "127.0.0.1"),
+                port=int(os.environ.get("SCHEDULE_BOT_WEBHOOK_PORT", "8443")),
+                url_path=url_path,
+                webhook_url=f"{webhook_url.rstrip('/')}/{url_path}",
+                secret_token=os.environ.get("SCHEDULE_BOT_WEBHOOK_SECRET"),
+                allowed_updates=ALLOWED_UPDATES,
+                max_connections=int(os.environ.get("SCHEDULE_BOT_WEBHOOK_MAX_CONNECTIONS", "40"))
+        )):
+            sys.exit(1)
+        return
+
+    application: Application = build_application(bot_token)
+    application.run_webhook(
+        listen=os.environ.get("SCHEDULE_BOT_WEBHOOK_LISTEN", "127.0.0.1"),
+        port=int(os.environ.get("SCHEDULE_BOT_WEBHOOK_PORT", "8443")),
+        url_path=url_path,
+        webhook_url=f"{webhook_url.rstrip('/')}/{url_path}",
+        secret_token=os.environ.get("SCHEDULE_BOT_WEBHOOK_SECRET"),
+        allowed_updates=ALLOWED_UPDATES,
+        max_connections=int(os.environ.get("SCHEDULE_BOT_WEBHOOK_MAX_CONNECTIONS", "40"))
+    )
 
 
 if __name__ == "__main__":
@@ -1,8 +1,25 @@
-from typing import Tuple
+from typing import TYPE_CHECKING, Iterator, Optional, Sequence, Tuple
 
-import tabula
-import pandas
-import re
+import hashlib
+import importlib.util
+
+# pandas is imported where tables are built, so that the lesson classes are cheap to import
+if TYPE_CHECKING:
+    import pandas
+
+from cell_classifier import (
+    FIRST_LESSON_ROW,
+    classify_page,
+    is_english_name,
+    normalize_lesson_type,
+    normalize_teacher_type
+)
+
+# Lattice detection: cells are delimited by the ruling lines drawn in the PDF
+LATTICE_SETTINGS: dict = {
+    "vertical_strategy": "lines",
+    "horizontal_strategy": "lines"
+}
 
 
 class Lesson:
@@ -21,6 +38,16 @@ class Lesson:
         # Default value
         self.subgroup = 0
 
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__ if hasattr(self, name)}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Lesson":
+        lesson: Lesson = cls()
+        for name, value in data.items():
+            setattr(lesson, name, value)
+        return lesson
+
 
 class APILesson:
     __slots__ = [
@@ -56,91 +83,208 @@ class APILesson:
     recordings: list[str]
     subgroup: int
 
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
 
-def schedule_pdf_to_list(filepath: str, pages: range) -> list[APILesson]:
-    # Read pdf into list of DataFrame
-    dfs = tabula.read_pdf(filepath, pages='all', lattice=True)
+    @classmethod
+    def from_dict(cls, data: dict) -> "APILesson":
+        api_lesson: APILesson = cls()
+        for name in cls.__slots__:
+            setattr(api_lesson, name, data[name])
+        return api_lesson
 
-    lessons_list: list[list[Lesson]] = []
 
-    page: pandas.DataFrame
-    lesson: Lesson
-    lesson_data: Tuple
-    column: Tuple[int, pandas.Series]
-    for index, page in enumerate(dfs):
-        if pages is not None and index not in pages:
-            continue
-        lessons_list.append([])
-        for lesson_num in range(0, 36):
-            lesson = Lesson()
-            lesson.lesson_number = lesson_num % 6
-            lessons_list[-1].append(lesson)
+def read_pdf_pages(
+        filepath: str,
+        pages: Optional[range],
+        backend: str = "auto"
+) -> Iterator[Tuple[int, "pandas.DataFrame"]]:
+    """Lazily yield (page index, timetable) for the requested pages, one timetable per page.
+
+    backend is "pdfplumber", "tabula" or "auto", which prefers pdfplumber when it is installed.
+    """
+    if backend == "auto":
+        backend = "pdfplumber" if importlib.util.find_spec("pdfplumber") is not None else "tabula"
+
+    match backend:
+        case "pdfplumber":
+            return _read_pdf_pages_pdfplumber(filepath, pages)
+        case "tabula":
+            return _read_pdf_pages_tabula(filepath, pages)
+        case _:
+            raise ValueError(f"Unknown PDF backend: {backend}")
+
+
+def _read_pdf_pages_pdfplumber(filepath: str, pages: Optional[range]) -> Iterator[Tuple[int, "pandas.DataFrame"]]:
+    import pdfplumber
 
-        # iterate over columns of the page
-        row: pandas.Series
-        for row in page.itertuples():
-            if row.Index < 2:
+    with pdfplumber.open(filepath) as pdf:
+        page_count: int = len(pdf.pages)
+        for index in (range(page_count) if pages is None else pages):
+            if index >= page_count:
+                break
+            page = pdf.pages[index]
+            tables: list[list[list[Optional[str]]]] = page.extract_tables(LATTICE_SETTINGS)
+            # Free the parsed layout, only the table is needed from here on
+            page.close()
+            if tables:
+                yield index, _table_to_dataframe(tables[0])
+
+
+def read_pdf_pages_fingerprinted(
+        filepath: str,
+        pages: Optional[range],
+        unchanged: dict[int, str],
+        backend: str = "auto"
+) -> Iterator[Tuple[int, str, Optional["pandas.DataFrame"]]]:
+    """Like read_pdf_pages, but also yield a fingerprint of every page.
+
+    A page whose fingerprint equals unchanged[index] is yielded with None instead of its timetable.
+    The pdfplumber backend fingerprints the page content stream and skips table extraction for such pages,
+    tabula can only fingerprint the extracted table.
+    """
+    if backend == "auto":
+        backend = "pdfplumber" if importlib.util.find_spec("pdfplumber") is not None else "tabula"
+
+    match backend:
+        case "pdfplumber":
+            return _read_pdf_pages_pdfplumber_fingerprinted(filepath, pages, unchanged)
+        case "tabula":
+            return _read_pdf_pages_tabula_fingerprinted(filepath, pages, unchanged)
+        case _:
+            raise ValueError(f"Unknown PDF backend: {backend}")
+
+
+def _fingerprint(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def _read_pdf_pages_pdfplumber_fingerprinted(
+        filepath: str,
+        pages: Optional[range],
+        unchanged: dict[int, str]
+) -> Iterator[Tuple[int, str, Optional["pandas.DataFrame"]]]:
+    import pdfplumber
+    from pdfminer.pdftypes import resolve1
+
+    with pdfplumber.open(filepath) as pdf:
+        page_count: int = len(pdf.pages)
+        for index in (range(page_count) if pages is None else pages):
+            if index >= page_count:
+                break
+            page = pdf.pages[index]
+            # The drawing instructions of the page, hashing them is much cheaper than laying the page out
+            fingerprint: str = _fingerprint(b''.join(resolve1(stream).get_data() for stream in page.page_obj.contents))
+            if unchanged.get(index) == fingerprint:
+                yield index, fingerprint, None
                 continue
-            for ind, value in enumerate(row):
-                if (ind not in range(3, 7)) or pandas.isna(value):
-                    continue
-                matches = re.findall(
-                    # Хай горить у пеклі, той хто робив цей розклад і додумався пихати латинські букви в українські слова
-                    # Нормальний вигляд: r"^(.*?)\r?(\d{1,2}\. \d{3}\w?)?\r?(Лабораторна|Практичне|Лекція)\r?(.*?)\r?([A-ZА-ЯІЇЄ].*? .?\..?\.)$
-                    r"^(.*?)\r?(\d{1,2}\. \d{3}\w?)?\r?(Л(?:а|a)б(?:о|o)(?:р|p)(?:а|a)т(?:о|o)(?:р|p)н(?:а|a)|П(?:р|p)(?:а|a)ктичн(?:е|e)|Л(?:е|e)кц(?:і|i)я)\r?(.*?)\r?([A-ZА-ЯІЇЄ].*? .?\..?\.)$",
-                    value
-                )
-                if len(matches):
-                    lesson = Lesson()
-                    lesson.name = matches[0][0]
-                    lesson.place = matches[0][1] if matches[0][1] is not None else "Відсутнє"
-                    lesson.lesson_type = matches[0][2]
-                    lesson.teacher_type = matches[0][3]
-                    lesson.teacher = matches[0][4]
-                    lesson.subgroup = 1 if ind <= 3 else 2
-                    lesson.week = 1 if index % 2 == 0 else 2
-                    lesson.day = (row.Index - 2) // 6
-                    lesson.lesson_number = (row.Index - 2) % 6
-                    lessons_list[-1].append(lesson)
-                else:
-                    lesson = lessons_list[-1][row.Index - 2]
-                    match ind:
-                        case 3:
-                            lesson.name = value
-                            lesson.week = 1 if index % 2 == 0 else 2
-                            lesson.day = (row.Index - 2) // 6
-                            lesson.lesson_number = (row.Index - 2) % 6
-                        case 4:
-                            lesson.place = value
-                        case 5:
-                            data = value.split('\r')
-                            lesson.lesson_type = data[0]
-                            lesson.teacher_type = data[1]
-                        case 6:
-
-                            lesson.teacher = value
-
-    # merge all lists into one if lesson has attribute name
-    computed_lessons_list: list[Lesson] = [
-        lesson for lessons in lessons_list for lesson in lessons if hasattr(lesson, "name")
+            tables: list[list[list[Optional[str]]]] = page.extract_tables(LATTICE_SETTINGS)
+            page.close()
+            if tables:
+                yield index, fingerprint, _table_to_dataframe(tables[0])
+
+
+def _read_pdf_pages_tabula_fingerprinted(
+        filepath: str,
+        pages: Optional[range],
+        unchanged: dict[int, str]
+) -> Iterator[Tuple[int, str, Optional["pandas.DataFrame"]]]:
+    for index, page in _read_pdf_pages_tabula(filepath, pages):
+        fingerprint: str = _fingerprint(page.to_csv().encode())
+        yield index, fingerprint, None if unchanged.get(index) == fingerprint else page
+
+
+def _table_to_dataframe(table: list[list[Optional[str]]]) -> "pandas.DataFrame":
+    import pandas
+
+    # Mimic tabula's output: the first row is the header, line breaks inside cells are '\r', empty cells are NaN
+    rows: list[list[Optional[str]]] = [
+        [cell.replace('\n', '\r') if cell else None for cell in row] for row in table
     ]
+    return pandas.DataFrame(rows[1:], columns=rows[0])
+
+
+def _read_pdf_pages_tabula(filepath: str, pages: Optional[range]) -> Iterator[Tuple[int, "pandas.DataFrame"]]:
+    import tabula
+
+    if pages is None:
+        yield from enumerate(tabula.read_pdf(filepath, pages='all', lattice=True))
+        return
+    indices: list[int] = sorted(pages)
+    yield from zip(indices, tabula.read_pdf(filepath, pages=[index + 1 for index in indices], lattice=True))
+
+
+def schedule_pdf_to_list(
+        filepath: str,
+        pages: Optional[range],
+        backend: str = "auto",
+        group_code: str = "ІП-94",
+        start_date: Sequence[int] = (2023, 9, 1),
+        end_date: Sequence[int] = (2023, 12, 22)
+) -> list[APILesson]:
+    computed_lessons_list: list[Lesson] = []
+    page: "pandas.DataFrame"
+    for index, page in read_pdf_pages(filepath, pages, backend):
+        computed_lessons_list += extract_page_lessons(index, page)
+    return lessons_to_api(computed_lessons_list, group_code, start_date, end_date)
 
+
+def extract_page_lessons(index: int, page: "pandas.DataFrame") -> list[Lesson]:
+    lessons_list: list[Lesson] = []
+    lesson: Lesson
+    for lesson_num in range(0, 36):
+        lesson = Lesson()
+        lesson.lesson_number = lesson_num % 6
+        lessons_list.append(lesson)
+
+    row_label: int
+    column: int
+    value: str
+    fields: Optional[Tuple[str, str, str, str, str]]
+    for row_label, column, value, fields in classify_page(page):
+        row_index: int = row_label - FIRST_LESSON_ROW
+        if fields is not None:
+            lesson = Lesson()
+            lesson.name, lesson.place, lesson.lesson_type, lesson.teacher_type, lesson.teacher = fields
+            lesson.subgroup = 1 if column == 0 else 2
+            lesson.week = 1 if index % 2 == 0 else 2
+            lesson.day = row_index // 6
+            lesson.lesson_number = row_index % 6
+            lessons_list.append(lesson)
+        else:
+            lesson = lessons_list[row_index]
+            match column:
+                case 0:
+                    lesson.name = value
+                    lesson.week = 1 if index % 2 == 0 else 2
+                    lesson.day = row_index // 6
+                    lesson.lesson_number = row_index % 6
+                case 1:
+                    lesson.place = value
+                case 2:
+                    data = value.split('\r')
+                    lesson.lesson_type = data[0]
+                    lesson.teacher_type = data[1]
+                case 3:
+                    lesson.teacher = value
+
+    # keep only the lessons that were filled in
+    return [lesson for lesson in lessons_list if hasattr(lesson, "name")]
+
+
+def lessons_to_api(
+        computed_lessons_list: list[Lesson],
+        group_code: str,
+        start_date: Sequence[int],
+        end_date: Sequence[int]
+) -> list[APILesson]:
     has_subgroups: bool = False
 
     for lesson in computed_lessons_list:
-        lesson.lesson_type = lesson.lesson_type.replace('a', 'а').replace('o', 'о').replace('і', 'i').replace('e', 'е').\
-            replace('p', 'р')
+        lesson.lesson_type = normalize_lesson_type(lesson.lesson_type)
         lesson.place = lesson.place.replace(' ', '')
-        lesson.teacher_type.strip()
         # Fix for the teacher type. Just in case
-        if re.match(r'^Проф', lesson.teacher_type):
-            lesson.teacher_type = "Професор"
-        elif re.match(r'^Доц', lesson.teacher_type):
-            lesson.teacher_type = "Доцент"
-        elif re.match(r'^Старш', lesson.teacher_type):
-            lesson.teacher_type = "Старший викладач"
-        elif re.match(r'^Асист', lesson.teacher_type):
-            lesson.teacher_type = "Асистент"
+        lesson.teacher_type = normalize_teacher_type(lesson.teacher_type)
         if lesson.subgroup != 0:
             has_subgroups = True
 
@@ -148,8 +292,7 @@ def schedule_pdf_to_list(filepath: str, pages: range) -> list[APILesson]:
 
     for lesson in computed_lessons_list:
         api_lesson: APILesson = APILesson()
-        # Gotta change this
-        api_lesson.group_code = "ІП-94"
+        api_lesson.group_code = group_code
         match lesson.lesson_number:
             case 0:
                 api_lesson.time = 480
@@ -165,14 +308,13 @@ def schedule_pdf_to_list(filepath: str, pages: range) -> list[APILesson]:
                 api_lesson.time = 1030
         api_lesson.day_number = lesson.day
         api_lesson.week_number = lesson.week
-        api_lesson.start_date = [2023, 9, 1]
-        api_lesson.end_date = [2023, 12, 22]
+        api_lesson.start_date = list(start_date)
+        api_lesson.end_date = list(end_date)
         # Gotta change this
         api_lesson.template = "1"
         # Gotta change this
         api_lesson.lecturers = [lesson.teacher]
-        # Check if it's an english name
-        if re.match(r'^(?:[A-z]|\s)*$', lesson.name[0]):
+        if is_english_name(lesson.name):
             api_lesson.names = ["", lesson.name]
         else:
             api_lesson.names = [lesson.name, ""]
@@ -0,0 +1,168 @@
+import hashlib
+import json
+import os
+from collections import Counter
+from typing import TYPE_CHECKING, Iterator, Optional, Sequence, Tuple
+
+import parser
+
+if TYPE_CHECKING:
+    import pandas
+
+# group code, week, day, time, subgroup: lessons sharing a slot are compared with each other
+SlotKey = Tuple[str, int, int, int, int]
+
+
+def lesson_fingerprint(lesson: dict) -> str:
+    return hashlib.blake2b(
+        json.dumps(lesson, ensure_ascii=False, sort_keys=True).encode(),
+        digest_size=16
+    ).hexdigest()
+
+
+def lesson_slot(lesson: dict) -> SlotKey:
+    return lesson["group_code"], lesson["week_number"], lesson["day_number"], lesson["time"], lesson["subgroup"]
+
+
+class LessonDiff:
+    """Lessons added, removed and changed between two imports of the same timetable."""
+    __slots__ = ["added", "removed", "changed"]
+    added: list[dict]
+    removed: list[dict]
+    changed: list[Tuple[dict, dict]]
+
+    def __init__(self, previous: list[dict], current: list[dict]):
+        self.added = []
+        self.removed = []
+        self.changed = []
+
+        previous_slots: dict[SlotKey, list[dict]] = _group_by_slot(previous)
+        current_slots: dict[SlotKey, list[dict]] = _group_by_slot(current)
+        for slot in previous_slots.keys() | current_slots.keys():
+            previous_lessons, current_lessons = _drop_unchanged(
+                previous_slots.get(slot, []),
+                current_slots.get(slot, [])
+            )
+            # Whatever is left in the same slot on both sides is an edit of a lesson rather than a new one
+            self.changed += zip(previous_lessons, current_lessons)
+            self.removed += previous_lessons[len(current_lessons):]
+            self.added += current_lessons[len(previous_lessons):]
+
+    def __len__(self):
+        return len(self.added) + len(self.removed) + len(self.changed)
+
+    def records(self) -> Iterator[dict]:
+        for lesson in self.added:
+            yield {"change": "added", "lesson": lesson}
+        for lesson in self.removed:
+            yield {"change": "removed", "lesson": lesson}
+        for previous, current in self.changed:
+            yield {"change": "changed", "lesson": current, "previous": previous}
+
+
+def _group_by_slot(lessons: list[dict]) -> dict[SlotKey, list[dict]]:
+    slots: dict[SlotKey, list[dict]] = {}
+    for lesson in lessons:
+        slots.setdefault(lesson_slot(lesson), []).append(lesson)
+    return slots
+
+
+def _drop_unchanged(previous: list[dict], current: list[dict]) -> Tuple[list[dict], list[dict]]:
+    previous_fingerprints: list[str] = [lesson_fingerprint(lesson) for lesson in previous]
+    current_fingerprints: list[str] = [lesson_fingerprint(lesson) for lesson in current]
+    common: Counter = Counter(previous_fingerprints) & Counter(current_fingerprints)
+    return _without(previous, previous_fingerprints, common.copy()), _without(current, current_fingerprints, common)
+
+
+def _without(lessons: list[dict], fingerprints: list[str], common: Counter) -> list[dict]:
+    left: list[dict] = []
+    for lesson, fingerprint in zip(lessons, fingerprints):
+        if common[fingerprint] > 0:
+            common[fingerprint] -= 1
+        else:
+            left.append(lesson)
+    return left
+
+
+class ImportState:
+    """What the previous import of one timetable left behind, stored as a JSON file.
+
+    For every page: its fingerprint and the lessons parsed from it before normalization.
+    Also the resulting APILesson dicts, which the next import is diffed against.
+    """
+    __slots__ = ["path", "pages", "lessons"]
+    path: str
+    pages: dict[int, Tuple[str, list[dict]]]
+    lessons: list[dict]
+
+    def __init__(self, path: str):
+        self.path = path
+        self.pages = {}
+        self.lessons = []
+        if not os.path.exists(path):
+            return
+        with open(path, encoding="utf-8") as state_file:
+            data: dict = json.load(state_file)
+        self.pages = {int(index): (page["fingerprint"], page["lessons"]) for index, page in data["pages"].items()}
+        self.lessons = data["lessons"]
+
+    def fingerprints(self) -> dict[int, str]:
+        return {index: fingerprint for index, (fingerprint, _) in self.pages.items()}
+
+    def save(self) -> None:
+        data: dict = {
+            "pages": {
+                str(index): {"fingerprint": fingerprint, "lessons": lessons}
+                for index, (fingerprint, lessons) in self.pages.items()
+            },
+            "lessons": self.lessons
+        }
+        # Written aside and renamed, so that an interrupted import leaves the previous state intact
+        temporary_path: str = self.path + ".tmp"
+        with open(temporary_path, "w", encoding="utf-8") as state_file:
+            json.dump(data, state_file, ensure_ascii=False)
+        os.replace(temporary_path, self.path)
+
+
+def reimport(
+        filepath: str,
+        pages: Optional[range],
+        state: ImportState,
+        backend: str = "auto",
+        group_code: str = "ІП-94",
+        start_date: Sequence[int] = (2023, 9, 1),
+        end_date: Sequence[int] = (2023, 12, 22)
+) -> Tuple[LessonDiff, int]:
+    """Parse the PDF again, reusing the previous parse of unchanged pages, and update state.
+
+    Returns the diff against the previous import and the number of pages that were not parsed again.
+    """
+    new_pages: dict[int, Tuple[str, list[dict]]] = {}
+    computed_lessons_list: list[parser.Lesson] = []
+    skipped: int = 0
+    index: int
+    fingerprint: str
+    page: Optional["pandas.DataFrame"]
+    for index, fingerprint, page in parser.read_pdf_pages_fingerprinted(
+            filepath,
+            pages,
+            state.fingerprints(),
+            backend
+    ):
+        if page is None:
+            skipped += 1
+            page_lessons: list[dict] = state.pages[index][1]
+        else:
+            page_lessons = [lesson.to_dict() for lesson in parser.extract_page_lessons(index, page)]
+        new_pages[index] = (fingerprint, page_lessons)
+        computed_lessons_list += [parser.Lesson.from_dict(lesson) for lesson in page_lessons]
+
+    lessons: list[dict] = [
+        lesson.to_dict()
+        for lesson in parser.lessons_to_api(computed_lessons_list, group_code, start_date, end_date)
+    ]
+    diff: LessonDiff = LessonDiff(state.lessons, lessons)
+    state.pages = new_pages
+    state.lessons = lessons
+    state.save()
+    return diff, skipped